@@ -0,0 +1,123 @@
+""" An asyncio interface to analitico.ai/api which runs the blocking calls of AnaliticoSDK on a pool of threads """
+
+import asyncio
+import functools
+import concurrent.futures
+import pandas as pd
+
+from analitico.sdk import AnaliticoSDK, SDK_POOL_SIZE
+from analitico.models import Item, Workspace
+
+# size of the chunks yielded when streaming downloads
+ASYNC_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+
+class AsyncAnaliticoSDK:
+    """
+    An asyncio version of AnaliticoSDK for notebooks and scripts that retrieve or upload many items
+    or files at once. Methods mirror those of AnaliticoSDK and Item but are coroutines which can be
+    awaited concurrently, eg. with asyncio.gather. Returned items are regular items bound to the underlying sdk.
+
+    This is not an asynchronous http client: calls are made with the blocking, pooled and retrying
+    requests session of a regular AnaliticoSDK on a pool of max_concurrency threads. Concurrency is
+    capped by the pool, at most max_concurrency calls are in flight and additional calls wait for a
+    free thread. Each call holds its thread until it returns, so a download or upload holds one for its
+    whole duration. Streams read each chunk on a pool thread and keep one of the pooled connections
+    until they are closed. Use a larger max_concurrency for many slow transfers.
+    """
+
+    def __init__(
+        self, token=None, endpoint=None, workspace_id: str = None, max_concurrency: int = SDK_POOL_SIZE, **kwargs
+    ):
+        assert max_concurrency > 0
+        # connection pool is sized so that each concurrent call has its own keep-alive connection
+        self.sdk = AnaliticoSDK(
+            token=token, endpoint=endpoint, workspace_id=workspace_id, pool_size=max_concurrency, **kwargs
+        )
+        self.max_concurrency = max_concurrency
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="analitico_sdk"
+        )
+
+    async def _run(self, func, *args, **kwargs):
+        """ Runs a blocking call on the sdk's pool of threads """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    ##
+    ## with AsyncAnaliticoSDK as: lifecycle methods
+    ##
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Waits for pending calls, then releases threads and pooled connections """
+        self._executor.shutdown(wait=True)
+        self.sdk.close()
+
+    ##
+    ## Items
+    ##
+
+    async def create_item(self, item_type: str, workspace: Workspace = None, **kwargs) -> Item:
+        return await self._run(self.sdk.create_item, item_type, workspace, **kwargs)
+
+    async def get_items(self, item_type: str) -> [Item]:
+        return await self._run(self.sdk.get_items, item_type)
+
+    async def get_item(self, item_id: str) -> Item:
+        return await self._run(self.sdk.get_item, item_id)
+
+    async def get_workspace(self, workspace_id: str = None) -> Workspace:
+        return await self._run(self.sdk.get_workspace, workspace_id)
+
+    ##
+    ## Files
+    ##
+
+    async def upload(
+        self, item: Item, filepath: str = None, df: pd.DataFrame = None, remotepath: str = None, direct: bool = True
+    ) -> bool:
+        """ Uploads a file or dataframe to the storage of the given item, see Item.upload """
+        return await self._run(item.upload, filepath=filepath, df=df, remotepath=remotepath, direct=direct)
+
+    async def download(self, item: Item, remotepath: str, filepath: str = None, binary: bool = True, df: str = None):
+        """ Downloads a file of the given item to a file or a dataframe, see Item.download """
+        return await self._run(item.download, remotepath, filepath=filepath, binary=binary, df=df)
+
+    async def stream(self, item: Item, remotepath: str, chunk_size: int = ASYNC_CHUNK_SIZE):
+        """
+        Asynchronous generator yielding chunks of a file of the given item as they are downloaded.
+        Chunks are read from a blocking stream on the pool's threads one at a time.
+        """
+        url = item.url + "/files/" + remotepath
+        stream = self.sdk.get_url_stream(url, chunk_size=chunk_size)
+        try:
+            while True:
+                chunk = await self._run(next, stream, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            stream.close()
+
+    async def gather_downloads(self, downloads: list) -> list:
+        """
+        Downloads many files to disk concurrently.
+
+        Arguments:
+            downloads {list} -- A list of (item, remotepath, filepath) tuples.
+
+        Returns:
+            list -- The filepaths of the downloaded files in the same order as the downloads.
+        """
+
+        async def _download(item, remotepath, filepath):
+            await self.download(item, remotepath, filepath=filepath)
+            return filepath
+
+        return await asyncio.gather(*[_download(*download) for download in downloads])
@@ -0,0 +1,318 @@
+""" A disk cache of downloaded files with a size budget, eviction and hit statistics """
+
+import io
+import os
+import os.path
+import time
+import sqlite3
+import hashlib
+import threading
+
+from analitico import logger
+from analitico.utilities import id_generator
+
+# size budget of the disk cache in bytes
+CACHE_MAX_SIZE = int(os.environ.get("ANALITICO_CACHE_MAX_SIZE", 8 * 1024 * 1024 * 1024))  # 8 GiBs
+
+# eviction policy used when the cache exceeds its size budget, lru or lfu
+CACHE_EVICTION_POLICY = os.environ.get("ANALITICO_CACHE_EVICTION_POLICY", "lru")
+
+# read streams in chunks when writing them to the cache
+CACHE_BUFFER_SIZE = 1024 * 1024  # 1 MiB
+
+# sqlite database with the index of cached files, kept in the cache directory
+CACHE_INDEX_FILENAME = "cache_index.sqlite"
+
+# seconds to wait on the index when another process is writing it
+CACHE_INDEX_TIMEOUT = 60
+
+CACHE_EVICTION_POLICIES = {
+    "lru": "accessed_at ASC",
+    "lfu": "hits ASC, accessed_at ASC",
+}
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    filename TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tags (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class DiskCache:
+    """
+    A content addressed cache of files stored in a directory. Files are named after a hash of
+    their unique id (eg: an url plus etag, an asset's hash, etc) and are tracked in a sqlite index
+    with their size, last access time and number of hits. When the total size of the cached files
+    exceeds the cache's budget, the least recently used (lru) or least frequently used (lfu) files
+    are removed. Files are written to a temporary file and then renamed into place while the index
+    is updated in sqlite transactions so multiple processes can safely share the same directory.
+    Cached files should be treated as read only.
+    """
+
+    def __init__(self, directory: str, max_size: int = CACHE_MAX_SIZE, policy: str = CACHE_EVICTION_POLICY):
+        assert max_size > 0
+        if policy not in CACHE_EVICTION_POLICIES:
+            raise ValueError(f"DiskCache - unknown eviction policy: {policy}")
+        self.directory = directory
+        self.max_size = max_size
+        self.policy = policy
+        self._local = threading.local()
+        os.makedirs(directory, exist_ok=True)
+        self._get_connection().executescript(CACHE_SCHEMA)
+
+    ##
+    ## Index
+    ##
+
+    def _get_connection(self):
+        """ Returns a connection to the sqlite index, connections are not shared across threads """
+        db = getattr(self._local, "db", None)
+        if db is None:
+            index_path = os.path.join(self.directory, CACHE_INDEX_FILENAME)
+            db = sqlite3.connect(index_path, timeout=CACHE_INDEX_TIMEOUT, isolation_level=None)
+            self._local.db = db
+        return db
+
+    class _Transaction:
+        """ Context manager running statements in a write transaction which locks the index across processes """
+
+        def __init__(self, db):
+            self.db = db
+
+        def __enter__(self):
+            self.db.execute("BEGIN IMMEDIATE")
+            return self.db
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+            return False
+
+    def _transaction(self):
+        return DiskCache._Transaction(self._get_connection())
+
+    def _increment_stat(self, db, name, value=1):
+        db.execute("INSERT OR IGNORE INTO stats (name, value) VALUES (?, 0)", (name,))
+        db.execute("UPDATE stats SET value = value + ? WHERE name = ?", (value, name))
+
+    ##
+    ## Files
+    ##
+
+    def get_filename(self, unique_id: str) -> str:
+        """ Returns the fullpath in cache for an item with the given unique_id (eg: a unique url, an md5, etag, etc) """
+        # Tip: if cache contents need to be invalidated for whatever reason, you can change the prefix below...
+        return os.path.join(self.directory, "cache_v2_" + hashlib.sha256(unique_id.encode()).hexdigest())
+
+    def get(self, unique_id: str) -> str:
+        """ Returns the path of the cached file with the given unique_id or None if it is not in cache """
+        filename = self.get_filename(unique_id)
+        basename = os.path.basename(filename)
+        with self._transaction() as db:
+            if not os.path.isfile(filename):
+                db.execute("DELETE FROM entries WHERE filename = ?", (basename,))
+                self._increment_stat(db, "misses")
+                return None
+            now = time.time()
+            updated = db.execute(
+                "UPDATE entries SET accessed_at = ?, hits = hits + 1 WHERE filename = ?", (now, basename)
+            ).rowcount
+            if not updated:
+                # file was cached before the index was created or by an older version
+                db.execute(
+                    "INSERT INTO entries (filename, size, created_at, accessed_at, hits) VALUES (?, ?, ?, ?, 1)",
+                    (basename, os.path.getsize(filename), now, now),
+                )
+            self._increment_stat(db, "hits")
+        return filename
+
+    def put(self, unique_id: str, stream) -> str:
+        """ Writes a stream or an iterator of bytes to the cache, returns the path of the cached file """
+        writer = self.open(unique_id)
+        try:
+            if hasattr(stream, "read"):
+                for chunk in iter(lambda: stream.read(CACHE_BUFFER_SIZE), b""):
+                    writer.write(chunk)
+            else:
+                for chunk in stream:
+                    writer.write(chunk)
+        except Exception:
+            writer.discard()
+            raise
+        return writer.commit()
+
+    def open(self, unique_id: str):
+        """ Returns a writer for a file that is added to the cache when the writer is committed """
+        return CacheWriter(self, self.get_filename(unique_id))
+
+    def add(self, filename: str):
+        """ Adds a file that was written to the cache directory to the index, then evicts files if needed """
+        basename = os.path.basename(filename)
+        now = time.time()
+        with self._transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO entries (filename, size, created_at, accessed_at, hits) VALUES (?, ?, ?, ?, 0)",
+                (basename, os.path.getsize(filename), now, now),
+            )
+            self._increment_stat(db, "writes")
+            self._evict(db, keep=basename)
+
+    def _evict(self, db, keep=None):
+        """ Removes files until the cache is within its size budget, the file just added is kept """
+        total_size = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total_size <= self.max_size:
+            return
+        order_by = CACHE_EVICTION_POLICIES[self.policy]
+        candidates = db.execute(f"SELECT filename, size FROM entries ORDER BY {order_by}").fetchall()
+        for basename, size in candidates:
+            if total_size <= self.max_size:
+                break
+            if basename == keep:
+                continue
+            try:
+                # readers that already opened the file can keep reading it after it is removed
+                os.remove(os.path.join(self.directory, basename))
+            except FileNotFoundError:
+                pass
+            db.execute("DELETE FROM entries WHERE filename = ?", (basename,))
+            self._increment_stat(db, "evictions")
+            total_size -= size
+            logger.debug(f"DiskCache - evicted {basename} ({size} bytes)")
+
+    def evict(self):
+        """ Removes files from the cache until it is within its size budget """
+        with self._transaction() as db:
+            self._evict(db)
+
+    def clear(self):
+        """ Removes all cached files and resets statistics """
+        with self._transaction() as db:
+            for (basename,) in db.execute("SELECT filename FROM entries").fetchall():
+                try:
+                    os.remove(os.path.join(self.directory, basename))
+                except FileNotFoundError:
+                    pass
+            db.execute("DELETE FROM entries")
+            db.execute("DELETE FROM stats")
+            db.execute("DELETE FROM tags")
+
+    def get_tag(self, key: str) -> str:
+        """ Returns a string value stored in the index with the given key, eg: the last known etag of an url """
+        row = self._get_connection().execute("SELECT value FROM tags WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_tag(self, key: str, value: str):
+        """ Stores a string value in the index with the given key """
+        with self._transaction() as db:
+            db.execute("INSERT OR REPLACE INTO tags (key, value) VALUES (?, ?)", (key, value))
+
+    @property
+    def stats(self) -> dict:
+        """ Returns size, number of files, hits, misses, hit rate and evictions of the cache across all processes """
+        db = self._get_connection()
+        count, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        stats = {"files": count, "size": size, "max_size": self.max_size, "policy": self.policy}
+        for name in ("hits", "misses", "writes", "evictions"):
+            stats[name] = 0
+        for name, value in db.execute("SELECT name, value FROM stats").fetchall():
+            stats[name] = value
+        requests = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / requests if requests else 0.0
+        return stats
+
+
+class CacheWriter:
+    """ Writes a file to a temporary path, then renames it into the cache and adds it to the index when committed """
+
+    def __init__(self, cache: DiskCache, filename: str):
+        self.cache = cache
+        self.filename = filename
+        self.temp_filename = filename + ".tmp_" + id_generator()
+        self._file = open(self.temp_filename, "wb")
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)
+
+    def commit(self) -> str:
+        """ Moves the file into the cache, returns the path of the cached file """
+        self._file.close()
+        # rename is atomic, concurrent writers of the same file will just replace each other's copy
+        os.replace(self.temp_filename, self.filename)
+        self.cache.add(self.filename)
+        return self.filename
+
+    def discard(self):
+        """ Removes the partially written file """
+        self._file.close()
+        if os.path.isfile(self.temp_filename):
+            os.remove(self.temp_filename)
+
+
+class TeeStream(io.RawIOBase):
+    """
+    A readable stream over an iterator of bytes, for example a streaming http response. While the stream
+    is read, its contents can be copied to a cache writer which is committed when the whole stream has been
+    read and discarded if the stream is closed before reaching its end. Wrap with io.BufferedReader
+    to read lines or arbitrary sizes efficiently.
+    """
+
+    def __init__(self, chunks, writer: CacheWriter = None, on_close=None):
+        super().__init__()
+        self._chunks = iter(chunks)
+        self._chunk = b""
+        self._offset = 0
+        self._writer = writer
+        self._on_close = on_close
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._offset >= len(self._chunk):
+            try:
+                self._chunk, self._offset = next(self._chunks), 0
+            except StopIteration:
+                if self._writer:
+                    self._writer.commit()
+                    self._writer = None
+                return 0
+            if self._writer:
+                self._writer.write(self._chunk)
+        size = min(len(b), len(self._chunk) - self._offset)
+        b[:size] = self._chunk[self._offset : self._offset + size]
+        self._offset += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            if self._writer:
+                self._writer.discard()
+                self._writer = None
+            if self._on_close:
+                self._on_close()
+        super().close()
+
+
+# disk caches are shared by all factories in the process using the same directory
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_disk_cache(directory: str) -> DiskCache:
+    """ Returns the disk cache for the given directory """
+    with _caches_lock:
+        if directory not in _caches:
+            _caches[directory] = DiskCache(directory)
+        return _caches[directory]
@@ -5,7 +5,6 @@ import requests
 import json
 import re
 import logging
-import hashlib
 import inspect
 import urllib.parse
 import io
@@ -18,11 +17,14 @@ from .status import STATUS_FAILED
 
 import analitico.utilities
 from analitico.dataset import Dataset
-from analitico.utilities import id_generator
+from analitico.cache import get_disk_cache, TeeStream
 
 # read http streams in chunks
 HTTP_BUFFER_SIZE = 32 * 1024 * 1024  # 32 MiBs
 
+# size of the chunks read from http responses while they are streamed to the caller
+HTTP_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
 
 class Factory(AttributeMixin):
     """ A base class providing runtime services like notebook and plugin creation, storage, network, etc """
@@ -107,10 +109,13 @@ class Factory(AttributeMixin):
             os.mkdir(cache_dir)
         return cache_dir
 
+    def get_cache(self):
+        """ Returns the disk cache used to store downloaded files, shared by factories using the same directory """
+        return get_disk_cache(self.get_cache_directory())
+
     def get_cache_filename(self, unique_id):
         """ Returns the fullpath in cache for an item with the given unique_id (eg: a unique url, an md5 or etag, etc) """
-        # Tip: if cache contents need to be invalidated for whatever reason, you can change the prefix below...
-        return os.path.join(self.get_cache_directory(), "cache_v2_" + hashlib.sha256(unique_id.encode()).hexdigest())
+        return self.get_cache().get_filename(unique_id)
 
     ##
     ## URL retrieval, authorization and caching
@@ -124,22 +129,12 @@ class Factory(AttributeMixin):
 
     def get_cached_stream(self, stream, unique_id):
         """ Will cache a stream on disk based on a unique_id (like md5 or etag) and return file stream and filename """
-        cache_file = self.get_cache_filename(unique_id)
-        if not os.path.isfile(cache_file):
+        cache = self.get_cache()
+        cache_file = cache.get(unique_id)
+        if not cache_file:
             # if not cached already, download and cache
-            cache_temp_file = cache_file + ".tmp_" + id_generator()
-
-            with open(cache_temp_file, "wb") as f:
-                if hasattr(stream, "read"):
-                    for chunk in iter(lambda: stream.read(HTTP_BUFFER_SIZE), b""):
-                        f.write(chunk)
-                else:
-                    for b in stream:
-                        f.write(b)
-
             # TODO add progress bar for slow downloads https://github.com/tqdm/tqdm#iterable-based
-
-            os.rename(cache_temp_file, cache_file)
+            cache_file = cache.put(unique_id, stream)
         # return stream from cached file
         return open(cache_file, "rb"), cache_file
 
@@ -148,6 +143,9 @@ class Factory(AttributeMixin):
         Returns a stream to the given url. This works for regular http:// or https://
         and also works for analitico:// assets which are converted to calls to the given
         endpoint with proper authorization tokens. The stream is returned as an iterator.
+        Http responses are streamed while they are downloaded. If the server sends an etag,
+        the response is also written to the cache as it is read and the next request for the
+        same url is sent with If-None-Match so that an unchanged file is read from the cache.
         """
         assert url and isinstance(url, str)
         # If the url uses the analitico:// scheme for assets stored on the cloud
@@ -173,19 +171,30 @@ class Factory(AttributeMixin):
                 # if url is connecting to analitico.ai add token
                 headers = {"Authorization": "Bearer " + self.token}
 
-            # we should not take the raw response stream here as it could be gzipped or encoded.
-            # we take the decoded content as a text string and turn it into a stream or we take the
-            # decompressed binary content and also turn it into a stream.
+            # if we have a cached copy of the url, ask the server to send it only if it has changed
+            cached_file = None
+            if cache:
+                etag = self.get_cache().get_tag(url)
+                if etag:
+                    cached_file = self.get_cache().get(url + etag)
+                    if cached_file:
+                        headers["If-None-Match"] = etag
+
             response = requests.get(url, stream=True, headers=headers)
+            if response.status_code == 304 and cached_file:
+                response.close()
+                return open(cached_file, "rb")
 
+            # we should not take the raw response stream here as it could be gzipped or encoded.
+            # we iterate over the decoded content and tee it into the cache while the caller reads it.
             # always treat content as binary, utf-8 encoding is done by readers
-            response_stream = io.BytesIO(response.content)
-
-            if cache and "etag" in response.headers:
-                etag = response.headers["etag"]
-                if etag:
-                    return self.get_cached_stream(response_stream, url + etag)[0]
-            return response_stream
+            writer = None
+            etag = response.headers.get("etag")
+            if cache and etag and response.status_code == 200:
+                self.get_cache().set_tag(url, etag)
+                writer = self.get_cache().open(url + etag)
+            chunks = response.iter_content(chunk_size=HTTP_CHUNK_SIZE)
+            return io.BufferedReader(TeeStream(chunks, writer, on_close=response.close), HTTP_CHUNK_SIZE)
         return open(url, "rb")
 
     def get_url_json(self, url):
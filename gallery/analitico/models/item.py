@@ -5,6 +5,10 @@ import urllib
 import requests
 import base64
 import io
+import json
+import hashlib
+import time
+import concurrent.futures
 
 from analitico import AnaliticoException, logger
 from analitico.mixin import AttributeMixin
@@ -17,6 +21,18 @@ from pathlib import Path
 
 DF_SUPPORTED_FORMATS = (".parquet", ".csv")
 
+# large files are uploaded in parts of this size, a few parts at a time
+UPLOAD_PART_SIZE = 32 * 1024 * 1024  # 32 MiBs
+UPLOAD_MULTIPART_MIN_SIZE = 2 * UPLOAD_PART_SIZE
+UPLOAD_THREADS = 4
+
+# state of multipart uploads is saved here so that interrupted uploads can be resumed
+UPLOAD_STATE_DIRECTORY = os.path.join(tempfile.gettempdir(), "analitico_uploads")
+
+# very large uploads are assembled by a job on the server, its status is checked every few seconds
+UPLOAD_ASSEMBLE_POLL_SECONDS = 5
+UPLOAD_ASSEMBLE_TIMEOUT_SECONDS = 60 * 60
+
 
 class Item(AttributeMixin):
     """ Base class for items like datasets, recipes and notebooks on Analitico. """
@@ -86,7 +102,7 @@ class Item(AttributeMixin):
                 with open(filepath, "rb") as f:
                     # direct upload implies the containing directory already exists
                     url = f"{server}/{remotepath}"
-                    response = requests.put(url, data=f, auth=(user, password))
+                    response = self.sdk.session.put(url, data=f, auth=(user, password))
                     if response.status_code in (200, 201, 204):
                         return True
 
@@ -96,14 +112,14 @@ class Item(AttributeMixin):
                     parts_url = server + "/"
                     for part in parts:
                         parts_url += part + "/"
-                        response = requests.request("MKCOL", parts_url, auth=(user, password))
+                        response = self.sdk.session.request("MKCOL", parts_url, auth=(user, password))
                         if response.status_code not in (405, 200, 201, 204):
                             msg = f"An error occoured while creating directory {parts_url}"
                             raise AnaliticoException(msg, status_code=response.status_code)
 
                     # now we can retry uploading the file as we know for sure its directory exists
                     with open(filepath, "rb") as f:
-                        response = requests.put(url, data=f, auth=(user, password))
+                        response = self.sdk.session.put(url, data=f, auth=(user, password))
                         if response.status_code in (200, 201, 204):
                             return True
 
@@ -111,6 +127,78 @@ class Item(AttributeMixin):
                 raise AnaliticoException(msg, status_code=response.status_code)
         return False
 
+    def _upload_multipart(self, filepath: str, remotepath: str, part_size: int = UPLOAD_PART_SIZE) -> bool:
+        """
+        Upload a large file in parts via the /files APIs. Parts are uploaded concurrently and then
+        assembled on the server. If an upload of the same file was interrupted, only the parts that
+        the server has not acknowledged yet are uploaded again.
+        """
+        url = self.url + "/files/" + remotepath
+        size = os.path.getsize(filepath)
+        parts = (size + part_size - 1) // part_size
+
+        # uploads are resumed only for the same file, destination and file version
+        state_key = f"{self.id}:{remotepath}:{os.path.abspath(filepath)}:{size}:{os.path.getmtime(filepath)}"
+        state_path = os.path.join(UPLOAD_STATE_DIRECTORY, hashlib.sha256(state_key.encode()).hexdigest() + ".json")
+
+        upload_id, uploaded = None, set()
+        if os.path.isfile(state_path):
+            with open(state_path) as f:
+                upload_id = json.load(f)["upload_id"]
+            try:
+                upload = self.sdk.get_url_json(f"{url}?upload_id={upload_id}")
+                for part in upload["data"]["parts"]:
+                    if part["size"] == min(part_size, size - (part["part"] - 1) * part_size):
+                        uploaded.add(part["part"])
+                logger.info(f"upload - resuming {filepath}, {len(uploaded)} of {parts} parts already uploaded")
+            except AnaliticoException:
+                upload_id = None
+        if not upload_id:
+            upload = self.sdk.get_url_json(f"{url}?uploads=true", method="POST", status_code=201)
+            upload_id = upload["data"]["upload_id"]
+            os.makedirs(UPLOAD_STATE_DIRECTORY, exist_ok=True)
+            with open(state_path, "w") as f:
+                json.dump({"upload_id": upload_id, "filepath": filepath, "remotepath": remotepath}, f)
+
+        def _upload_part(part):
+            with open(filepath, "rb") as f:
+                f.seek((part - 1) * part_size)
+                data = f.read(part_size)
+            part_url, headers = self.sdk.get_url_headers(f"{url}?upload_id={upload_id}&part={part}")
+            response = self.sdk.session.put(part_url, data=data, headers=headers)
+            if response.status_code not in (200, 204):
+                msg = f"Could not upload part {part} of {filepath} to {url}, status: {response.status_code}"
+                raise AnaliticoException(msg, status_code=response.status_code)
+
+        missing = [part for part in range(1, parts + 1) if part not in uploaded]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=UPLOAD_THREADS) as executor:
+            list(executor.map(_upload_part, missing))
+
+        # assemble parts into the final file on the server, very large files are assembled
+        # by a job and the request returns 202 with the id of the job that we wait for
+        assemble_url, headers = self.sdk.get_url_headers(f"{url}?upload_id={upload_id}&parts={parts}")
+        response = self.sdk.session.post(assemble_url, headers=headers)
+        if response.status_code == 202:
+            self._wait_for_upload_job(response.json()["data"]["job_id"], filepath)
+        elif response.status_code != 204:
+            msg = f"Could not assemble {filepath} on {url}, status: {response.status_code}"
+            raise AnaliticoException(msg, status_code=response.status_code)
+        os.remove(state_path)
+        return True
+
+    def _wait_for_upload_job(self, job_id: str, filepath: str):
+        """ Waits for the job assembling a multipart upload on the server, raises if the job failed """
+        started_at = time.time()
+        while time.time() - started_at < UPLOAD_ASSEMBLE_TIMEOUT_SECONDS:
+            job = self.sdk.get_url_json(f"{self.url}/k8s/jobs/{job_id}")
+            if get_dict_dot(job, "status.succeeded", 0) > 0:
+                return
+            if get_dict_dot(job, "status.failed", 0) > 0:
+                # parts are kept on the server so the upload can be resumed and assembled again
+                raise AnaliticoException(f"Could not assemble {filepath}, job {job_id} failed")
+            time.sleep(UPLOAD_ASSEMBLE_POLL_SECONDS)
+        raise AnaliticoException(f"Could not assemble {filepath}, job {job_id} did not complete in time")
+
     ##
     ## Methods
     ##
@@ -121,7 +209,7 @@ class Item(AttributeMixin):
         """
         Upload a file to the storage drive associated with this item. You can upload a file by indicating its
         filepath on the local disk or by handing a Pandas dataframe which is automatically saved to a file and
-        then uploaded.
+        then uploaded. Large files are uploaded in parts and an interrupted upload is resumed when retried.
         
         Keyword Arguments:
             filepath {str} -- Local filepath (or None if passing a dataframe)
@@ -156,6 +244,10 @@ class Item(AttributeMixin):
             # no absolute paths
             assert not remotepath.startswith("/"), "remotepath should be relative, eg: flower.jpg or flowers/flower.jpg"
 
+            # large files are uploaded in parts that can be resumed if the upload is interrupted
+            if os.path.getsize(filepath) >= UPLOAD_MULTIPART_MIN_SIZE:
+                return self._upload_multipart(filepath, remotepath)
+
             if direct:
                 try:
                     # see if we can upload directly to storage
@@ -169,7 +261,7 @@ class Item(AttributeMixin):
 
             with open(filepath, "rb") as f:
                 # multipart encoded upload
-                response = requests.put(url, files={"file": f}, headers=headers)
+                response = self.sdk.session.put(url, files={"file": f}, headers=headers)
 
                 # raw upload
                 # response = requests.put(url, data=f, headers=headers)
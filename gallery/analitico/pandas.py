@@ -1,3 +1,5 @@
+import collections
+import numpy as np
 import pandas as pd
 import json
 import dateutil
@@ -158,26 +160,38 @@ def pd_columns_to_string(df):
     return columns[:-2]
 
 
-def pd_read_csv(filepath_or_buffer, schema=None, skiprows=None, nrows=None):
-    """ Read csv file from file or stream and apply optional schema """
-    try:
-        dtype = None
+def pd_get_csv_dtype(schema) -> dict:
+    """ Returns dtype dictionary that should be used to read a csv with the given schema (or None) """
+    dtype = None
+    if schema:
+        # array of types for each column in the source
+        columns = schema.get("columns")
+        if columns:
+            dtype = {}
+            for column in columns:
+                if "type" in column:  # type is optionally defined
+                    if column["type"] == "datetime":
+                        dtype[column["name"]] = "object"
+                    elif column["type"] == "timespan":
+                        dtype[column["name"]] = "object"
+                    elif column["type"] == "integer":
+                        pass  # do not cast so we can deal with nulls later
+                    else:
+                        dtype[column["name"]] = analitico_to_pandas_type(column["type"])
+    return dtype
+
+
+def pd_read_csv(filepath_or_buffer, schema=None, skiprows=None, nrows=None, chunksize=None):
+    """ 
+    Read csv file from file or stream and apply optional schema. If chunksize is
+    specified the method will return a generator of dataframes, see pd_read_csv_chunks.
+    """
+    if chunksize:
+        return pd_read_csv_chunks(filepath_or_buffer, schema, chunksize=chunksize, skiprows=skiprows, nrows=nrows)
 
-        if schema:
-            # array of types for each column in the source
-            columns = schema.get("columns")
-            if columns:
-                dtype = {}
-                for column in columns:
-                    if "type" in column:  # type is optionally defined
-                        if column["type"] == "datetime":
-                            dtype[column["name"]] = "object"
-                        elif column["type"] == "timespan":
-                            dtype[column["name"]] = "object"
-                        elif column["type"] == "integer":
-                            pass  # do not cast so we can deal with nulls later
-                        else:
-                            dtype[column["name"]] = analitico_to_pandas_type(column["type"])
+    dtype = None
+    try:
+        dtype = pd_get_csv_dtype(schema)
 
         # read csv from file or stream
         df = pd.read_csv(
@@ -200,6 +214,85 @@ def pd_read_csv(filepath_or_buffer, schema=None, skiprows=None, nrows=None):
         raise exc
 
 
+# number of rows read at once when streaming csv files in chunks
+CSV_CHUNKSIZE = 100000
+
+
+def pd_read_csv_chunks(filepath_or_buffer, schema=None, chunksize=CSV_CHUNKSIZE, skiprows=None, nrows=None):
+    """
+    Read csv file from file or stream in chunks of at most chunksize rows, apply optional
+    schema to each chunk and yield the resulting dataframes. Memory use is bounded by chunksize.
+
+    Columns of type category are given the categories seen so far: values seen in earlier chunks
+    keep their codes while new values are appended as they are encountered, so chunks can be fed
+    to a model one after the other without remapping. Since categories grow from chunk to chunk,
+    pd.concat turns them into objects, concatenate them with pd.api.types.union_categoricals
+    or set the categories of the last chunk on all chunks instead.
+
+    Integer columns not typed by the schema are read as pandas' nullable Int64 so that a chunk
+    with missing values has the same dtype as the others, and numeric columns keep the dtype
+    they had in the first chunk when possible, eg. a float column whose values are all integers
+    in a later chunk. Chunks are yielded as they are read, so when a column that was integer
+    turns out to have float values it is float64 from that chunk on while the chunks already
+    yielded stay Int64. Give the column a type in the schema when all chunks need the same dtype.
+    """
+    dtype = None
+    try:
+        dtype = pd_get_csv_dtype(schema)
+
+        # categories collected so far for each categorical column (after renames)
+        categories, typed = {}, set()
+        if schema:
+            for column in schema.get("columns", []) + schema.get("apply", []):
+                if column.get("type"):
+                    typed.add(column.get("rename", column["name"]))
+                if column.get("type") == analitico.schema.ANALITICO_TYPE_CATEGORY:
+                    categories[column.get("rename", column["name"])] = []
+
+        # dtypes of the numeric columns not typed by the schema in the first chunk
+        dtypes = None
+
+        reader = pd.read_csv(
+            filepath_or_buffer,
+            dtype=dtype,
+            encoding="utf-8",
+            na_values=NA_VALUES,
+            skiprows=skiprows,
+            nrows=nrows,
+            chunksize=chunksize,
+        )
+        for df in reader:
+            if schema:
+                # reorder, filter, apply types, rename columns as requested in schema
+                df = analitico.schema.apply_schema(df, schema)
+            for name, known in categories.items():
+                if name in df.columns:
+                    if df[name].dtype.name == "category":
+                        values = df[name].cat.categories
+                    else:
+                        values = df[name].dropna().unique()
+                    known.extend(values[~pd.Index(values).isin(known)])
+                    df[name] = pd.Categorical(df[name], categories=known)
+            for name in df.columns:
+                if name in typed or not pd.api.types.is_numeric_dtype(df[name].dtype) or df[name].dtype == bool:
+                    continue
+                if pd.api.types.is_integer_dtype(df[name].dtype):
+                    df[name] = df[name].astype("Int64")
+                if dtypes is not None and name in dtypes and df[name].dtype != dtypes[name]:
+                    try:
+                        df[name] = df[name].astype(dtypes[name])
+                    except (TypeError, ValueError):
+                        # float values in a column that was integer, later chunks are float64 as well
+                        dtypes[name] = df[name].dtype
+            if dtypes is None:
+                dtypes = {name: df[name].dtype for name in df.columns if name not in typed}
+            yield df
+
+    except Exception as exc:
+        logger.error(f"Could not read csv file from {filepath_or_buffer}, schema: {schema}, dtype: {dtype}")
+        raise exc
+
+
 def pd_to_csv(df: pd.DataFrame, filename, schema=False, samples=0):
     """ Writes dataframe to disk optionally adding a .schema file and a .samples file """
     if not filename.endswith(".csv"):
@@ -233,6 +326,24 @@ def pd_to_dict(df):
         return json.load(io)
 
 
+def pd_to_json_dict(results: dict) -> dict:
+    """
+    Returns a copy of the given dictionary where numpy arrays, series and dataframes have been
+    converted to lists and records that can be serialized to json. Conversions are vectorized
+    so this can be used on large columnar results right before they are sent back to the caller.
+    """
+    json_dict = collections.OrderedDict()
+    for key, value in results.items():
+        if isinstance(value, pd.DataFrame):
+            value = pd_to_dict(value)
+        elif isinstance(value, (pd.Series, pd.Index, np.ndarray)):
+            value = value.tolist()
+        elif isinstance(value, dict):
+            value = pd_to_json_dict(value)
+        json_dict[key] = value
+    return json_dict
+
+
 def pd_sample(df, n=20):
     """ Returns a sample from the given DataFrame, either number of rows or percentage. """
     if n < 1:
@@ -21,6 +21,7 @@ import catboost
 from catboost import CatBoostClassifier, CatBoostRegressor
 
 from analitico.utilities import time_ms
+from analitico.registry import model_registry
 
 import analitico.pandas
 import analitico.schema
@@ -356,8 +357,30 @@ class CatBoostPlugin(IAlgorithmPlugin):
         except Exception as exc:
             self.exception("CatBoostPlugin - error while training: %s", str(exc), exception=exc)
 
+    def load_model(self, training):
+        """ Returns the trained model saved in the artifacts, models are cached by the process wide model registry """
+        model_path = os.path.join(self.factory.get_artifacts_directory(), "model.cbm")
+        if not os.path.isfile(model_path):
+            self.exception("CatBoostPlugin.predict - cannot find saved model in %s", model_path)
+
+        def _load_model(path):
+            model = self.create_model(training)
+            model.load_model(path)
+            return model
+
+        return model_registry.get(model_path, _load_model)
+
     def predict(self, data, training, results, *args, **kwargs):
-        """ Return predictions from trained model """
+        """ 
+        Return predictions from trained model. By default predictions are returned as lists that can
+        be serialized to json, probabilities as a dictionary of class: probability for each record and
+        the processed records are echoed back. If the plugin's "prediction.columnar" attribute is set,
+        predictions are returned as a numpy array, probabilities as a dataframe with a column for each
+        class and the class labels are returned once in "classes". Set "prediction.drop_records" to avoid
+        echoing back the processed records. Columnar results can be converted to json with
+        analitico.pandas.pd_to_json_dict when they are sent back to the caller.
+        """
+        columnar = self.get_attribute("prediction.columnar", False)
 
         # data should already come in as pd.DataFrame but it's just a dictionary we convert it
         if not isinstance(data, pd.DataFrame):
@@ -366,9 +389,9 @@ class CatBoostPlugin(IAlgorithmPlugin):
         # record that we're predicting on after augmentation is added
         # to the results. if the endpoint or the jupyter notebook in
         # charge of communicating with the caller does not want to send
-        # this information back, it can always take it out. in the future
-        # we may want to optimized here and add this optionally instead.
-        results["records"] = analitico.pandas.pd_to_dict(data)
+        # this information back, it can turn it off
+        if not self.get_attribute("prediction.drop_records", False):
+            results["records"] = data.copy() if columnar else analitico.pandas.pd_to_dict(data)
 
         # initialize data pool to be tested
         categorical_idx = self.get_categorical_idx(data)
@@ -376,19 +399,14 @@ class CatBoostPlugin(IAlgorithmPlugin):
 
         # create model object from stored file
         loading_on = time_ms()
-        model_path = os.path.join(self.factory.get_artifacts_directory(), "model.cbm")
-        if not os.path.isfile(model_path):
-            self.exception("CatBoostPlugin.predict - cannot find saved model in %s", model_path)
-
-        model = self.create_model(training)
-        model.load_model(model_path)
+        model = self.load_model(training)
         results["performance"]["loading_ms"] = time_ms(loading_on)
 
         algo = training.get("algorithm", ALGORITHM_TYPE_REGRESSION)
         if algo == ALGORITHM_TYPE_REGRESSION:
             y_predictions = model.predict(data_pool)
             y_predictions = np.around(y_predictions, decimals=3)
-            results["predictions"] = list(y_predictions)
+            results["predictions"] = y_predictions if columnar else list(y_predictions)
 
         else:
             # predict class and probabilities of each class
@@ -398,19 +416,19 @@ class CatBoostPlugin(IAlgorithmPlugin):
             y_probabilities = model.predict(data_pool, prediction_type="Probability")  # array of array of probabilities
             y_classes = training["data"]["classes"]  # list of possible classes
 
-            preds = results["predictions"] = []
-            probs = results["probabilities"] = []
-
-            # create predictions with assigned class and probabilities
-            if algo == ALGORITHM_TYPE_MULTICLASS_CLASSIFICATION:
-                for i in range(0, len(data)):
-                    preds.append(y_classes[int(y_predictions[i][0])])
-                    probs.append({y_classes[j]: y_probabilities[i][j] for j in range(0, len(y_classes))})
+            # class labels are looked up for all records at once, multiclass
+            # models return an array with a single class index for each record
+            y_codes = np.asarray(y_predictions).reshape(len(data)).astype(int)
+            y_labels = np.asarray(y_classes, dtype=object)[y_codes]
+            y_probabilities = pd.DataFrame(y_probabilities, columns=y_classes, index=data.index)
 
-            elif algo == ALGORITHM_TYPE_BINARY_CLASSICATION:
-                for i in range(0, len(data)):
-                    preds.append(y_classes[int(y_predictions[i])])
-                    probs.append({y_classes[0]: y_probabilities[i][0], y_classes[1]: y_probabilities[i][1]})
+            if columnar:
+                results["classes"] = y_classes
+                results["predictions"] = y_labels
+                results["probabilities"] = y_probabilities
+            else:
+                results["predictions"] = y_labels.tolist()
+                results["probabilities"] = y_probabilities.to_dict(orient="records", into=dict)
 
         return results
 
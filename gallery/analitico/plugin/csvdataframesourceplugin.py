@@ -5,6 +5,7 @@ Plugins that import dataframes from different sources
 import pandas
 from analitico.utilities import get_dict_dot
 from analitico.schema import analitico_to_pandas_type, apply_schema, NA_VALUES
+from analitico.pandas import pd_read_csv_chunks
 from .interfaces import IDataframeSourcePlugin, PluginError, plugin
 
 ##
@@ -51,6 +52,15 @@ class CsvDataframeSourcePlugin(IDataframeSourcePlugin):
                             dtype[column["name"]] = analitico_to_pandas_type(column["type"])
 
             stream = self.factory.get_url_stream(url, binary=False)
+
+            # a chunksize can be specified to stream very large files in bounded
+            # memory, in which case we return a generator of typed dataframes
+            chunksize = self.get_attribute("chunksize", 0)
+            if chunksize > 0:
+                if self.get_attribute("tail", 0) > 0:
+                    self.warning("tail: cannot be applied when reading in chunks and will be ignored")
+                return pd_read_csv_chunks(stream, schema, chunksize=chunksize)
+
             df = pandas.read_csv(stream, dtype=dtype, encoding="utf-8", na_values=NA_VALUES)
 
             tail = self.get_attribute("tail", 0)
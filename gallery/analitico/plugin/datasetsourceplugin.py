@@ -45,6 +45,14 @@ class DatasetSourcePlugin(IDataframeSourcePlugin):
             csv_url = "analitico://datasets/" + dataset_id + "/data/csv"
             csv_stream = self.factory.get_url_stream(csv_url, binary=False)
 
+            # a chunksize can be specified to stream very large datasets in
+            # bounded memory, in which case we return a generator of dataframes
+            chunksize = self.get_attribute("chunksize", 0)
+            if chunksize > 0:
+                self.info("reading: %s in chunks of %d rows", csv_url, chunksize)
+                chunks = analitico.pandas.pd_read_csv_chunks(csv_stream, schema, chunksize=chunksize)
+                return self.process_chunks(chunks)
+
             reading_on = time_ms()
             self.info("reading: %s", csv_url)
             df = analitico.pandas.pd_read_csv(csv_stream, schema)
@@ -68,6 +76,23 @@ class DatasetSourcePlugin(IDataframeSourcePlugin):
         except Exception as exc:
             raise exc
 
+    def process_chunks(self, chunks):
+        """ Applies sampling to a stream of dataframe chunks, yields the processed chunks """
+        sample = self.get_attribute("sample", 0)
+        if sample >= 1:
+            self.warning("sample: %d rows cannot be applied when reading in chunks, use a fraction instead", sample)
+        if self.get_attribute("tail", 0) > 0:
+            self.warning("tail: cannot be applied when reading in chunks and will be ignored")
+
+        reading_on = time_ms()
+        rows = 0
+        for df in chunks:
+            rows += len(df)
+            if 0 < sample < 1:
+                df = analitico.pandas.pd_sample(df, sample)
+            yield df
+        self.info("%d rows in %d ms", rows, time_ms(reading_on))
+
     def run(self, *args, action=None, **kwargs):
         """ Read data from configured dataset in training mode, noop in prediction mode """
 
@@ -14,8 +14,10 @@ from abc import ABC, abstractmethod
 from analitico.mixin import AttributeMixin
 from analitico.factory import Factory
 from analitico.utilities import time_ms, save_json, read_json, get_runtime_brief
-from analitico.schema import apply_schema
+from analitico.schema import apply_schema, compile_schema
+from analitico.pandas import pd_to_json_dict
 from analitico.constants import PLUGIN_PREFIX
+from analitico.registry import model_registry
 
 ##
 ## IPlugin - base class for all plugins
@@ -233,8 +235,11 @@ class IAlgorithmPlugin(IPlugin):
         # assert isinstance(args[0], pandas.DataFrame) # custom models may take json as input
         data = args[0]
 
+        # training metadata and the compiled schema are cached by the model registry
+        # and are only read again from disk if the model is retrained
         artifacts_path = self.factory.get_artifacts_directory()
-        training = read_json(os.path.join(artifacts_path, "metadata.json"))
+        training_path = os.path.join(artifacts_path, "metadata.json")
+        training = model_registry.get(training_path, read_json)
         assert training
 
         started_on = time_ms()
@@ -253,15 +258,16 @@ class IAlgorithmPlugin(IPlugin):
 
         # force schema like in training data
         if isinstance(data, pd.DataFrame):
-            schema = training["data"]["schema"]
+            schema = model_registry.get(training_path, lambda _: compile_schema(training["data"]["schema"]), "schema")
             data = apply_schema(data, schema)
 
         # load model, calculate predictions
         results = self.predict(data, training, results, *args, **kwargs)
         results["performance"]["total_ms"] = time_ms(started_on)
 
+        # columnar results are converted to json only when saved
         results_path = os.path.join(artifacts_path, "results.json")
-        save_json(results, results_path)
+        save_json(pd_to_json_dict(results), results_path)
 
         return results
 
@@ -0,0 +1,257 @@
+""" Streaming statistics used to profile datasets that may not fit in memory """
+
+import math
+import numpy as np
+import pandas as pd
+
+from analitico.schema import (
+    generate_schema,
+    ANALITICO_TYPE_INTEGER,
+    ANALITICO_TYPE_FLOAT,
+    ANALITICO_TYPE_STRING,
+    ANALITICO_TYPE_BOOLEAN,
+)
+
+# number of bits of the hash used to pick a register, 2^14 registers have a standard error of about 0.8%
+HLL_PRECISION = 14
+
+# t-digest compression, higher values keep more centroids and give more accurate quantiles
+TDIGEST_COMPRESSION = 100
+
+# quantiles reported for numeric columns
+PROFILE_QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+##
+## HyperLogLog - approximate number of distinct values
+##
+
+
+class HyperLogLog:
+    """
+    Estimates the number of distinct values in a stream using a fixed amount of memory
+    (2^precision bytes). Values are hashed, the first bits of each hash pick a register and
+    the register keeps the longest run of leading zeros seen in the remaining bits.
+    Sketches of different chunks can be merged. See Flajolet et al, HyperLogLog: the analysis
+    of a near-optimal cardinality estimation algorithm.
+    """
+
+    def __init__(self, precision: int = HLL_PRECISION):
+        assert 4 <= precision <= 18
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, values: pd.Series):
+        """ Adds the non null values of a series """
+        values = values.dropna()
+        if values.empty:
+            return
+        hashes = pd.util.hash_pandas_object(values, index=False).values.astype(np.uint64)
+        bits = 64 - self.precision
+        indexes = (hashes >> np.uint64(bits)).astype(np.int64)
+        remainders = hashes & np.uint64((1 << bits) - 1)
+
+        # bit length of the remainders computed on 32 bit halves which are exact as floats
+        high = (remainders >> np.uint64(32)).astype(np.float64)
+        low = (remainders & np.uint64(0xFFFFFFFF)).astype(np.float64)
+        with np.errstate(divide="ignore"):
+            lengths = np.where(
+                high > 0, 33 + np.floor(np.log2(np.maximum(high, 1))), np.where(low > 0, np.floor(np.log2(low)) + 1, 0)
+            )
+        ranks = (bits - lengths + 1).astype(np.uint8)
+        np.maximum.at(self.registers, indexes, ranks)
+
+    def merge(self, other: "HyperLogLog"):
+        assert self.precision == other.precision
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        """ Returns the estimated number of distinct values """
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+##
+## TDigest - approximate quantiles
+##
+
+
+class TDigest:
+    """
+    Estimates quantiles of a stream of numbers with a bounded number of centroids (means with
+    weights). Centroids are small near the tails and larger in the middle of the distribution
+    so extreme quantiles are accurate. Each chunk of values is sorted and merged with the existing
+    centroids in a vectorized pass using the k1 scale function. See Dunning, Computing extremely
+    accurate quantiles using t-digests.
+    """
+
+    def __init__(self, compression: int = TDIGEST_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0, dtype=np.float64)
+        self.weights = np.empty(0, dtype=np.float64)
+        self.min = None
+        self.max = None
+
+    @property
+    def count(self) -> int:
+        return int(self.weights.sum())
+
+    def update(self, values):
+        """ Adds an array or series of numbers, missing values are ignored """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.min = float(values.min()) if self.min is None else min(self.min, float(values.min()))
+            self.max = float(values.max()) if self.max is None else max(self.max, float(values.max()))
+            self._compress(np.concatenate((self.means, values)), np.concatenate((self.weights, np.ones(len(values)))))
+
+    def merge(self, other: "TDigest"):
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+            self._compress(np.concatenate((self.means, other.means)), np.concatenate((self.weights, other.weights)))
+
+    def _compress(self, means, weights):
+        order = np.argsort(means, kind="mergesort")
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+
+        # centroids whose centers fall within the same unit of the scale function are merged
+        q = (np.cumsum(weights) - weights / 2) / total
+        k = self.compression / math.pi * np.arcsin(2 * q - 1)
+        bins = np.floor(k - k.min()).astype(np.int64)
+        merged_weights = np.bincount(bins, weights=weights)
+        merged_means = np.bincount(bins, weights=means * weights)
+        nonzero = merged_weights > 0
+        self.weights = merged_weights[nonzero]
+        self.means = merged_means[nonzero] / self.weights
+
+    def quantile(self, q: float) -> float:
+        """ Returns the estimated value at quantile q (0 to 1) """
+        if not len(self.weights):
+            return None
+        if len(self.weights) == 1:
+            return float(self.means[0])
+        centers = (np.cumsum(self.weights) - self.weights / 2) / self.weights.sum()
+        points = np.concatenate(([0.0], centers, [1.0]))
+        values = np.concatenate(([self.min], self.means, [self.max]))
+        return float(np.interp(q, points, values))
+
+
+##
+## Profiler
+##
+
+
+class DataFrameProfiler:
+    """
+    Profiles a dataset one chunk at a time with memory that does not depend on the number of rows.
+    For each column it collects the schema type, number of values and nulls, min and max values,
+    an approximate number of distinct values (HyperLogLog) and approximate quantiles of numeric
+    columns (t-digest). Chunks can be dataframes read with pd_read_csv(chunksize=...) or row
+    groups of a parquet file. If a column's type changes between chunks (eg. integers that
+    turn out to have missing values or decimals) the wider type is reported.
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.columns = None
+        self.types = {}
+        self.index = {}
+        self.nulls = {}
+        self.mins = {}
+        self.maxs = {}
+        self.distincts = {}
+        self.digests = {}
+
+    def _merge_type(self, current: str, new: str) -> str:
+        if current is None or current == new:
+            return new
+        numeric = (ANALITICO_TYPE_BOOLEAN, ANALITICO_TYPE_INTEGER, ANALITICO_TYPE_FLOAT)
+        if current in numeric and new in numeric:
+            return ANALITICO_TYPE_FLOAT if ANALITICO_TYPE_FLOAT in (current, new) else ANALITICO_TYPE_INTEGER
+        return ANALITICO_TYPE_STRING
+
+    def update(self, df: pd.DataFrame):
+        """ Adds a chunk of records to the profile """
+        if self.columns is None:
+            self.columns = df.columns.tolist()
+        self.records += len(df.index)
+
+        for column in generate_schema(df)["columns"]:
+            name = column["name"]
+            self.types[name] = self._merge_type(self.types.get(name), column["type"])
+            if column.get("index"):
+                self.index[name] = True
+            if name not in self.distincts:
+                if name not in self.columns:
+                    self.columns.append(name)
+                self.nulls[name] = 0
+                self.distincts[name] = HyperLogLog()
+
+            series = df[name]
+            self.nulls[name] += int(series.isna().sum())
+            self.distincts[name].update(series)
+
+            values = series.dropna()
+            if values.empty:
+                continue
+            try:
+                low, high = values.min(), values.max()
+                self.mins[name] = low if name not in self.mins else min(self.mins[name], low)
+                self.maxs[name] = high if name not in self.maxs else max(self.maxs[name], high)
+            except TypeError:
+                pass  # mixed types that cannot be compared
+            if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+                self.digests.setdefault(name, TDigest()).update(values.values)
+
+    def _to_json(self, value):
+        """ Converts numpy and pandas values to types that can be saved as json """
+        if isinstance(value, (pd.Timestamp, pd.Timedelta)):
+            return str(value)
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+    def get_schema(self) -> dict:
+        """ Returns the analitico schema of the profiled records """
+        columns = []
+        for name in self.columns or []:
+            column = {"name": name, "type": self.types[name]}
+            if self.index.get(name):
+                column["index"] = True
+            columns.append(column)
+        return {"columns": columns}
+
+    def get_metadata(self) -> dict:
+        """ Returns the number of records, the schema and the statistics of each column """
+        statistics = {}
+        for name in self.columns or []:
+            stats = {
+                "count": self.records - self.nulls[name],
+                "nulls": self.nulls[name],
+                "distinct": min(self.distincts[name].count(), self.records - self.nulls[name]),
+            }
+            if name in self.mins:
+                stats["min"] = self._to_json(self.mins[name])
+                stats["max"] = self._to_json(self.maxs[name])
+            if name in self.digests:
+                digest = self.digests[name]
+                stats["mean"] = float(np.sum(digest.means * digest.weights) / digest.weights.sum())
+                stats["quantiles"] = {str(q): digest.quantile(q) for q in PROFILE_QUANTILES}
+            statistics[name] = stats
+        return {"total_records": self.records, "schema": self.get_schema(), "statistics": statistics}
+
+
+def profile_dataframe_chunks(chunks) -> dict:
+    """ Returns the metadata of a dataset read as an iterator of dataframes, see DataFrameProfiler """
+    profiler = DataFrameProfiler()
+    for df in chunks:
+        profiler.update(df)
+    return profiler.get_metadata()
@@ -0,0 +1,85 @@
+""" A process wide cache of trained models and related artifacts used to serve predictions """
+
+import os
+import collections
+import threading
+
+from analitico import logger
+
+# maximum number of artifacts kept in memory by default
+MODEL_REGISTRY_SIZE = int(os.environ.get("ANALITICO_MODEL_REGISTRY_SIZE", 16))
+
+
+class ModelRegistry:
+    """
+    A size bounded LRU cache of objects loaded from artifact files, for example trained
+    models, training metadata or schemas compiled from it. Entries are keyed by the artifact's
+    path and an optional kind (so the same file can back more than one object) and remember
+    the file's modification time and size. When the file changes on disk, for example because
+    the model has been retrained, the entry is considered stale and is loaded again.
+    """
+
+    def __init__(self, max_size: int = MODEL_REGISTRY_SIZE):
+        assert max_size > 0
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get_signature(self, path: str):
+        """ Signature used to detect changes to an artifact file """
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, path: str, loader, kind: str = None):
+        """
+        Returns the object loaded from the given artifact path. If the object is not
+        in cache or the file has changed since it was loaded, loader(path) is called
+        and its result is cached before being returned.
+        """
+        key = (os.path.realpath(path), kind)
+        signature = self._get_signature(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # load outside of the lock so slow loads do not block other artifacts
+        value = loader(path)
+        with self._lock:
+            self._entries[key] = (signature, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+                logger.debug(f"ModelRegistry - evicted {evicted_key[0]} ({evicted_key[1]})")
+        return value
+
+    def clear(self):
+        """ Removes all cached entries, counters are preserved """
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self) -> dict:
+        """ Returns a dictionary with hits, misses, evictions and current size of the registry """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# shared instance used by plugins to serve predictions
+model_registry = ModelRegistry()
@@ -1,5 +1,9 @@
 """ Utility methods to convert between pandas and analitico's schemas """
 
+import collections
+import json
+import threading
+
 import numpy as np
 import pandas as pd
 
@@ -72,7 +76,7 @@ def analitico_to_pandas_type(data_type: str):
 
 def pandas_to_analitico_type(data_type):
     """ Return the analitico schema data type of a pandas dtype """
-    if data_type == "int" or data_type == "int8":
+    if data_type == "int" or data_type == "int8" or data_type == "Int64":
         return ANALITICO_TYPE_INTEGER
     if data_type == "float":
         return ANALITICO_TYPE_FLOAT
@@ -108,71 +112,213 @@ def generate_schema(df: pd.DataFrame) -> dict:
     return {"columns": columns}
 
 
-def apply_column(df: pd.DataFrame, column):
-    """ Apply given type to the column (parameters are type, name, etc from schema column) """
+##
+## Compiled schemas
+##
+
+# pandas' format inference is private and has moved around between versions,
+# without it datetimes are parsed one by one without a format
+try:
+    from pandas._libs.tslibs.parsing import guess_datetime_format
+except ImportError:
     try:
-        assert isinstance(df, pd.DataFrame)
+        from pandas._libs.tslibs.parsing import _guess_datetime_format as guess_datetime_format
+    except ImportError:
+        guess_datetime_format = None
+
+ANALITICO_TYPES = (
+    ANALITICO_TYPE_INTEGER,
+    ANALITICO_TYPE_FLOAT,
+    ANALITICO_TYPE_STRING,
+    ANALITICO_TYPE_BOOLEAN,
+    ANALITICO_TYPE_DATETIME,
+    ANALITICO_TYPE_TIMESPAN,
+    ANALITICO_TYPE_CATEGORY,
+)
+
+
+class ColumnPlan:
+    """ 
+    The cast planned for a single schema column. Each cast is done with a single vectorized
+    operation on the column and is skipped when the column already has the requested dtype.
+    Integer columns with "nullable": true are cast to pandas' nullable Int64 instead of
+    having their missing values replaced with 0. The format used to parse datetimes is
+    inferred from the data and, once it has parsed a whole series, is tried first on
+    later dataframes so the format does not need to be inferred again.
+    """
+
+    def __init__(self, column: dict):
         assert "name" in column, "apply_column - should always be passed a column name"
-        column_name = column["name"]
+        self.name = column["name"]
+        self.type = column.get("type")
+        self.rename = column.get("rename")
+        self.index = column.get("index", False)
+        self.nullable = column.get("nullable", False)
+        if self.type and self.type not in ANALITICO_TYPES:
+            raise AnaliticoException("apply_column - unknown type: " + self.type)
+
+        # last datetime format that parsed a whole series of this column
+        self.datetime_format = None
+
+    def cast(self, series: pd.Series) -> pd.Series:
+        """ Returns the series cast to the column's type """
+        if self.type == ANALITICO_TYPE_STRING:
+            if pd.api.types.infer_dtype(series, skipna=False) == "string":
+                return series
+            return series.astype(str)
+
+        if self.type == ANALITICO_TYPE_FLOAT:
+            return series.astype(float, copy=False)
+
+        if self.type == ANALITICO_TYPE_BOOLEAN:
+            # missing values are converted to False
+            if series.dtype == bool:
+                return series
+            return series.fillna(False).astype(bool) if series.hasnans else series.astype(bool)
+
+        if self.type == ANALITICO_TYPE_INTEGER:
+            if series.dtype == PD_TYPE_INTEGER:
+                return series
+            if self.nullable:
+                return series.astype("Int64")
+            # missing values converted to 0
+            return series.fillna(0).astype(int) if series.hasnans else series.astype(int)
+
+        if self.type == ANALITICO_TYPE_DATETIME:
+            return self.cast_datetime(series)
+
+        if self.type == ANALITICO_TYPE_TIMESPAN:
+            return pd.to_timedelta(series)
+
+        if self.type == ANALITICO_TYPE_CATEGORY:
+            return series if series.dtype.name == PD_TYPE_CATEGORY else series.astype(PD_TYPE_CATEGORY)
+
+        return series
+
+    def cast_datetime(self, series: pd.Series) -> pd.Series:
+        """ Casts strings to datetimes using a single mask for all missing date markers """
+        if series.dtype == "datetime64[ns]":
+            return series
+        series = series.mask(series.isin(NA_DATES))
 
-        # we are being requested to apply type to the column
-        if "type" in column:
+        # plans are shared by all executions of a schema so the cached format is only
+        # replaced by a format that parsed a whole series and a failed parse only means
+        # that this series is in a different format, which is then inferred from its data
+        dates = self._to_datetime(series, self.datetime_format)
+        if dates is None and guess_datetime_format:
+            valid = series.notna().values
+            if valid.any():
+                value = series.iloc[valid.argmax()]
+                if isinstance(value, str):
+                    datetime_format = guess_datetime_format(value)
+                    if datetime_format and datetime_format != self.datetime_format:
+                        dates = self._to_datetime(series, datetime_format)
+                        if dates is not None:
+                            self.datetime_format = datetime_format
+        if dates is None:
+            # mixed formats or format could not be inferred, parse one by one
+            return series.astype("datetime64[ns]")
+        if dates.dt.tz is not None:
+            dates = dates.dt.tz_convert(None)
+        return dates
+
+    def _to_datetime(self, series: pd.Series, datetime_format: str) -> pd.Series:
+        """ Returns the series parsed with the given format or None if the format does not match all values """
+        if datetime_format:
+            try:
+                return pd.to_datetime(series, format=datetime_format)
+            except (ValueError, TypeError):
+                pass
+        return None
+
+    def apply(self, df: pd.DataFrame) -> str:
+        """ Applies type, rename and index to the column in place, returns the column's final name """
+        column_name = self.name
+        if self.type:
             try:
-                column_type = column["type"]
-                missing = column_name not in df.columns
-                if column_type == "string":
-                    if missing:
-                        df[column_name] = None
-                    df[column_name] = df[column_name].astype(str)
-                elif column_type == "float":
-                    if missing:
-                        df[column_name] = np.nan
-                    df[column_name].fillna(0)
-                    df[column_name] = df[column_name].astype(float)
-                elif column_type == "boolean":
-                    if missing:
-                        df[column_name] = False
-                    # missing values are converted to False
-                    df[column_name] = df[column_name].fillna(False).astype(bool)
-                elif column_type == "integer":
-                    if missing:
-                        df[column_name] = 0
-                    # missing values converted to 0
-                    df[column_name] = df[column_name].fillna(0).astype(int)
-                elif column_type == "datetime":
-                    if missing:
-                        df[column_name] = None
-                    else:
-                        # strings like no
-                        for not_a_date in NA_DATES:
-                            df[column_name].replace(not_a_date, np.nan, inplace=True)
-                    df[column_name] = df[column_name].astype("datetime64[ns]")
-                elif column_type == "timespan":
-                    if missing:
-                        df[column_name] = None
-                    df[column_name] = pd.to_timedelta(df[column_name])
-                elif column_type == "category":
-                    if missing:
-                        df[column_name] = None
-                    df[column_name] = df[column_name].astype("category")
-                else:
-                    raise Exception("apply_column - unknown type: " + column_type)
+                if column_name not in df.columns:
+                    defaults = {ANALITICO_TYPE_FLOAT: np.nan, ANALITICO_TYPE_BOOLEAN: False, ANALITICO_TYPE_INTEGER: 0}
+                    df[column_name] = defaults.get(self.type, None)
+                df[column_name] = self.cast(df[column_name])
             except Exception as exc:
-                msg = f"apply_column - exception while applying type {column_type} to column {column_name}"
-                raise AnaliticoException(msg)
+                msg = f"apply_column - exception while applying type {self.type} to column {column_name}"
+                raise AnaliticoException(msg) from exc
 
-        if "rename" in column:
-            df.rename(index=str, columns={column_name: column["rename"]}, inplace=True)
-            column_name = column["rename"]
+        if self.rename:
+            df.rename(index=str, columns={column_name: self.rename}, inplace=True)
+            column_name = self.rename
 
         # make requested column index
-        index = column.get("index", False)
-        if index:
+        if self.index:
             # we use this column as the index but do not remove it from
             # the columns otherwise we won't be able to rename it, etc
             df.set_index(column_name, drop=False, inplace=True)
 
         assert column_name in df.columns
+        return column_name
+
+
+class SchemaPlan:
+    """ 
+    A schema compiled into a plan of column casts which can be applied to many dataframes,
+    for example to each chunk of a large file or to each batch of data sent for prediction.
+    Plans can be obtained with compile_schema which caches them by schema.
+    """
+
+    def __init__(self, schema: dict):
+        assert isinstance(schema, dict), "compile_schema should be passed a schema dictionary"
+        self.schema = schema
+        self.columns = [ColumnPlan(column) for column in schema["columns"]] if "columns" in schema else None
+        self.apply = [ColumnPlan(column) for column in schema.get("apply", [])]
+        self.drop = [column.get("name") for column in schema.get("drop", []) if column.get("name")]
+
+    def execute(self, df: pd.DataFrame) -> pd.DataFrame:
+        """ Applies the planned casts, renames, reordering and drops to the given dataframe """
+        assert isinstance(df, pd.DataFrame), "apply_schema should be passed a pd.DataFrame, received: " + str(df)
+
+        # select columns and apply types to columns then reorder and remove extra columns
+        if self.columns is not None:
+            names = [column.apply(df) for column in self.columns]
+            return df[names]
+
+        for column in self.apply:
+            column.apply(df)
+
+        drop = [name for name in self.drop if name in df.columns]
+        if drop:
+            df.drop(columns=drop, inplace=True)
+        return df
+
+
+# compiled plans for recently used schemas
+SCHEMA_PLANS_CACHE_SIZE = 64
+_schema_plans = collections.OrderedDict()
+_schema_plans_lock = threading.Lock()
+
+
+def compile_schema(schema) -> SchemaPlan:
+    """ Returns a SchemaPlan for the given schema, plans are cached so the same schema is compiled only once """
+    if isinstance(schema, SchemaPlan):
+        return schema
+    key = json.dumps(schema, sort_keys=True, default=str)
+    with _schema_plans_lock:
+        plan = _schema_plans.get(key)
+        if plan:
+            _schema_plans.move_to_end(key)
+            return plan
+    plan = SchemaPlan(schema)
+    with _schema_plans_lock:
+        _schema_plans[key] = plan
+        while len(_schema_plans) > SCHEMA_PLANS_CACHE_SIZE:
+            _schema_plans.popitem(last=False)
+    return plan
+
+
+def apply_column(df: pd.DataFrame, column):
+    """ Apply given type to the column (parameters are type, name, etc from schema column) """
+    try:
+        assert isinstance(df, pd.DataFrame)
+        column_name = ColumnPlan(column).apply(df)
         return df[column_name]
 
     except AnaliticoException as exc:
@@ -186,38 +332,9 @@ def apply_schema(df: pd.DataFrame, schema):
     """ 
     Applies the given schema to the dataframe. The method will scan columns
     in the schema and apply their type to columns in the dataframe. It will
-    then sort, filter and rename columns according to schema.
+    then sort, filter and rename columns according to schema. The schema
+    can be a dictionary or a SchemaPlan obtained from compile_schema.
     """
     assert isinstance(df, pd.DataFrame), "apply_schema should be passed a pd.DataFrame, received: " + str(df)
-    assert isinstance(schema, dict), "apply_schema should be passed a schema dictionary"
-
-    # when a schema contains the 'columns' array, it means that we should
-    # apply the given columns transformations and end up with a dataframe
-    # containing only the given columns, ordered as specified. if the dataframe
-    # has any additional columns not listed in 'columns' they will be dropped.
-    if "columns" in schema:
-        # select columns and apply types to columns
-        names = []
-        for column in schema["columns"]:
-            ds = apply_column(df, column)
-            names.append(ds.name)
-        # reorder and remove extra columns
-        return df[names]
-
-    # when a schema contains the 'apply' array it means that we should
-    # apply the given column transformations to the dataframe. the array
-    # may or just one or a few columns, meaning all other columns are left
-    # as is. the order of items in 'apply' does not need to match the order
-    # in the dataframe
-    if "apply" in schema:
-        for column in schema["apply"]:
-            apply_column(df, column)
-
-    # if schema has a "drop" array then the columns
-    if "drop" in schema:
-        for column in schema["drop"]:
-            column_name = column.get("name")
-            if column_name and column_name in df.columns:
-                df.drop(columns=[column_name], inplace=True)
-
-    return df
+    assert isinstance(schema, (dict, SchemaPlan)), "apply_schema should be passed a schema dictionary"
+    return compile_schema(schema).execute(df)
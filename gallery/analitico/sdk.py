@@ -22,6 +22,44 @@ import analitico.models
 from analitico.utilities import id_generator, logger
 from analitico.models import Workspace, Item, Dataset, Recipe, Notebook
 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# number of connections kept alive in the pool of each host the sdk connects to
+SDK_POOL_SIZE = 10
+
+# number of times failed requests are retried and exponential backoff between retries
+SDK_RETRIES = 3
+SDK_BACKOFF_FACTOR = 0.5
+
+# responses which are retried as the service or storage may be temporarily unavailable
+SDK_RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+# methods which are retried, uploads are not retried as their body is streamed from a file
+SDK_RETRY_METHODS = frozenset(("HEAD", "GET", "OPTIONS", "DELETE", "PROPFIND"))
+
+
+def create_session(pool_size: int = SDK_POOL_SIZE, retries: int = SDK_RETRIES, backoff_factor=SDK_BACKOFF_FACTOR):
+    """ Returns a requests session with a pool of keep-alive connections that retries idempotent requests """
+    retry_methods = {"allowed_methods": SDK_RETRY_METHODS}
+    if "allowed_methods" not in inspect.signature(Retry.__init__).parameters:
+        retry_methods = {"method_whitelist": SDK_RETRY_METHODS}  # urllib3 < 1.26
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=SDK_RETRY_STATUS_CODES,
+        raise_on_status=False,
+        **retry_methods,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # responses are decoded transparently by requests
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    return session
+
+
 ##
 ## Models used in the SDK
 ##
@@ -30,8 +68,20 @@ from analitico.models import Workspace, Item, Dataset, Recipe, Notebook
 class AnaliticoSDK(AttributeMixin):
     """ An SDK for analitico.ai/api. """
 
-    def __init__(self, token=None, endpoint=None, workspace_id: str = None, **kwargs):
+    def __init__(
+        self,
+        token=None,
+        endpoint=None,
+        workspace_id: str = None,
+        pool_size: int = SDK_POOL_SIZE,
+        retries: int = SDK_RETRIES,
+        backoff_factor: float = SDK_BACKOFF_FACTOR,
+        **kwargs,
+    ):
         super().__init__(**kwargs)
+        # http connections are pooled and kept alive across calls
+        self._session = create_session(pool_size, retries, backoff_factor)
+
         if token:
             assert token.startswith("tok_")
             self.set_attribute("token", token)
@@ -70,6 +120,11 @@ class AnaliticoSDK(AttributeMixin):
     def workspace(self, workspace: Workspace):
         self._workspace = workspace
 
+    @property
+    def session(self) -> requests.Session:
+        """ Session with pooled connections used for all calls to the service and its storage """
+        return self._session
+
     @property
     def token(self):
         """ API token used to call endpoint (optional) """
@@ -160,17 +215,19 @@ class AnaliticoSDK(AttributeMixin):
         # we take the decoded content as a text string and turn it into a stream or we take the
         # decompressed binary content and also turn it into a stream.
         url, headers = self.get_url_headers(url)
-        response = requests.request(method, url, data=data, files=files, stream=True, headers=headers)
-        if status_code and response.status_code != status_code:
-            msg = f"The response from {url} should have been {status_code} but instead it is {response.status_code}."
-            raise AnaliticoException(msg)
-        # always treat content as binary, utf-8 encoding is done by readers
-        if binary:
-            for chunk in response.iter_content(chunk_size):
-                yield chunk
-        else:
-            for chunk in response.iter_content(chunk_size):
-                yield chunk
+        response = self.session.request(method, url, data=data, files=files, stream=True, headers=headers)
+        # connection is returned to the pool once the response is read or the stream is closed
+        with response:
+            if status_code and response.status_code != status_code:
+                msg = f"The response from {url} should have been {status_code} but instead it is {response.status_code}"
+                raise AnaliticoException(msg)
+            # always treat content as binary, utf-8 encoding is done by readers
+            if binary:
+                for chunk in response.iter_content(chunk_size):
+                    yield chunk
+            else:
+                for chunk in response.iter_content(chunk_size):
+                    yield chunk
 
     def get_url_json(self, url: str, json: dict = None, method: str = "GET", status_code: int = 200) -> dict:
         """
@@ -190,7 +247,7 @@ class AnaliticoSDK(AttributeMixin):
         """
         url, headers = self.get_url_headers(url)
 
-        response = requests.request(method, url, headers=headers, json=json)
+        response = self.session.request(method, url, headers=headers, json=json)
         if status_code and response.status_code != status_code:
             msg = f"The response from {url} should have been {status_code} but instead it is {response.status_code}."
             raise AnaliticoException(msg)
@@ -208,7 +265,11 @@ class AnaliticoSDK(AttributeMixin):
 
     def __exit__(self, exception_type, exception_value, traceback):
         """ Leave any temporary files upon exiting """
-        pass
+        self.close()
+
+    def close(self):
+        """ Closes pooled connections """
+        self._session.close()
 
     ##
     ## SDK v1 methods
@@ -7,3 +7,8 @@ from .test_mixin import TestMixin
 from .test_plugin import PluginTests
 from .test_metadata import MetadataTests
 from .test_sdk import SDKTests
+from .test_registry import RegistryTests
+from .test_cache import CacheTests
+from .test_asyncsdk import AsyncSDKTests
+from .test_upload import UploadTests
+from .test_profile import ProfileTests
@@ -0,0 +1,82 @@
+import unittest
+import os
+import os.path
+import json
+import asyncio
+import tempfile
+import threading
+import http.server
+import pytest
+
+from analitico.asyncsdk import AsyncAnaliticoSDK
+
+from .test_mixin import TestMixin
+
+# pylint: disable=no-member
+
+
+class ItemsRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ Serves datasets at /datasets/ds_xxx and their files at /datasets/ds_xxx/files/name """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) == 2:
+            body = json.dumps({"data": {"id": parts[1], "type": "analitico/dataset", "attributes": {}}})
+            body = body.encode()
+        else:
+            body = (parts[1] + "/" + parts[3]).encode() * 1000
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.mark.django_db
+class AsyncSDKTests(unittest.TestCase, TestMixin):
+    """ Testing of the asyncio sdk against a local server """
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ItemsRequestHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.endpoint = "http://127.0.0.1:%d/" % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_asyncsdk_get_items_concurrently(self):
+        async def _get_items():
+            async with AsyncAnaliticoSDK(endpoint=self.endpoint, max_concurrency=4) as sdk:
+                return await asyncio.gather(*[sdk.get_item(f"ds_{i}") for i in range(10)])
+
+        items = asyncio.run(_get_items())
+        self.assertEqual([item.id for item in items], [f"ds_{i}" for i in range(10)])
+
+    def test_asyncsdk_gather_downloads(self):
+        async def _download(directory):
+            async with AsyncAnaliticoSDK(endpoint=self.endpoint, max_concurrency=3) as sdk:
+                items = await asyncio.gather(*[sdk.get_item(f"ds_{i}") for i in range(5)])
+                downloads = [(item, "data.csv", os.path.join(directory, item.id + ".csv")) for item in items]
+                return await sdk.gather_downloads(downloads)
+
+        with tempfile.TemporaryDirectory() as directory:
+            filepaths = asyncio.run(_download(directory))
+            self.assertEqual(len(filepaths), 5)
+            for i, filepath in enumerate(filepaths):
+                with open(filepath, "rb") as f:
+                    self.assertEqual(f.read(), f"ds_{i}/data.csv".encode() * 1000)
+
+    def test_asyncsdk_stream(self):
+        async def _stream():
+            async with AsyncAnaliticoSDK(endpoint=self.endpoint) as sdk:
+                item = await sdk.get_item("ds_1")
+                return [chunk async for chunk in sdk.stream(item, "data.csv", chunk_size=1000)]
+
+        chunks = asyncio.run(_stream())
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b"".join(chunks), b"ds_1/data.csv" * 1000)
@@ -0,0 +1,106 @@
+import unittest
+import io
+import os
+import os.path
+import time
+import tempfile
+import pytest
+
+from analitico.cache import DiskCache, get_disk_cache
+from analitico.factory import Factory
+
+from .test_mixin import TestMixin
+
+# pylint: disable=no-member
+
+
+@pytest.mark.django_db
+class CacheTests(unittest.TestCase, TestMixin):
+    """ Unit testing of the disk cache used to store downloaded files """
+
+    def put(self, cache, unique_id, size=100):
+        filename = cache.put(unique_id, io.BytesIO(b"x" * size))
+        time.sleep(0.01)  # separate access times
+        return filename
+
+    def test_cache_put_get(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DiskCache(directory)
+            self.assertIsNone(cache.get("id1"))
+            filename = cache.put("id1", iter([b"abc", b"def"]))
+            self.assertEqual(filename, cache.get_filename("id1"))
+            self.assertEqual(cache.get("id1"), filename)
+            with open(filename, "rb") as f:
+                self.assertEqual(f.read(), b"abcdef")
+
+            stats = cache.stats
+            self.assertEqual(stats["files"], 1)
+            self.assertEqual(stats["size"], 6)
+            self.assertEqual(stats["hits"], 1)
+            self.assertEqual(stats["misses"], 1)
+            self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_cache_evict_lru(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DiskCache(directory, max_size=250, policy="lru")
+            self.put(cache, "id1")
+            self.put(cache, "id2")
+            cache.get("id1")  # id2 is now least recently used
+            self.put(cache, "id3")
+            self.assertIsNotNone(cache.get("id1"))
+            self.assertIsNone(cache.get("id2"))
+            self.assertIsNotNone(cache.get("id3"))
+            self.assertEqual(cache.stats["evictions"], 1)
+            self.assertEqual(cache.stats["size"], 200)
+
+    def test_cache_evict_lfu(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DiskCache(directory, max_size=250, policy="lfu")
+            self.put(cache, "id1")
+            cache.get("id1")
+            cache.get("id1")
+            self.put(cache, "id2")
+            cache.get("id2")  # id2 is most recently used but less frequently than id1
+            self.put(cache, "id3")
+            self.assertIsNotNone(cache.get("id1"))
+            self.assertIsNone(cache.get("id2"))
+            self.assertIsNotNone(cache.get("id3"))
+
+    def test_cache_shared_index(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache1 = DiskCache(directory)
+            cache2 = DiskCache(directory)
+            filename = self.put(cache1, "id1")
+            self.assertEqual(cache2.get("id1"), filename)
+            self.assertEqual(cache1.stats["hits"], 1)
+
+    def test_cache_untracked_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DiskCache(directory)
+            # files cached before the index existed are picked up when first requested
+            with open(cache.get_filename("id1"), "wb") as f:
+                f.write(b"abc")
+            self.assertIsNotNone(cache.get("id1"))
+            self.assertEqual(cache.stats["size"], 3)
+
+    def test_cache_clear(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DiskCache(directory)
+            filename = self.put(cache, "id1")
+            cache.clear()
+            self.assertFalse(os.path.isfile(filename))
+            self.assertEqual(cache.stats["files"], 0)
+            self.assertEqual(cache.stats["writes"], 0)
+
+    def test_cache_factory_cached_stream(self):
+        factory = Factory()
+        self.assertIs(factory.get_cache(), get_disk_cache(factory.get_cache_directory()))
+        unique_id = "test_cache_factory_cached_stream_" + str(time.time())
+        stream, filename = factory.get_cached_stream(io.BytesIO(b"abc"), unique_id)
+        with stream:
+            self.assertEqual(stream.read(), b"abc")
+        # second time stream is read from cache and source stream is not used
+        stream, filename2 = factory.get_cached_stream(io.BytesIO(b"def"), unique_id)
+        with stream:
+            self.assertEqual(stream.read(), b"abc")
+        self.assertEqual(filename, filename2)
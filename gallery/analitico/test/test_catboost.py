@@ -1,14 +1,17 @@
 import unittest
 import os
 import os.path
+import tempfile
 import pytest
 import pandas as pd
+import numpy as np
 
 import sklearn.metrics
 from sklearn.datasets import load_boston
 
 from analitico.factory import Factory
 from analitico.plugin import *
+from analitico.pandas import pd_to_json_dict
 from .test_mixin import TestMixin
 
 # pylint: disable=no-member
@@ -20,6 +23,16 @@ ASSETS_PATH = os.path.dirname(os.path.realpath(__file__)) + "/assets"
 class CatBoostTests(unittest.TestCase, TestMixin):
     """ Unit testing of machine learning algorithms """
 
+    def setUp(self):
+        # models, training samples and catboost_info are written to the working directory
+        self.cwd = os.getcwd()
+        self.artifacts = tempfile.TemporaryDirectory()
+        os.chdir(self.artifacts.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.artifacts.cleanup()
+
     def train_iris(self, factory):
         """ Train iris.csv dataset using a multiclass classifier, return df and training results """
         csv_path = self.get_asset_path("iris_1.csv")
@@ -257,6 +270,41 @@ class CatBoostTests(unittest.TestCase, TestMixin):
             factory.error("test_catboost_multiclass_classifier_prediction - " + str(exc))
             pass
 
+    def test_catboost_multiclass_classifier_prediction_columnar(self):
+        """ Test predictions with catboost as a multiclass classifier returning columnar results """
+        with Factory() as factory:
+            csv_path = self.get_asset_path("iris_1.csv")
+            df = pd.read_csv(csv_path)
+            df = df.drop(columns=["Id"])
+            df["Species"] = df["Species"].astype("category")
+            catboost = CatBoostPlugin(factory=factory, parameters={"learning_rate": 0.2})
+            training = catboost.run(df.copy(), action="recipe/train")
+            classes = training["data"]["classes"]
+
+            df = df.drop(columns=["Species"])
+            predict = catboost.run(df.copy(), action="endpoint/predict")
+
+            catboost.set_attribute("prediction.columnar", True)
+            catboost.set_attribute("prediction.drop_records", True)
+            columnar = catboost.run(df.copy(), action="endpoint/predict")
+
+            # class labels are returned once, predictions and probabilities as columns
+            self.assertEqual(columnar["classes"], classes)
+            self.assertNotIn("records", columnar)
+            self.assertIsInstance(columnar["predictions"], np.ndarray)
+            self.assertIsInstance(columnar["probabilities"], pd.DataFrame)
+            self.assertEqual(list(columnar["probabilities"].columns), classes)
+            self.assertEqual(len(columnar["probabilities"]), len(df))
+
+            # same results as regular predictions
+            self.assertEqual(list(columnar["predictions"]), predict["predictions"])
+            self.assertEqual(columnar["probabilities"].to_dict(orient="records"), predict["probabilities"])
+
+            # columnar results can be converted to json
+            json_results = pd_to_json_dict(columnar)
+            self.assertEqual(json_results["predictions"], predict["predictions"])
+            self.assertEqual(json_results["probabilities"][0].keys(), predict["probabilities"][0].keys())
+
     def test_catboost_regressor_training(self):
         """ Test training catboost as a regressor """
         try:
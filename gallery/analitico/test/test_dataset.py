@@ -1,8 +1,11 @@
 import unittest
 import pytest
+from unittest import mock
 import pandas as pd
 
-from analitico.schema import generate_schema, apply_schema
+from analitico import AnaliticoException
+from analitico.schema import generate_schema, apply_schema, compile_schema
+from analitico.dataset import Dataset
 
 from .test_mixin import TestMixin
 
@@ -423,6 +426,93 @@ class DatasetTests(unittest.TestCase, TestMixin):
         except Exception as exc:
             raise exc
 
+    def test_dataset_csv5_category_chunks(self):
+        """ Test reading categorical data in chunks """
+        try:
+            json = self.read_json_asset("ds_test_5_category_with_schema.json")
+            json["plugin"]["chunksize"] = 100
+            ds = Dataset(factory=self.factory, **json)
+
+            chunks = list(ds.plugin.run())
+            self.assertEqual(len(chunks), 3)
+            self.assertEqual(sum(len(chunk) for chunk in chunks), 206)
+            for chunk in chunks:
+                self.assertEqual(len(chunk.columns), 10)
+                self.assertEqual(chunk.dtypes[1], "category")  # name
+                self.assertEqual(chunk.dtypes[7], "bool")  # frozen
+        except Exception as exc:
+            raise exc
+
+    def test_dataset_compile_schema_cached(self):
+        """ Test compiling the same schema twice returns the same plan """
+        schema1 = {"columns": [{"name": "First", "type": "integer"}, {"name": "Second", "type": "string"}]}
+        schema2 = {"columns": [{"name": "First", "type": "integer"}, {"name": "Second", "type": "string"}]}
+        plan1 = compile_schema(schema1)
+        plan2 = compile_schema(schema2)
+        self.assertIs(plan1, plan2)
+        self.assertIs(compile_schema(plan1), plan1)
+
+        schema2["columns"][1]["type"] = "category"
+        plan3 = compile_schema(schema2)
+        self.assertIsNot(plan1, plan3)
+
+    def test_dataset_compile_schema_unknown_type(self):
+        """ Test compiling a schema with an unknown type """
+        with self.assertRaises(AnaliticoException):
+            compile_schema({"columns": [{"name": "First", "type": "imaginary"}]})
+
+    def test_dataset_compile_schema_integer_nullable(self):
+        """ Test integers with missing values are cast to 0 or kept as nulls if nullable """
+        df = pd.DataFrame({"First": [1, None, 3]})
+        df1 = apply_schema(df.copy(), {"columns": [{"name": "First", "type": "integer"}]})
+        self.assertEqual(df1.dtypes[0], "int64")
+        self.assertEqual(df1.iloc[1, 0], 0)
+
+        df2 = apply_schema(df.copy(), {"columns": [{"name": "First", "type": "integer", "nullable": True}]})
+        self.assertEqual(df2.dtypes[0], "Int64")
+        self.assertEqual(df2.iloc[0, 0], 1)
+        self.assertTrue(pd.isnull(df2.iloc[1, 0]))
+
+    def test_dataset_compile_schema_datetime_format(self):
+        """ Test datetime format is cached once it parsed a series and is not replaced by failed parses """
+        plan = compile_schema({"columns": [{"name": "Third", "type": "datetime"}]})
+        df1 = plan.execute(pd.DataFrame({"Third": ["2019-01-20 10:30:00", "null", "0", None]}))
+        self.assertEqual(df1.dtypes[0], "datetime64[ns]")
+        self.assertEqual(df1.iloc[0, 0], pd.Timestamp("2019-01-20 10:30:00"))
+        self.assertTrue(df1.iloc[1:, 0].isnull().all())
+        self.assertEqual(plan.columns[0].datetime_format, "%Y-%m-%d %H:%M:%S")
+
+        # mixed formats are parsed one by one and do not change the cached format
+        df2 = plan.execute(pd.DataFrame({"Third": ["N/A", "2019-02-01 16:30:15", "2019/03/01"]}))
+        self.assertTrue(pd.isnull(df2.iloc[0, 0]))
+        self.assertEqual(df2.iloc[1, 0], pd.Timestamp("2019-02-01 16:30:15"))
+        self.assertEqual(df2.iloc[2, 0], pd.Timestamp("2019-03-01"))
+        self.assertEqual(plan.columns[0].datetime_format, "%Y-%m-%d %H:%M:%S")
+
+        # later dataframes are parsed with the cached format without inferring it again
+        with mock.patch("analitico.schema.guess_datetime_format") as guess_datetime_format:
+            with mock.patch("analitico.schema.pd.to_datetime", wraps=pd.to_datetime) as to_datetime:
+                df3 = plan.execute(pd.DataFrame({"Third": ["2019-04-01 08:00:00", "2019-04-02 09:00:00"]}))
+        guess_datetime_format.assert_not_called()
+        to_datetime.assert_called_once_with(mock.ANY, format="%Y-%m-%d %H:%M:%S")
+        self.assertEqual(df3.iloc[1, 0], pd.Timestamp("2019-04-02 09:00:00"))
+
+        # a dataframe in another format is parsed with its own format which is then cached
+        df4 = plan.execute(pd.DataFrame({"Third": ["05/13/2019", "05/14/2019"]}))
+        self.assertEqual(df4.iloc[1, 0], pd.Timestamp("2019-05-14"))
+        self.assertEqual(plan.columns[0].datetime_format, "%m/%d/%Y")
+
+    def test_dataset_compile_schema_datetime_without_format_inference(self):
+        """ Test datetimes are parsed without a format when pandas' private format inference is not available """
+        plan = compile_schema({"columns": [{"name": "Fourth", "type": "datetime"}]})
+        with mock.patch("analitico.schema.guess_datetime_format", None):
+            df = plan.execute(pd.DataFrame({"Fourth": ["2019-01-20 10:30:00", "null", "2019-01-21 11:00:00"]}))
+        self.assertEqual(df.dtypes[0], "datetime64[ns]")
+        self.assertEqual(df.iloc[0, 0], pd.Timestamp("2019-01-20 10:30"))
+        self.assertTrue(pd.isnull(df.iloc[1, 0]))
+        self.assertEqual(df.iloc[2, 0], pd.Timestamp("2019-01-21 11:00"))
+        self.assertIsNone(plan.columns[0].datetime_format)
+
     # TODO: test reading number that use . for thousands (eg: en-us, locale)
 
     # TODO: test datetime in localized formats
@@ -5,6 +5,9 @@ import random
 import string
 import io
 import json
+import gzip
+import threading
+import http.server
 
 from analitico.factory import Factory
 from analitico.schema import generate_schema
@@ -16,6 +19,30 @@ from .test_mixin import TestMixin
 TITANIC_PUBLIC_URL = "https://storage.googleapis.com/eu.artifacts.analitico-api.appspot.com/data/train-titanic.csv"
 
 
+class EtagRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ Serves a gzipped csv with an etag and answers 304 when the etag matches """
+
+    content = b"a,b\n1,2\n3,4\n"
+    requests = []
+
+    def do_GET(self):
+        EtagRequestHandler.requests.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = gzip.compress(self.content)
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
 class FactoryTests(unittest.TestCase, TestMixin):
     """ Unit testing of Factory functionality: caching, creating items, plugins, etc """
 
@@ -66,3 +93,38 @@ class FactoryTests(unittest.TestCase, TestMixin):
         self.assertTrue("hardware" in data)
         self.assertTrue("platform" in data)
         self.assertTrue("python" in data)
+
+    def test_factory_get_url_stream_etag(self):
+        server = http.server.HTTPServer(("127.0.0.1", 0), EtagRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = "http://127.0.0.1:%d/%s.csv" % (server.server_port, self.random_long_name()[:32])
+            EtagRequestHandler.requests = []
+
+            # first request is streamed, decoded and written to cache while it is read
+            with self.factory.get_url_stream(url) as stream:
+                self.assertEqual(stream.read(), EtagRequestHandler.content)
+            cache_filename = self.factory.get_cache().get(url + '"v1"')
+            self.assertIsNotNone(cache_filename)
+
+            # second request is conditional and is read from cache
+            with self.factory.get_url_stream(url) as stream:
+                df = pd.read_csv(stream)
+                self.assertEqual(stream.name, cache_filename)
+            self.assertEqual(len(df), 2)
+            self.assertEqual(EtagRequestHandler.requests, [None, '"v1"'])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_factory_get_url_stream_partial_read_not_cached(self):
+        server = http.server.HTTPServer(("127.0.0.1", 0), EtagRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = "http://127.0.0.1:%d/%s.csv" % (server.server_port, self.random_long_name()[:32])
+            with self.factory.get_url_stream(url) as stream:
+                stream.read(1)
+            self.assertIsNone(self.factory.get_cache().get(url + '"v1"'))
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -1,5 +1,7 @@
+import io
 import unittest
 import tempfile
+import os.path
 import numpy as np
 import pytest
 
@@ -9,6 +11,8 @@ from datetime import datetime, timedelta
 
 from analitico.pandas import *
 
+from .test_mixin import ASSETS_PATH
+
 
 @pytest.mark.django_db
 class PandasTests(unittest.TestCase):
@@ -168,3 +172,79 @@ class PandasTests(unittest.TestCase):
         self.assertEqual(df2["Dates1.day"].dtype, "category")
         self.assertEqual(df2["Dates1.hour"].dtype, "category")
         self.assertEqual(df2["Dates1.minute"].dtype, "category")
+
+    def test_pandas_read_csv_chunks(self):
+        path = os.path.join(ASSETS_PATH, "ds_test_5_category.csv")
+        df = pd_read_csv(path)
+        chunks = list(pd_read_csv_chunks(path, chunksize=50))
+
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(len(chunks[0]), 50)
+        self.assertEqual(len(chunks[4]), 6)
+        self.assertEqual(sum(len(chunk) for chunk in chunks), len(df))
+        self.assertEqual(list(chunks[0].columns), list(df.columns))
+
+    def test_pandas_read_csv_chunks_with_schema(self):
+        path = os.path.join(ASSETS_PATH, "ds_test_5_category.csv")
+        schema = {
+            "columns": [
+                {"name": "id", "type": "integer"},
+                {"name": "slug", "type": "category", "rename": "category"},
+                {"name": "frozen", "type": "boolean"},
+            ]
+        }
+        df = pd_read_csv(path, schema)
+        chunks = list(pd_read_csv(path, schema, chunksize=50))
+
+        self.assertEqual(len(chunks), 5)
+        for chunk in chunks:
+            self.assertEqual(list(chunk.columns), ["id", "category", "frozen"])
+            self.assertEqual(chunk.dtypes[0], "int")
+            self.assertEqual(chunk.dtypes[1], "category")
+            self.assertEqual(chunk.dtypes[2], "bool")
+
+        # rows are the same as when reading the whole file at once
+        df_chunks = pd.concat(chunks)
+        self.assertTrue((df["id"].values == df_chunks["id"].values).all())
+        self.assertTrue((df["category"].astype(str).values == df_chunks["category"].astype(str).values).all())
+
+    def test_pandas_read_csv_chunks_consistent_categories(self):
+        path = os.path.join(ASSETS_PATH, "ds_test_5_category.csv")
+        schema = {"columns": [{"name": "id", "type": "integer"}, {"name": "slug", "type": "category"}]}
+        chunks = list(pd_read_csv_chunks(path, schema, chunksize=50))
+
+        # categories only grow from chunk to chunk and codes never change
+        for previous, chunk in zip(chunks[:-1], chunks[1:]):
+            previous_categories = list(previous["slug"].cat.categories)
+            categories = list(chunk["slug"].cat.categories)
+            self.assertGreater(len(categories), len(previous_categories))
+            self.assertEqual(categories[: len(previous_categories)], previous_categories)
+
+        # chunks are concatenated with union_categoricals without losing the categorical type or codes
+        self.assertEqual(pd.concat(chunks)["slug"].dtype.name, "object")
+        slugs = pd.api.types.union_categoricals([chunk["slug"] for chunk in chunks])
+        self.assertEqual(list(slugs.categories), list(chunks[-1]["slug"].cat.categories))
+        self.assertEqual(list(slugs.codes[:50]), list(chunks[0]["slug"].cat.codes))
+
+    def test_pandas_read_csv_chunks_consistent_dtypes(self):
+        """ Integer columns with missing values only in later chunks keep the same dtype in all chunks """
+        csv = "id,count,price\n1,10,5\n2,20,6\n3,,7.5\n4,40,8\n5,50,9\n6,60,10\n"
+        chunks = list(pd_read_csv_chunks(io.StringIO(csv), chunksize=2))
+        self.assertEqual([str(chunk["count"].dtype) for chunk in chunks], ["Int64", "Int64", "Int64"])
+        self.assertTrue(pd.isna(chunks[1]["count"].iloc[0]))
+        self.assertEqual(list(pd.concat(chunks)["count"].fillna(0)), [10, 20, 0, 40, 50, 60])
+
+        # float values in a column that was integer can't be kept as integers, the column is
+        # float64 from the first chunk with floats on while chunks already yielded stay Int64
+        self.assertEqual([str(chunk["price"].dtype) for chunk in chunks], ["Int64", "float64", "float64"])
+        self.assertEqual(list(pd.concat(chunks)["price"].astype(float)), [5, 6, 7.5, 8, 9, 10])
+
+        # integer values in a column that was float keep the float dtype
+        csv = "id,weight\n1,1.5\n2,2.5\n3,3\n4,4\n"
+        chunks = list(pd_read_csv_chunks(io.StringIO(csv), chunksize=2))
+        self.assertEqual([str(chunk["weight"].dtype) for chunk in chunks], ["float64", "float64"])
+
+        # columns typed by the schema are cast as requested
+        schema = {"columns": [{"name": "id", "type": "integer"}, {"name": "count", "type": "integer"}]}
+        chunks = list(pd_read_csv_chunks(io.StringIO("id,count\n1,10\n2,\n"), schema, chunksize=1))
+        self.assertEqual([str(chunk["count"].dtype) for chunk in chunks], ["int64", "int64"])
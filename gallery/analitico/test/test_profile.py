@@ -0,0 +1,84 @@
+import unittest
+import io
+import pytest
+import numpy as np
+import pandas as pd
+
+from analitico.pandas import pd_read_csv
+from analitico.profile import HyperLogLog, TDigest, DataFrameProfiler, profile_dataframe_chunks
+
+from .test_mixin import TestMixin
+
+# pylint: disable=no-member
+
+
+@pytest.mark.django_db
+class ProfileTests(unittest.TestCase, TestMixin):
+    """ Unit testing of the streaming statistics used to profile datasets """
+
+    def get_dataframe(self, rows=20000):
+        return pd.DataFrame(
+            {
+                "id": np.arange(rows),
+                "value": np.random.RandomState(42).normal(10, 2, rows),
+                "color": [["red", "green", "blue", None][i % 4] for i in range(rows)],
+            }
+        )
+
+    def test_profile_hyperloglog(self):
+        for distinct in (10, 1000, 100000):
+            hll = HyperLogLog()
+            hll.update(pd.Series(np.arange(distinct)))
+            hll.update(pd.Series(np.arange(distinct)))  # duplicates are not counted again
+            self.assertAlmostEqual(hll.count(), distinct, delta=distinct * 0.03)
+
+    def test_profile_hyperloglog_merge(self):
+        hll1, hll2 = HyperLogLog(), HyperLogLog()
+        hll1.update(pd.Series(["item_%d" % i for i in range(5000)]))
+        hll2.update(pd.Series(["item_%d" % i for i in range(2500, 7500)]))
+        hll1.merge(hll2)
+        self.assertAlmostEqual(hll1.count(), 7500, delta=7500 * 0.03)
+
+    def test_profile_tdigest_quantiles(self):
+        values = np.random.RandomState(42).normal(0, 1, 200000)
+        digest = TDigest()
+        for chunk in np.array_split(values, 20):
+            digest.update(chunk)
+        self.assertEqual(digest.count, len(values))
+        self.assertLessEqual(len(digest.means), 2 * digest.compression)
+        for q in (0.01, 0.25, 0.5, 0.75, 0.99):
+            self.assertAlmostEqual(digest.quantile(q), np.quantile(values, q), delta=0.05)
+        self.assertEqual(digest.quantile(0), values.min())
+        self.assertEqual(digest.quantile(1), values.max())
+
+    def test_profile_chunks_match_whole(self):
+        df = self.get_dataframe()
+        whole = profile_dataframe_chunks([df])
+        chunked = profile_dataframe_chunks(np.array_split(df, 7))
+        self.assertEqual(whole["total_records"], 20000)
+        self.assertEqual(whole["schema"], chunked["schema"])
+        for name in ("id", "value", "color"):
+            for stat in ("count", "nulls", "distinct", "min", "max"):
+                self.assertEqual(whole["statistics"][name].get(stat), chunked["statistics"][name].get(stat))
+
+        stats = chunked["statistics"]
+        self.assertEqual(stats["color"]["nulls"], 5000)
+        self.assertEqual(stats["color"]["distinct"], 3)
+        self.assertEqual(stats["id"]["min"], 0)
+        self.assertEqual(stats["id"]["max"], 19999)
+        self.assertAlmostEqual(stats["value"]["mean"], 10, delta=0.1)
+        self.assertAlmostEqual(stats["value"]["quantiles"]["0.5"], 10, delta=0.1)
+        self.assertNotIn("quantiles", stats["color"])
+
+    def test_profile_csv_chunks_widen_types(self):
+        # integers in the first chunk, decimals in the second
+        csv = "number,text\n" + "\n".join(f"{i},t{i}" for i in range(100)) + "\n1.5,x\n"
+        chunks = pd_read_csv(io.StringIO(csv), chunksize=50)
+        profiler = DataFrameProfiler()
+        for chunk in chunks:
+            profiler.update(chunk)
+        metadata = profiler.get_metadata()
+        self.assertEqual(metadata["total_records"], 101)
+        self.assertEqual(metadata["schema"]["columns"][0], {"name": "number", "type": "float"})
+        self.assertEqual(metadata["statistics"]["number"]["max"], 99)
+        self.assertEqual(metadata["statistics"]["text"]["distinct"], 101)
@@ -0,0 +1,112 @@
+import unittest
+import os
+import os.path
+import tempfile
+import pytest
+import pandas as pd
+
+from analitico.factory import Factory
+from analitico.plugin import CatBoostPlugin
+from analitico.registry import ModelRegistry, model_registry
+from analitico.utilities import save_json, read_json
+
+from .test_mixin import TestMixin
+
+# pylint: disable=no-member
+
+
+@pytest.mark.django_db
+class RegistryTests(unittest.TestCase, TestMixin):
+    """ Unit testing of the registry used to cache trained models """
+
+    def setUp(self):
+        # models and training samples are written to the working directory
+        self.cwd = os.getcwd()
+        self.artifacts = tempfile.TemporaryDirectory()
+        os.chdir(self.artifacts.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.artifacts.cleanup()
+
+    def save_artifact(self, directory, name, content):
+        path = os.path.join(directory, name)
+        save_json(content, path)
+        return path
+
+    def test_registry_get_cached(self):
+        with tempfile.TemporaryDirectory() as directory:
+            registry = ModelRegistry(max_size=4)
+            path = self.save_artifact(directory, "metadata.json", {"id": 1})
+
+            loaded1 = registry.get(path, read_json)
+            loaded2 = registry.get(path, read_json)
+            self.assertIs(loaded1, loaded2)
+            self.assertEqual(loaded1["id"], 1)
+
+            stats = registry.stats
+            self.assertEqual(stats["hits"], 1)
+            self.assertEqual(stats["misses"], 1)
+            self.assertEqual(stats["evictions"], 0)
+            self.assertEqual(stats["size"], 1)
+
+    def test_registry_get_kinds(self):
+        with tempfile.TemporaryDirectory() as directory:
+            registry = ModelRegistry(max_size=4)
+            path = self.save_artifact(directory, "metadata.json", {"id": 1})
+
+            loaded = registry.get(path, read_json)
+            keys = registry.get(path, lambda p: list(read_json(p).keys()), "keys")
+            self.assertEqual(loaded, {"id": 1})
+            self.assertEqual(keys, ["id"])
+            self.assertEqual(len(registry), 2)
+
+    def test_registry_reload_when_changed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            registry = ModelRegistry(max_size=4)
+            path = self.save_artifact(directory, "metadata.json", {"id": 1})
+            self.assertEqual(registry.get(path, read_json)["id"], 1)
+
+            # artifact is rewritten, eg. model is retrained
+            self.save_artifact(directory, "metadata.json", {"id": 22})
+            os.utime(path, ns=(0, 0))
+            self.assertEqual(registry.get(path, read_json)["id"], 22)
+            self.assertEqual(registry.stats["misses"], 2)
+
+    def test_registry_evictions(self):
+        with tempfile.TemporaryDirectory() as directory:
+            registry = ModelRegistry(max_size=2)
+            path1 = self.save_artifact(directory, "metadata1.json", {"id": 1})
+            path2 = self.save_artifact(directory, "metadata2.json", {"id": 2})
+            path3 = self.save_artifact(directory, "metadata3.json", {"id": 3})
+
+            registry.get(path1, read_json)
+            registry.get(path2, read_json)
+            registry.get(path1, read_json)  # path2 is now least recently used
+            registry.get(path3, read_json)
+
+            stats = registry.stats
+            self.assertEqual(stats["size"], 2)
+            self.assertEqual(stats["evictions"], 1)
+
+            registry.get(path1, read_json)
+            self.assertEqual(registry.stats["hits"], 2)
+            registry.get(path2, read_json)
+            self.assertEqual(registry.stats["misses"], 4)
+
+    def test_registry_catboost_prediction_cached(self):
+        with Factory() as factory:
+            df = pd.read_csv(self.get_asset_path("iris_1.csv"))
+            df = df.drop(columns=["Id"])
+            df["Species"] = df["Species"].astype("category")
+            catboost = CatBoostPlugin(factory=factory, parameters={"learning_rate": 0.2})
+            catboost.run(df.copy(), action="recipe/train")
+
+            hits = model_registry.stats["hits"]
+            df = df.drop(columns=["Species"])
+            predict1 = catboost.run(df.copy(), action="endpoint/predict")
+            predict2 = catboost.run(df.copy(), action="endpoint/predict")
+            self.assertEqual(predict1["predictions"], predict2["predictions"])
+
+            # second prediction reuses model, metadata and schema
+            self.assertGreaterEqual(model_registry.stats["hits"], hits + 3)
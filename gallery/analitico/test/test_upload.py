@@ -0,0 +1,102 @@
+import unittest
+import os
+import os.path
+import json
+import tempfile
+import threading
+import http.server
+import urllib.parse
+import pytest
+
+from unittest import mock
+
+from analitico import AnaliticoException
+from analitico.sdk import AnaliticoSDK
+from analitico.models import Dataset
+
+from .test_mixin import TestMixin
+
+# pylint: disable=no-member
+
+
+class UploadsRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ Receives multipart uploads at /datasets/ds_xxx/files/name and assembles them with a job """
+
+    protocol_version = "HTTP/1.1"
+
+    # parts received by upload_id and part number
+    parts = {}
+    # statuses returned when the assemble job is polled
+    job_statuses = []
+
+    def _reply(self, status_code, data=None):
+        body = json.dumps(data).encode() if data is not None else b""
+        self.send_response(status_code)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+        if "uploads" in query:
+            return self._reply(201, {"data": {"upload_id": "u1"}})
+        # files over UPLOAD_ASSEMBLE_JOB_SIZE_MB are assembled by a job
+        self._reply(202, {"data": {"upload_id": query["upload_id"], "job_id": "jb_1"}})
+
+    def do_PUT(self):
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+        self.parts[int(query["part"])] = self.rfile.read(int(self.headers["Content-Length"]))
+        self._reply(204)
+
+    def do_GET(self):
+        if "/k8s/jobs/jb_1" in self.path:
+            return self._reply(200, {"status": self.job_statuses.pop(0)})
+        self._reply(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.mark.django_db
+class UploadTests(unittest.TestCase, TestMixin):
+    """ Testing of multipart uploads against a local server """
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), UploadsRequestHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.sdk = AnaliticoSDK(endpoint="http://127.0.0.1:%d/" % self.server.server_port)
+        self.directory = tempfile.TemporaryDirectory()
+        UploadsRequestHandler.parts = {}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def upload(self, data: bytes):
+        filepath = os.path.join(self.directory.name, "large.bin")
+        with open(filepath, "wb") as f:
+            f.write(data)
+        state_directory = os.path.join(self.directory.name, "state")
+        dataset = Dataset(self.sdk, {"id": "ds_1", "type": "analitico/dataset", "attributes": {}})
+        with mock.patch("analitico.models.item.UPLOAD_STATE_DIRECTORY", state_directory):
+            with mock.patch("analitico.models.item.UPLOAD_ASSEMBLE_POLL_SECONDS", 0):
+                try:
+                    return dataset._upload_multipart(filepath, "large.bin", part_size=4)
+                finally:
+                    self.state_files = os.listdir(state_directory)
+
+    def test_upload_multipart_assembled_by_job(self):
+        """ Uploads over UPLOAD_ASSEMBLE_JOB_SIZE_MB return 202 and complete when the job does """
+        UploadsRequestHandler.job_statuses = [{"active": 1}, {"active": 1}, {"succeeded": 1}]
+        self.assertTrue(self.upload(b"0123456789"))
+        self.assertEqual(b"".join(UploadsRequestHandler.parts[part] for part in (1, 2, 3)), b"0123456789")
+        self.assertEqual(UploadsRequestHandler.job_statuses, [])
+        self.assertEqual(self.state_files, [])
+
+    def test_upload_multipart_assembled_by_job_failed(self):
+        """ Failed assemble jobs raise and keep the state so the upload can be resumed """
+        UploadsRequestHandler.job_statuses = [{"active": 1}, {"failed": 1}]
+        with self.assertRaises(AnaliticoException):
+            self.upload(b"0123456789")
+        self.assertEqual(len(self.state_files), 1)
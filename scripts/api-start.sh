@@ -33,6 +33,12 @@ cd $DJANGODIR
 
 export DJANGO_SETTINGS_MODULE=$DJANGO_SETTINGS_MODULE
 
+# Track jobs on Kubernetes and notify when they complete or fail, a tracker
+# runs with each replica and the one holding a lease writes the jobs.
+# The tracker is restarted if it stops, eg. when the API server can't be reached.
+echo "Start job tracker"
+(while true; do ./manage.py jobtracker; sleep 10; done) &
+
 # Start your Django Unicorn.
 # Programs meant to be run under supervisor should not daemonize themselves 
 # (do not use --daemon)
@@ -10,6 +10,7 @@ import logging
 from io import StringIO
 
 import analitico
+import analitico.pandas
 import analitico.utilities
 
 from analitico import AnaliticoException, logger
@@ -134,6 +135,10 @@ def handle_main():
                 body = body.to_json(orient="records", date_format="iso", date_unit="s", double_precision=6)
                 body = '{ "data": ' + body + " }"
 
+            # columnar results with numpy arrays and dataframes are converted in bulk
+            if isinstance(body, dict):
+                body = analitico.pandas.pd_to_json_dict(body)
+
             # objects other than strings are serialized to json
             # for strings we check first if they aren't json already
             if not isinstance(body, str) or not is_json(body):
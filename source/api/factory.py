@@ -76,14 +76,14 @@ class ServerFactory(Factory):
         # name of the file in cache is determined by its hash so all files are unique and
         # we do not need to check versions, eg. if we have it with the correct name it's
         # the correct version and we can save a rountrip to check with the server
-        storage_file = self.get_cache_filename(asset["hash"])
+        storage_file = self.get_cache().get(asset["hash"])
 
         # if not in cache already download it from storage
-        if not os.path.isfile(storage_file):
+        if not storage_file:
             storage = item.storage
             assert storage
             _, storage_stream = storage.download_object_via_stream(asset["path"])
-            _, storage_file = self.get_cached_stream(storage_stream, asset["hash"])
+            storage_file = self.get_cache().put(asset["hash"], storage_stream)
         return storage_file
 
     def get_url_stream(self, url, binary=False):
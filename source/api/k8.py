@@ -2,6 +2,7 @@ import os
 import shutil
 import tempfile
 import collections
+import concurrent.futures
 import json
 import urllib
 import base64
@@ -10,14 +11,17 @@ import collections
 import urllib.parse
 import requests
 import time
+import yaml
 from datetime import datetime, timedelta
 import dateutil.parser
 import django.conf
+import django.core.cache
 
 import analitico.utilities
 from rest_framework import status
 
 from analitico import AnaliticoException, logger
+from analitico.status import STATUS_RUNNING
 from analitico.utilities import (
     save_json,
     save_text,
@@ -32,12 +36,16 @@ from analitico.utilities import (
     cpu_unit_to_fractional,
     find_key,
     datetime_to_iso8601,
+    time_ms,
 )
 import api
 from api.factory import factory
 from api.models import ItemMixin, Job, Recipe, Model, Workspace, Automl
 from api.models.job import generate_job_id
 from api.models.notebook import nb_extract_serverless
+from api.k8client import get_k8_client
+from api.k8informers import k8_informers_get, k8_informers_observe, k8_informers_forget
+from api.k8manifests import k8_render_template
 
 K8_DEFAULT_NAMESPACE = "cloud"  # service.cloud.analitico.ai
 K8_DEFAULT_CONCURRENCY = 20  # concurrent connection per docker
@@ -63,29 +71,21 @@ def k8_normalize_name(name: str):
     return name.lower().replace("_", "-")
 
 
-def k8_workspace_env_vars_to_yaml(workspace: Workspace):
+def k8_workspace_env_vars(workspace: Workspace) -> [dict]:
     """ 
-    Convert the list of workspace's environment variables
-    into a yaml string to use when customizing and applying a yaml 
-    template in K8
+    Convert the workspace's environment variables into the list
+    of a container's env entries used when customizing templates
     """
     envs = workspace.get_attribute("env_vars", {})
-
-    envs_yaml = ""
-    # TODO: improve replacement of env vars by parsing the
-    # yaml with a dedicated library like PyYAML
-    for env_name in envs.keys():
-        envs_yaml += f"        - name: {env_name}\n"
-        envs_yaml += f"          value: {envs[env_name]}\n"
-
-    return envs_yaml
+    return [{"name": env_name, "value": str(env_value)} for env_name, env_value in envs.items()]
 
 
 def kubectl(
     namespace: str, action: str, resource: str, output: str = "json", context_name: str = None, args: [] = []
 ) -> (str, str):
     """ 
-    Exec operation on Kubernetes using Kubectl command 
+    Exec operation on Kubernetes using Kubectl command. Commands supported by K8Client are
+    sent directly to the API server, others are run with the kubectl binary.
     
     Arguments:
     ----------
@@ -103,6 +103,25 @@ def kubectl(
         Tuple : (str, str) -- from the run command
     """
     try:
+        # commands are run in process with a pooled connection to the API server when possible
+        client = get_k8_client(context_name)
+        if client and output in ("json", None):
+            try:
+                # reads of jobs, services, statefulsets and pods are answered from the informers' caches
+                if action == "get" and output and not context_name:
+                    response = k8_informers_get(namespace, resource, args=args)
+                    if response is not None:
+                        return response, ""
+                response = client.kubectl(namespace, action, resource, args=args)
+                if not context_name:
+                    if action == "delete":
+                        k8_informers_forget(namespace, resource, args=args)
+                    elif action in ("apply", "scale", "annotate"):
+                        k8_informers_observe(response)
+                return (response if output else ""), ""
+            except NotImplementedError as exc:
+                logger.info(f"kubectl - {exc}, running kubectl instead")
+
         namespace = ["--namespace", namespace] if namespace else []
         resource = [resource] if resource else []
         output_args = ["--output", output] if output else []
@@ -208,8 +227,7 @@ def k8_persistent_volume_deploy(workspace: Workspace, storage_size: str):
     secret_template = os.path.join(TEMPLATE_DIR, "drive-secret-template.yaml")
     template_filename = os.path.join(TEMPLATE_DIR, "persistent-volume-and-claim-template.yaml")
 
-    k8_customize_and_apply(secret_template, **configs)
-    k8_customize_and_apply(template_filename, **configs)
+    k8_customize_and_apply_all([secret_template, template_filename], **configs)
 
 
 def k8_build_v2(item: ItemMixin, target: ItemMixin, job_data: dict = None, push=True) -> dict:
@@ -340,6 +358,20 @@ def k8_deploy_v2(item: ItemMixin, target: ItemMixin, stage: str = K8_STAGE_PRODU
     Returns:
         dict -- The knative service information.
     """
+    try:
+        attrs, manifests = k8_deploy_v2_render(item, target, stage)
+        started_on = time_ms()
+        service_json = k8_apply_manifests(manifests)[0]
+        logger.info(f"k8_deploy_v2 - {attrs['name']}, apply: {time_ms(started_on)}ms")
+        return k8_deploy_v2_save(target, stage, attrs, service_json)
+    except AnaliticoException as exc:
+        raise exc
+    except Exception as exc:
+        raise AnaliticoException(f"Could not deploy {item.id} because: {exc}") from exc
+
+
+def k8_deploy_v2_render(item: ItemMixin, target: ItemMixin, stage: str = K8_STAGE_PRODUCTION) -> (dict, [dict]):
+    """ Returns the service information k8_deploy_v2 saves in the target and the knative service's manifests """
     try:
         # name of service we are deploying
         name = f"{target.id}-{stage}" if stage != K8_STAGE_PRODUCTION else target.id
@@ -395,30 +427,37 @@ def k8_deploy_v2(item: ItemMixin, target: ItemMixin, stage: str = K8_STAGE_PRODU
             configs["command"] = ["./tasks/serverless-start.sh"]
             configs["api_token"] = "None"
 
-        service_filename = os.path.join(TEMPLATE_DIR, "serving.yaml")
-        service_json = k8_customize_and_apply(service_filename, **configs)
+        started_on = time_ms()
+        manifests = k8_render_template(os.path.join(TEMPLATE_DIR, "serving.yaml"), **configs)
+        logger.info(f"k8_deploy_v2 - {service_name}, render: {time_ms(started_on)}ms")
 
-        # save deployment information inside item, endpoint and job
+        # deployment information saved inside item, endpoint and job
         attrs["type"] = "analitico/service"
         attrs["name"] = service_name
         attrs["item_id"] = item.id
         attrs["namespace"] = service_namespace
-        attrs["url"] = get_dict_dot(service_json, "status.url", None)
         attrs["docker"] = item.get_attribute("docker")
-        attrs["response"] = service_json
-
-        services[stage] = attrs
-        target.set_attribute("service", services)
-        target.save()
-
-        logger.debug(json.dumps(attrs, indent=4))
-        return attrs
+        return attrs, manifests
     except AnaliticoException as exc:
         raise exc
     except Exception as exc:
         raise AnaliticoException(f"Could not deploy {item.id} because: {exc}") from exc
 
 
+def k8_deploy_v2_save(target: ItemMixin, stage: str, attrs: dict, service_json: dict) -> dict:
+    """ Saves the information of the service deployed by k8_deploy_v2 in the target """
+    attrs["url"] = get_dict_dot(service_json, "status.url", None)
+    attrs["response"] = service_json
+
+    services = target.get_attribute("service", {})
+    services[stage] = attrs
+    target.set_attribute("service", services)
+    target.save()
+
+    logger.debug(json.dumps(attrs, indent=4))
+    return attrs
+
+
 def k8_autodeploy(item: ItemMixin, target: ItemMixin) -> dict:
     """ Check if the model is blessed and then deploy it.
 
@@ -574,7 +613,7 @@ def k8_jobs_create(
 
     # model deployed in production used for evaluating the bless model
     configs["blessed_model_id"] = item.get_attribute("service.production.item_id", "")
-    configs["env_vars"] = k8_workspace_env_vars_to_yaml(item.workspace)
+    configs["env_vars"] = k8_workspace_env_vars(item.workspace)
 
     # the run job needs to run using an image of the code that is the same of what we are running here
     # gitlab tags our build with the environment variable ANALITICO_COMMIT_SHA
@@ -592,20 +631,20 @@ def k8_jobs_create(
         configs["dataset_hash"] = "None"
 
         automl_config = item.get_attribute("automl")
-        configs["run_command"] = str(
-            [
-                "python3",
-                "/root/source/analitico_automl/trainer.py",
-                f"/mnt/analitico-drive/automls/{item.id}/models",
-                json.dumps(automl_config),
-            ]
-        )
+        configs["run_command"] = [
+            "python3",
+            "/root/source/analitico_automl/trainer.py",
+            f"/mnt/analitico-drive/automls/{item.id}/models",
+            json.dumps(automl_config),
+        ]
     elif job_action == analitico.ACTION_RUN or job_action == analitico.ACTION_RUN_AND_BUILD:
         # pass command that should be executed on job docker
         configs["job_template"] = os.path.join(TEMPLATE_DIR, "job-run-template.yaml")
-        configs["run_command"] = str(
-            ["python3", "./tasks/job.py", os.path.normpath(f"$ANALITICO_DRIVE/{item.type}s/{item.id}/{notebook_name}")]
-        )
+        configs["run_command"] = [
+            "python3",
+            "./tasks/job.py",
+            os.path.normpath(f"$ANALITICO_DRIVE/{item.type}s/{item.id}/{notebook_name}"),
+        ]
 
         configs["cpu_request"] = item.get_attribute("job.cpu_request", "500m")
         configs["memory_request"] = item.get_attribute("job.memory_request", "4Gi")
@@ -633,9 +672,7 @@ def k8_jobs_create(
         configs["target_id"] = model.id
         configs["target_type"] = model.type
         configs["job_template"] = os.path.join(TEMPLATE_DIR, "job-build-template.yaml")
-        configs["build_command"] = str(
-            ["/home/www/analitico/scripts/builder-start.sh", item.id, model.id, notebook_name]
-        )
+        configs["build_command"] = ["/home/www/analitico/scripts/builder-start.sh", item.id, model.id, notebook_name]
 
         configs["build_image"] = f"eu.gcr.io/analitico-api/analitico:{image_tag}"
 
@@ -645,7 +682,8 @@ def k8_jobs_create(
     if not "job_template" in configs:
         raise AnaliticoException(f"Unknown job action: {job_action}")
 
-    # webhook notification for job completion
+    # webhook notification for job completion, jobs are also tracked by api.k8jobtracker
+    # when it runs and both go through the same update so a job is only notified once
     from api.notifications import get_job_completion_webhook
 
     if not notification_server_name:
@@ -653,18 +691,22 @@ def k8_jobs_create(
     notification_url_path = get_job_completion_webhook(item.id, job_id, 10)
     configs["notification_url"] = urllib.parse.urljoin(notification_server_name, notification_url_path)
 
-    # k8s secret containing the credentials for the workspace mount
-    secret_template = os.path.join(TEMPLATE_DIR, "drive-secret-template.yaml")
-    secret = k8_customize_and_apply(secret_template, **configs)
+    # k8s secret containing the credentials for the workspace mount and the job that will launch
+    templates = [os.path.join(TEMPLATE_DIR, "drive-secret-template.yaml"), configs["job_template"]]
+    if isinstance(item, Automl):
+        # the automl serving endpoint is deployed or updated in the same batch as the job
+        attrs, serving = k8_deploy_v2_render(item, item, K8_STAGE_PRODUCTION)
+        secret, job, service_json = k8_customize_and_apply_all(templates, manifests=serving, **configs)
+        k8_deploy_v2_save(item, K8_STAGE_PRODUCTION, attrs, service_json)
+    else:
+        secret, job = k8_customize_and_apply_all(templates, **configs)
     assert secret, "kubectl did not apply the secret"
-
-    # k8s job that will launch
-    job = k8_customize_and_apply(configs["job_template"], **configs)
     assert job, "kubctl did not apply the job"
 
-    if isinstance(item, Automl):
-        # deploy or update the automl serving endpoint
-        k8_deploy_v2(item, item, K8_STAGE_PRODUCTION)
+    # the webhook or api.k8jobtracker update the job's status and notify when it completes
+    tracked = Job(id=job_id, workspace=item.workspace, item_id=item.id, action=job_action, status=STATUS_RUNNING)
+    tracked.set_attribute("k8_job", configs["job_id_slug"])
+    tracked.save()
 
     return job
 
@@ -672,9 +714,7 @@ def k8_jobs_create(
 def k8_jobs_get(item: ItemMixin, job_id: str = None) -> dict:
     try:
         # return specific job filtered by item_id and job_id
-        job, _ = subprocess_run(
-            cmd_args=["kubectl", "get", "job", k8_normalize_name(job_id), "-n", "cloud", "-o", "json"]
-        )
+        job, _ = kubectl(K8_DEFAULT_NAMESPACE, "get", "job/" + k8_normalize_name(job_id))
     except Exception as exec:
         raise AnaliticoException(
             f"Job {job_id} cannot be retrieved or not found", status_code=status.HTTP_404_NOT_FOUND
@@ -700,20 +740,16 @@ def k8_jobs_list(item: ItemMixin) -> [dict]:
     selectBy = f"workspace-id={item.id}" if item.type == "workspace" else f"item-id={item.id}"
 
     # return list of jobs filtered by item_id
-    jobs, _ = subprocess_run(
-        cmd_args=[
-            "kubectl",
-            "get",
-            "job",
-            "-n",
-            "cloud",
+    jobs, _ = kubectl(
+        K8_DEFAULT_NAMESPACE,
+        "get",
+        "job",
+        args=[
             "--selector",
             f"analitico.ai/job-action in ({analitico.ACTION_BUILD}, {analitico.ACTION_RUN}, {analitico.ACTION_RUN_AND_BUILD}),analitico.ai/{selectBy}",
             "--sort-by",
             ".metadata.creationTimestamp",
-            "-o",
-            "json",
-        ]
+        ],
     )
     return jobs
 
@@ -721,7 +757,7 @@ def k8_jobs_list(item: ItemMixin) -> [dict]:
 def k8_job_delete(job_id: str):
     """ Delete the job on Kubernetes """
     try:
-        subprocess_run(cmd_args=["kubectl", "delete", "job", job_id, "-n", "cloud"])
+        kubectl(K8_DEFAULT_NAMESPACE, "delete", "job/" + job_id, output=None)
     except Exception as exec:
         raise AnaliticoException(
             f"Job {job_id} cannot be deleted or not found", status_code=status.HTTP_404_NOT_FOUND
@@ -731,9 +767,10 @@ def k8_job_delete(job_id: str):
 def k8_job_generate_dataset_metadata(item: ItemMixin, dataset_path: str, dataset_hash: str, extra: dict = None):
     """ 
     Execute a job that opens a dataset with Pandas and generates
-    the file metadata with statistics, schema etc...
-    The metadata generation is made async due to memory limits with
-    large datasets.
+    the file metadata with statistics, schema etc... Smaller datasets are
+    profiled right away by the API, the job is used for large datasets.
+    The job's script in the automl image loads the whole dataset so it
+    needs plenty of memory until it profiles datasets in chunks too.
     """
     configs = k8_get_storage_volume_configuration(item)
 
@@ -747,7 +784,7 @@ def k8_job_generate_dataset_metadata(item: ItemMixin, dataset_path: str, dataset
     configs["dataset_hash"] = dataset_hash
     configs["job_action"] = analitico.ACTION_DATASET_METADATA
     configs["job_id"] = job_id
-    configs["env_vars"] = ""
+    configs["env_vars"] = []
     configs["run_image"] = "analitico/analitico-automl:latest"
     configs["notification_url"] = ""
     configs["cpu_request"] = "100m"
@@ -764,6 +801,50 @@ def k8_job_generate_dataset_metadata(item: ItemMixin, dataset_path: str, dataset
     return resource
 
 
+def k8_job_assemble_upload(item: ItemMixin, upload_path: str, path: str, part_paths: [str]) -> dict:
+    """
+    Starts a job that concatenates the parts of a multipart upload into the file at path directly
+    on the workspace's drive, then removes the upload's directory, so that large files are not
+    downloaded and uploaded again by the API. Paths are absolute paths in the workspace's storage.
+    """
+    configs = k8_get_storage_volume_configuration(item)
+    workspace = item if isinstance(item, Workspace) else item.workspace
+
+    configs["job_action"] = analitico.ACTION_UPLOAD
+    configs["job_id"] = job_id = generate_job_id()
+    configs["job_id_slug"] = k8_normalize_name(job_id)
+    configs["workspace_id"] = workspace.id
+    configs["workspace_id_slug"] = k8_normalize_name(workspace.id)
+    configs["item_id"] = item.id
+    configs["item_type"] = item.type
+    configs["notebook_name"] = ""
+    configs["blessed_model_id"] = ""
+    configs["notification_url"] = ""
+    configs["env_vars"] = []
+    configs["run_image"] = f"eu.gcr.io/analitico-api/analitico-client:{get_image_commit_sha()}"
+    configs["cpu_request"] = "100m"
+    configs["memory_request"] = "256Mi"
+    configs["cpu_limit"] = "1"
+    configs["memory_limit"] = "512Mi"
+
+    # paths are passed as arguments of the script and are never part of the script itself
+    drive = "/mnt/analitico-drive"
+    script = 'set -e; target="$1"; upload="$2"; shift 2; mkdir -p "$(dirname "$target")"; '
+    script += 'cat "$@" > "$upload/assembled"; mv "$upload/assembled" "$target"; rm -rf "$upload"'
+    configs["run_command"] = ["sh", "-c", script, "assemble", drive + path, drive + upload_path.rstrip("/")]
+    configs["run_command"] += [drive + part_path for part_path in part_paths]
+
+    templates = [os.path.join(TEMPLATE_DIR, name) for name in ("drive-secret-template.yaml", "job-run-template.yaml")]
+    secret, job = k8_customize_and_apply_all(templates, **configs)
+    assert secret, "kubectl did not apply the secret"
+    assert job, "kubctl did not apply the job"
+
+    tracked = Job(id=job_id, workspace=workspace, item_id=item.id, action=analitico.ACTION_UPLOAD, status=STATUS_RUNNING)
+    tracked.set_attribute("k8_job", configs["job_id_slug"])
+    tracked.save()
+    return job
+
+
 ##
 ## Jupyter - allocate and deallocate Jupyter server nodes
 ##
@@ -929,7 +1010,7 @@ def k8_jupyter_deploy(workspace: Workspace, settings: dict = None) -> dict:
     configs["image_name"] = f"eu.gcr.io/analitico-api/analitico-client:{image_tag}"
 
     # workspace's custom environment variables
-    configs["env_vars"] = k8_workspace_env_vars_to_yaml(workspace)
+    configs["env_vars"] = k8_workspace_env_vars(workspace)
 
     # generate a jupyter token for login
     token = id_generator(16)
@@ -938,22 +1019,16 @@ def k8_jupyter_deploy(workspace: Workspace, settings: dict = None) -> dict:
     configs["jupyter_token"] = str(base64.b64encode(token.encode()), "ascii")
     configs["secret_name"] = secret_name
 
-    # k8s secret containing the credentials for the workspace mount
+    # k8s secret containing the credentials for the workspace mount and jupyter kubernetes service
     drive_secret_template = os.path.join(TEMPLATE_DIR, "drive-secret-template.yaml")
-    secret = k8_customize_and_apply(drive_secret_template, **configs)
-
-    # jupyter kubernetes service
     jupyter_service_template = os.path.join(TEMPLATE_DIR, "jupyter-service-template.yaml")
-    service = k8_customize_and_apply(jupyter_service_template, **configs)
+    _, service = k8_customize_and_apply_all([drive_secret_template, jupyter_service_template], **configs)
 
+    # the jupyter token and the resources owned by the service are applied once its uid is known
     configs["owner_uid"] = service["metadata"]["uid"]
-
-    # jupyter token
     jupyter_secret_template = os.path.join(TEMPLATE_DIR, "jupyter-secret-template.yaml")
-    secret = k8_customize_and_apply(jupyter_secret_template, **configs)
-
     jupyter_template = os.path.join(TEMPLATE_DIR, "jupyter-template.yaml")
-    template = k8_customize_and_apply(jupyter_template, **configs)
+    k8_customize_and_apply_all([jupyter_secret_template, jupyter_template], **configs)
 
     # wait for pod to be started, deployed or restored to one replica
     # wait few seconds for the pod to be deployed
@@ -1064,9 +1139,134 @@ def k8_jupyter_deallocate(workspace, jupyter_name: str = None, wait_for_deletion
             raise e
 
 
+##
+## Scale to zero
+##
+
+# idle services are scaled to zero when all these metrics are at or below their target over the grace period,
+# each metric is retrieved with a single query for all the services and grouped by label into their values
+K8_SCALE_TO_ZERO_METRICS = [
+    {
+        "name": "max_cpu_usage_last_period",
+        "query": 'sum(max_over_time(container_cpu_usage_seconds_total_irate1m{{pod=~"{pods}",container=""}}[{grace_period}m])) by (pod)',
+        "label": "pod",
+        "key": "pod_name",
+        # cpu usage in the last period (target in cpu time)
+        "target": 0.1,
+        # in both cases, we cannot make any evaulation without the actual value
+        "replicas_missing_metric": 1,
+        "replicas_status_error": 1,
+    },
+    {
+        "name": "max_http_requests_last_period",
+        "query": 'sum(max_over_time(istio_requests_total_rate1m{{destination_service_name=~"{apps}",container=""}}[{grace_period}m])) by (destination_service_name)',
+        "label": "destination_service_name",
+        "key": "app",
+        "target": 0,
+        # when there are no metrics it might mean that it's not
+        # been made any requests to the service or problems with Prometheus.
+        # In any case we can consider it as zero requests.
+        # The other metrics will compensate this case.
+        "replicas_missing_metric": 0,
+        # we cannot make any evaulation without the actual value
+        "replicas_status_error": 1,
+    },
+]
+
+# services scaled to zero at the same time
+K8_SCALE_TO_ZERO_WORKERS = 8
+
+# seconds before a query to Prometheus times out
+K8_PROMETHEUS_TIMEOUT = 30
+
+# cache key for the number of passes and statistics of the last one
+K8_SCALE_TO_ZERO_STATS_CACHE_KEY = "k8_scale_to_zero_stats"
+
+
+def k8_prometheus_query(query: str, label: str) -> dict:
+    """ Runs an instant query on Prometheus and returns the value of each of its series keyed by the given label """
+    # queries for many pods are too long for a url, Prometheus also accepts them as a form
+    response = requests.post(
+        django.conf.settings.PROMETHEUS_SERVICE_URL + "/query", data={"query": query}, timeout=K8_PROMETHEUS_TIMEOUT
+    )
+    if response.status_code != 200:
+        raise AnaliticoException(
+            "failed to retrieve metric from Prometheus", status_code=response.status_code, extra=response.text
+        )
+    values = {}
+    for series in get_dict_dot(response.json(), "data.result") or []:
+        values[series["metric"].get(label)] = float(series["value"][1])
+    return values
+
+
+def k8_scale_to_zero_get_stats() -> dict:
+    """
+    Returns the number of passes made by k8_scale_to_zero and the statistics of the last one.
+    Stats are kept in the Django cache so they are shared by all workers in a pod, the cache is
+    local to the pod so each replica of the server reports the passes it made itself.
+    """
+    return django.core.cache.cache.get(K8_SCALE_TO_ZERO_STATS_CACHE_KEY) or {"passes": 0, "last_pass": None}
+
+
+def _k8_scale_to_zero_get_candidate(controller: dict) -> dict:
+    """ Returns the controller's settings if it has scale to zero enabled and is running, None otherwise """
+    annotations = controller["metadata"].get("annotations") or {}
+    enabled = str(annotations.get("analitico.ai/enable-scale-to-zero", "")).lower() == "true"
+    if not enabled or not get_dict_dot(controller, "spec.replicas", 0) > 0:
+        return None
+    candidate = {
+        "name": controller["metadata"]["name"],
+        "namespace": controller["metadata"].get("namespace", K8_DEFAULT_NAMESPACE),
+        "app": controller["metadata"]["labels"]["app"],
+        "workspace_id": controller["metadata"]["labels"]["analitico.ai/workspace-id"],
+        "grace_period": int(annotations["analitico.ai/scale-to-zero-grace-period"]),
+    }
+    if candidate["grace_period"] <= 0:
+        raise AnaliticoException(f"invalid scale to zero grace period: {candidate['grace_period']}")
+    return candidate
+
+
+def _k8_scale_to_zero_get_replicas(candidates: [dict], grace_period: int, stats: dict):
+    """ Evaluates the metrics of candidates with the same grace period and sets their desired replicas """
+    for candidate in candidates:
+        candidate["replicas"] = 0
+
+    # pod and service names are dns labels, they don't need escaping in a regex
+    pods = "|".join(candidate["pod_name"] for candidate in candidates)
+    apps = "|".join(candidate["app"] for candidate in candidates)
+    for metric in K8_SCALE_TO_ZERO_METRICS:
+        name, target = metric["name"], metric["target"]
+        query = metric["query"].format(pods=pods, apps=apps, grace_period=grace_period)
+        try:
+            stats["queries"] += 1
+            values = k8_prometheus_query(query, metric["label"])
+        except Exception as exc:
+            # error contacting Prometheus, none of the services can be evaluated
+            values = None
+            logger.warning(f"metric {name} cannot be evaluated - replicas set to {metric['replicas_status_error']}")
+            logger.warning(str(exc))
+
+        for candidate in candidates:
+            if values is None:
+                replicas = metric["replicas_status_error"]
+            elif candidate[metric["key"]] not in values:
+                replicas = metric["replicas_missing_metric"]
+                logger.info(f"{candidate['name']} metric {name} is missing - replicas set to {replicas}")
+            else:
+                value = values[candidate[metric["key"]]]
+                replicas = 0 if value <= float(target) else 1
+                logger.info(
+                    f"{candidate['name']} status - {name} (current / target): "
+                    f"{round(value, 4)} / {target} - replicas: {replicas}"
+                )
+            candidate["replicas"] = max(candidate["replicas"], replicas)
+
+
 def k8_scale_to_zero(controllers: [] = None) -> (int, int):
     """ 
     Scale to zero services which enabled this feature and they are in idle for a period of time.
+    Each metric is retrieved from Prometheus with a single query for all the services that have
+    the same grace period and the services that are idle are scaled to zero concurrently.
     
     Arguments:
     ----------
@@ -1077,134 +1277,103 @@ def k8_scale_to_zero(controllers: [] = None) -> (int, int):
     --------
         Tuple : (int, int) -- number of services scaled to zero and number of services with error.
     """
+    started_on = time_ms()
     if not controllers:
         controllers, _ = kubectl(K8_DEFAULT_NAMESPACE, "get", "statefulSet")
         controllers = controllers["items"]
 
-    total_scaled = total_scaled_unabled = 0
+    stats = dict.fromkeys(("controllers", "candidates", "in_grace_period", "scaled", "kept", "errors", "queries"), 0)
+    stats["controllers"] = len(controllers)
 
+    candidates = []
     for controller in controllers:
-        enabled = bool(controller["metadata"]["annotations"]["analitico.ai/enable-scale-to-zero"])
-        replicas = controller["spec"]["replicas"]
-        controller_name = controller["metadata"]["name"]
         try:
-            if enabled and replicas > 0:
-                desired_replicas = 0
-                logger.info("evaluate scale to zero condition for " + controller_name)
-
-                app = controller["metadata"]["labels"]["app"]
-                workspace_id = controller["metadata"]["labels"]["analitico.ai/workspace-id"]
-                grace_period = int(controller["metadata"]["annotations"]["analitico.ai/scale-to-zero-grace-period"])
-                namespace = controller["metadata"]["namespace"]
-                assert app and workspace_id and grace_period
-
-                logger.info(f"{controller_name} has scale to zero grace period set to {grace_period} minutes")
-
-                pod, _ = kubectl(
-                    namespace, "get", "pod", args=["--selector", f"app={app},analitico.ai/workspace-id={workspace_id}"]
-                )
-                pod = pod["items"][0]
-                pod_name = pod["metadata"]["name"]
-                assert pod
-
-                # check creation time to respect the minimum availability
-                now = datetime.utcnow()
-                # eg: 2019-11-25T11:16:04Z
-                creation_time = get_dict_dot(pod, "metadata.creationTimestamp")
-                running_since = datetime_to_iso8601(creation_time) if creation_time else datetime.utcnow()
-                running_for = (now - running_since).total_seconds()
-                logger.info(
-                    f"{controller_name} has been running since {running_since}Z ({round(running_for / 60)} minutes)"
-                )
-
-                is_enable_to_scale = running_for > (grace_period * 60)
-
-                if not is_enable_to_scale:
-                    logger.info(f"skip scaling - pod is running in the grace period")
-                else:
-                    # check for scaling status against the following metrics
-                    metrics = [
-                        {
-                            "name": "max_cpu_usage_last_period",
-                            "query": f'sum(max_over_time(container_cpu_usage_seconds_total_irate1m{{pod="{pod_name}",container=""}}[{grace_period}m])) by (pod)',
-                            # cpu usage in the last period (target in cpu time)
-                            "target": 0.1,
-                            # in both cases, we cannot make any evaulation without the actual value
-                            "replicas_missing_metric": 1,
-                            "replicas_status_error": 1,
-                        },
-                        {
-                            "name": "max_http_requests_last_period",
-                            "query": f'sum(max_over_time(istio_requests_total_rate1m{{destination_service_name="{app}",container=""}}[{grace_period}m])) by (destination_service_name)',
-                            "target": 0,
-                            # when there are no metrics it might mean that it's not
-                            # been made any requests to the service or problems with Prometheus.
-                            # In any case we can consider it as zero requests.
-                            # The other metrics will compensate this case.
-                            "replicas_missing_metric": 0,
-                            # we cannot make any evaulation without the actual value
-                            "replicas_status_error": 1,
-                        },
-                    ]
-
-                    desired_replicas = 0
-                    for metric in metrics:
-                        name = metric["name"]
-                        query = metric["query"]
-                        target = metric["target"]
-                        replicas_missing_metric = metric["replicas_missing_metric"]
-                        replicas_status_error = metric["replicas_status_error"]
-
-                        try:
-                            # contact Prometheus to retrieve the values for the given query
-                            response = requests.get(
-                                django.conf.settings.PROMETHEUS_SERVICE_URL + f"/query?query={query}"
-                            )
-                            if response.status_code != 200:
-                                raise AnaliticoException(
-                                    f"failed to retrieve metric from Prometheus - metric: {name}",
-                                    status_code=response.status_code,
-                                    extra=response.json(),
-                                )
-
-                            result = get_dict_dot(response.json(), "data.result")
-                            # we expect one point only
-                            if len(result) != 1:
-                                raise AnaliticoException(
-                                    f"invalid metric result - metric: {name}",
-                                    status_code=response.status_code,
-                                    extra=result,
-                                )
-                            value = result[0].get("value")[1]
-
-                            replicas = 0 if float(value) <= float(target) else 1
-                            logger.info(
-                                f"{controller_name} status - {name} (current / target): {round(float(value), 4)} / {target} - replicas: {replicas}"
-                            )
-                        except AnaliticoException as e:
-                            # metric returned no value
-                            if e.status_code == status.HTTP_200_OK:
-                                replicas = replicas_missing_metric
-                                logger.warning(f"metric {name} is missing - replicas set to {replicas}")
-                            else:
-                                # error contacting Prometheus
-                                replicas = replicas_status_error
-                                logger.warning(f"metric {name} cannot be evaluated - replicas set to {replicas}")
-
-                        desired_replicas = max(desired_replicas, replicas)
-
-                    logger.info(f"{controller_name} desired replicas is {desired_replicas}")
-                    if desired_replicas == 0:
-                        # do scale to zero
-                        kubectl(K8_DEFAULT_NAMESPACE, "scale", f"statefulset/{controller_name}", args=["--replicas=0"])
-                        total_scaled = total_scaled + 1
-                        logger.info(f"{controller_name} is scaled to zero successfully")
-
-        except Exception as exception:
-            total_scaled_unabled = total_scaled_unabled + 1
-            logger.error(f"cannot perform evaluation of scale to zero for {controller_name}. Skip.\n{str(exception)}")
-
-    return total_scaled, total_scaled_unabled
+            candidate = _k8_scale_to_zero_get_candidate(controller)
+            if candidate:
+                candidates.append(candidate)
+        except Exception as exc:
+            stats["errors"] += 1
+            name = controller["metadata"]["name"]
+            logger.error(f"cannot perform evaluation of scale to zero for {name}. Skip.\n{exc}")
+    stats["candidates"] = len(candidates)
+
+    # the pods of all the candidates in a namespace are listed at once
+    pods = {}
+    for namespace in {candidate["namespace"] for candidate in candidates}:
+        workspace_ids = {candidate["workspace_id"] for candidate in candidates if candidate["namespace"] == namespace}
+        try:
+            selector = f"analitico.ai/workspace-id in ({','.join(sorted(workspace_ids))})"
+            items, _ = kubectl(namespace, "get", "pod", args=["--selector", selector])
+            for pod in items["items"]:
+                labels = pod["metadata"].get("labels") or {}
+                key = (namespace, labels.get("app"), labels.get("analitico.ai/workspace-id"))
+                pods.setdefault(key, pod)
+        except Exception as exc:
+            logger.error(f"cannot list pods for scale to zero in namespace: {namespace}\n{exc}")
+
+    # check creation time to respect the minimum availability
+    now = datetime.utcnow()
+    grace_periods = collections.defaultdict(list)
+    for candidate in candidates:
+        pod = pods.get((candidate["namespace"], candidate["app"], candidate["workspace_id"]))
+        if not pod:
+            stats["errors"] += 1
+            logger.error(f"cannot perform evaluation of scale to zero for {candidate['name']}. Skip.\npod not found")
+            continue
+        candidate["pod_name"] = pod["metadata"]["name"]
+        # eg: 2019-11-25T11:16:04Z
+        creation_time = get_dict_dot(pod, "metadata.creationTimestamp")
+        running_since = dateutil.parser.parse(creation_time).replace(tzinfo=None) if creation_time else now
+        if (now - running_since).total_seconds() > candidate["grace_period"] * 60:
+            grace_periods[candidate["grace_period"]].append(candidate)
+        else:
+            stats["in_grace_period"] += 1
+            logger.info(f"{candidate['name']} skip scaling - pod is running in the grace period")
+
+    metrics_on = time_ms()
+    for grace_period, evaluated in grace_periods.items():
+        _k8_scale_to_zero_get_replicas(evaluated, grace_period, stats)
+    stats["metrics_ms"] = time_ms(metrics_on)
+
+    idle = []
+    for evaluated in grace_periods.values():
+        for candidate in evaluated:
+            if candidate["replicas"] == 0:
+                idle.append(candidate)
+            else:
+                stats["kept"] += 1
+
+    scale_on = time_ms()
+    if idle:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(K8_SCALE_TO_ZERO_WORKERS, len(idle))) as executor:
+            futures = {
+                executor.submit(
+                    kubectl, candidate["namespace"], "scale", f"statefulset/{candidate['name']}", args=["--replicas=0"]
+                ): candidate
+                for candidate in idle
+            }
+            for future in concurrent.futures.as_completed(futures):
+                name = futures[future]["name"]
+                try:
+                    future.result()
+                    stats["scaled"] += 1
+                    logger.info(f"{name} is scaled to zero successfully")
+                except Exception as exc:
+                    stats["errors"] += 1
+                    logger.error(f"cannot scale to zero {name}. Skip.\n{exc}")
+    stats["scale_ms"] = time_ms(scale_on)
+    stats["elapsed_ms"] = time_ms(started_on)
+
+    passes = k8_scale_to_zero_get_stats()["passes"] + 1
+    last_pass = {"completed_at": now.strftime("%Y-%m-%dT%H:%M:%SZ"), **stats}
+    django.core.cache.cache.set(K8_SCALE_TO_ZERO_STATS_CACHE_KEY, {"passes": passes, "last_pass": last_pass}, None)
+    logger.info(
+        f"k8_scale_to_zero - controllers: {stats['controllers']}, candidates: {stats['candidates']}, "
+        f"in grace period: {stats['in_grace_period']}, scaled: {stats['scaled']}, kept: {stats['kept']}, "
+        f"errors: {stats['errors']}, queries: {stats['queries']}, metrics: {stats['metrics_ms']}ms, "
+        f"scale: {stats['scale_ms']}ms, elapsed: {stats['elapsed_ms']}ms"
+    )
+    return stats["scaled"], stats["errors"]
 
 
 ##
@@ -1212,18 +1381,44 @@ def k8_scale_to_zero(controllers: [] = None) -> (int, int):
 ##
 
 
-def k8_customize_and_apply(template_path: str, context_name=None, **kwargs):
-    # Deploy a k8 resource using kubectl command:
-    # kubectl apply --filename item.yaml -o json
+def k8_apply_manifests(manifests: [dict], context_name: str = None) -> [dict]:
+    """ Applies all the resources with a single kubectl apply and returns them as applied, in the same order """
+    # kubectl apply --filename items.yaml -o json
     # https://kubernetes.io/docs/reference/generated/kubectl/kubectl-commands#apply
     # export KUBECONFIG=$HOME/.kube/config/admin.conf
     with tempfile.NamedTemporaryFile(mode="w+", suffix=".yaml") as f:
-        template_yaml = read_text(template_path)
-        template_yaml = template_yaml.format(**kwargs)
-        save_text(template_yaml, f.name)
+        yaml.safe_dump_all(manifests, f, default_flow_style=False)
+        f.flush()
         cmd_args = ["--filename", f.name]
         item_json, _ = kubectl(action="apply", namespace=None, resource=None, context_name=context_name, args=cmd_args)
-        return item_json
+    return item_json["items"] if item_json.get("kind") == "List" else [item_json]
+
+
+def k8_customize_and_apply_all(
+    template_paths: [str], context_name: str = None, manifests: [dict] = None, **kwargs
+) -> [dict]:
+    """
+    Renders the templates with the given values and applies all their resources in a single batch
+    together with the given manifests, if any. Returns the resources as applied, in the same order
+    as in the templates followed by the manifests. Render and apply times are logged for each call.
+    """
+    started_on = time_ms()
+    rendered = [manifest for path in template_paths for manifest in k8_render_template(path, **kwargs)]
+    render_ms = time_ms(started_on)
+
+    started_on = time_ms()
+    items = k8_apply_manifests(rendered + (manifests or []), context_name)
+    apply_ms = time_ms(started_on)
+
+    templates = ", ".join(os.path.basename(path) for path in template_paths)
+    logger.info(f"k8_customize_and_apply - {templates}: {len(items)} items, render: {render_ms}ms, apply: {apply_ms}ms")
+    return items
+
+
+def k8_customize_and_apply(template_path: str, context_name=None, **kwargs):
+    """ Renders and applies a template, returns the resource or a List if the template has more than one """
+    items = k8_customize_and_apply_all([template_path], context_name, **kwargs)
+    return items[0] if len(items) == 1 else {"apiVersion": "v1", "kind": "List", "items": items}
 
 
 def k8_get_storage_volume_configuration(item: ItemMixin) -> dict:
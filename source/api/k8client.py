@@ -0,0 +1,685 @@
+import os
+import re
+import json
+import time
+import base64
+import atexit
+import shutil
+import tempfile
+import threading
+import collections
+import urllib.parse
+import yaml
+import dateutil.parser
+
+from datetime import datetime, timedelta, timezone
+
+from rest_framework import status
+
+from analitico import AnaliticoException, logger
+from analitico.utilities import get_dict_dot, time_ms
+from analitico.sdk import create_session
+
+# Kubernetes APIs are called directly over a pool of keep-alive connections instead of
+# forking a kubectl process, reloading the kubeconfig and opening a new TLS connection
+# for each operation. The API is documented here:
+# https://kubernetes.io/docs/reference/using-api/api-concepts/
+# https://kubernetes.io/docs/reference/generated/kubernetes-api/v1.16/
+
+# keep-alive connections kept open with the API server
+K8_API_POOL_SIZE = 16
+
+# seconds before a call to the API server gives up
+K8_API_TIMEOUT = 30
+
+# GET calls that fail because the API server is temporarily unavailable are retried
+K8_API_RETRIES = 2
+
+# name recorded as the owner of the fields we set with server side apply
+K8_FIELD_MANAGER = "analitico"
+
+# credentials mounted in pods running in the cluster
+K8_SERVICE_ACCOUNT_DIR = "/var/run/secrets/kubernetes.io/serviceaccount"
+
+# seconds after which a token read from a file is read again, service account
+# tokens projected in pods are rotated by the kubelet and expire after a while
+K8_TOKEN_REFRESH_SECONDS = 60
+
+# seconds before a client that could not be configured is configured again
+K8_CLIENT_RETRY_SECONDS = 60
+
+# a kind of resource served by the API server
+K8Resource = collections.namedtuple("K8Resource", ["api_version", "kind", "plural", "namespaced", "aliases"])
+
+# resources used by analitico, names and short names are the same ones accepted by kubectl
+K8_RESOURCES = (
+    K8Resource("v1", "Pod", "pods", True, ("pod", "po")),
+    K8Resource("v1", "Service", "services", True, ("service", "svc")),
+    K8Resource("v1", "Secret", "secrets", True, ("secret",)),
+    K8Resource("v1", "Event", "events", True, ("event", "ev")),
+    K8Resource("v1", "Node", "nodes", False, ("node", "no")),
+    K8Resource("v1", "PersistentVolume", "persistentvolumes", False, ("persistentvolume", "pv")),
+    K8Resource("v1", "PersistentVolumeClaim", "persistentvolumeclaims", True, ("persistentvolumeclaim", "pvc")),
+    K8Resource("batch/v1", "Job", "jobs", True, ("job",)),
+    K8Resource("apps/v1", "StatefulSet", "statefulsets", True, ("statefulset", "sts")),
+    K8Resource("apps/v1", "Deployment", "deployments", True, ("deployment", "deploy")),
+    K8Resource("coordination.k8s.io/v1", "Lease", "leases", True, ("lease",)),
+    K8Resource("serving.knative.dev/v1", "Service", "services", True, ("kservice", "ksvc")),
+    K8Resource("serving.knative.dev/v1", "Revision", "revisions", True, ("revision", "rev")),
+    K8Resource("networking.istio.io/v1alpha3", "VirtualService", "virtualservices", True, ("virtualservice", "vs")),
+)
+
+_resources_by_name = {}
+_resources_by_kind = {}
+for _resource in K8_RESOURCES:
+    for _name in (_resource.plural, *_resource.aliases):
+        _resources_by_name.setdefault(_name, _resource)  # core services win over knative services
+    _resources_by_kind[(_resource.api_version, _resource.kind)] = _resource
+
+
+def k8_get_resource(name) -> K8Resource:
+    """
+    Returns the kind of resource for a name like job, jobs, statefulSet or ksvc. Names are
+    ambiguous, eg. services are core services while ksvc are knative services, so callers
+    that have already resolved a name can pass its K8Resource which is returned as is.
+    """
+    if isinstance(name, K8Resource):
+        return name
+    resource = _resources_by_name.get(name.lower())
+    if not resource:
+        raise AnaliticoException(f"Unknown Kubernetes resource: {name}", status_code=status.HTTP_400_BAD_REQUEST)
+    return resource
+
+
+def k8_get_resource_by_kind(api_version: str, kind: str) -> K8Resource:
+    """ Returns the kind of resource used by a manifest, eg: batch/v1, Job """
+    resource = _resources_by_kind.get((api_version, kind))
+    if not resource:
+        raise AnaliticoException(
+            f"Unknown Kubernetes resource: {api_version} {kind}", status_code=status.HTTP_400_BAD_REQUEST
+        )
+    return resource
+
+
+##
+## Label selectors
+##
+
+# a requirement like app=jupyter, app!=jupyter, app in (a, b), app notin (a, b), app or !app
+LABEL_REQUIREMENT_RE = re.compile(
+    r"^\s*(?:(?P<not>!)\s*(?P<nkey>[\w./-]+)|(?P<key>[\w./-]+)\s*"
+    r"(?:(?P<op>==|!=|=|\s+in\s+|\s+notin\s+)\s*(?P<value>\([^)]*\)|[\w./-]*))?)\s*$"
+)
+
+
+def k8_parse_label_selector(selector: str) -> [tuple]:
+    """ Parses a label selector like the one used by kubectl --selector into a list of (key, operator, values) """
+    requirements = []
+    for requirement in re.split(r",(?![^(]*\))", selector or ""):
+        if not requirement.strip():
+            continue
+        match = LABEL_REQUIREMENT_RE.match(requirement)
+        if not match:
+            raise AnaliticoException(f"Invalid label selector: {selector}", status_code=status.HTTP_400_BAD_REQUEST)
+        if match.group("not"):
+            requirements.append((match.group("nkey"), "!", ()))
+        elif not match.group("op"):
+            requirements.append((match.group("key"), "exists", ()))
+        else:
+            op = match.group("op").strip()
+            value = match.group("value")
+            values = tuple(v.strip() for v in value.strip("()").split(",")) if value.startswith("(") else (value,)
+            requirements.append((match.group("key"), {"=": "=", "==": "="}.get(op, op), values))
+    return requirements
+
+
+def k8_match_labels(requirements: [tuple], labels: dict) -> bool:
+    """ True if the labels satisfy all the requirements of a parsed label selector """
+    labels = labels or {}
+    for key, op, values in requirements:
+        if op == "exists" and key not in labels:
+            return False
+        if op == "!" and key in labels:
+            return False
+        if op in ("=", "in") and labels.get(key) not in values:
+            return False
+        if op in ("!=", "notin") and key in labels and labels[key] in values:
+            return False
+    return True
+
+
+##
+## kubectl arguments
+##
+
+
+def k8_parse_kubectl_args(args: []) -> (dict, []):
+    """ Splits kubectl arguments into --options and positional arguments """
+    short = {"-l": "selector", "-f": "filename"}
+    options, positional, args = {}, [], list(args)
+    while args:
+        arg = args.pop(0)
+        if arg in short or arg.startswith("--"):
+            key, _, value = arg[2:].partition("=") if arg.startswith("--") else (short[arg], "", None)
+            if key not in ("selector", "sort-by", "filename", "for", "timeout", "replicas", "overwrite", "wait"):
+                raise NotImplementedError(f"kubectl option {arg} is not supported by K8Client")
+            if not _ and key not in ("overwrite", "wait"):
+                value = args.pop(0)
+            elif not _ and key == "wait" and args and args[0] in ("true", "false"):
+                value = args.pop(0)
+            options[key] = value or ""
+        else:
+            positional.append(arg)
+    return options, positional
+
+
+def k8_sort_items(items: [dict], sort_by: str = None) -> [dict]:
+    """ Sorts resources by a field like kubectl --sort-by, eg: .metadata.creationTimestamp """
+    if sort_by:
+        key = sort_by.strip(".{}")
+        items.sort(key=lambda item: str(get_dict_dot(item, key, "")))
+    return items
+
+
+##
+## Configuration
+##
+
+
+class K8Config:
+    """
+    Address and credentials of a Kubernetes API server. Configuration is read from the
+    service account mounted in pods running in the cluster or from the kubeconfig file
+    used by kubectl ($KUBECONFIG or ~/.kube/config). Authentication plugins like exec or
+    auth-provider are not supported, in that case kubectl is used instead. Tokens read from
+    a file, like the service account's, are read again when they may have been rotated.
+    """
+
+    def __init__(self, server: str, token: str = None, cert=None, verify=True, auth=None, token_path: str = None):
+        self.server = server.rstrip("/")
+        self.token = token
+        self.token_path = token_path
+        self.token_read_at = None
+        self.cert = cert
+        self.verify = verify
+        self.auth = auth
+        if token_path and not token:
+            self.get_token(refresh=True)
+
+    def get_token(self, refresh: bool = False) -> str:
+        """ Returns the bearer token, a token file is read again every K8_TOKEN_REFRESH_SECONDS or if refresh """
+        if self.token_path and (
+            refresh or self.token_read_at is None or time.monotonic() - self.token_read_at > K8_TOKEN_REFRESH_SECONDS
+        ):
+            try:
+                with open(self.token_path) as f:
+                    self.token = f.read().strip()
+            except OSError as exc:
+                if self.token is None:
+                    raise
+                logger.warning(f"K8Config - cannot read {self.token_path}, using the previous token: {exc}")
+            self.token_read_at = time.monotonic()
+        return self.token
+
+    @staticmethod
+    def load(context_name: str = None) -> "K8Config":
+        if not context_name and os.environ.get("KUBERNETES_SERVICE_HOST"):
+            token_path = os.path.join(K8_SERVICE_ACCOUNT_DIR, "token")
+            if os.path.isfile(token_path):
+                host, port = os.environ["KUBERNETES_SERVICE_HOST"], os.environ.get("KUBERNETES_SERVICE_PORT", "443")
+                verify = os.path.join(K8_SERVICE_ACCOUNT_DIR, "ca.crt")
+                return K8Config(f"https://{host}:{port}", verify=verify, token_path=token_path)
+        return K8Config.load_kubeconfig(context_name=context_name)
+
+    @staticmethod
+    def load_kubeconfig(path: str = None, context_name: str = None) -> "K8Config":
+        path = path or os.environ.get("KUBECONFIG", "").split(os.pathsep)[0] or os.path.expanduser("~/.kube/config")
+        with open(path) as f:
+            kubeconfig = yaml.safe_load(f)
+
+        def named(section, name):
+            for entry in kubeconfig.get(section) or []:
+                if entry["name"] == name:
+                    return entry.get(section[:-1]) or {}
+            raise AnaliticoException(f"K8Config - {section[:-1]} {name} not found in {path}")
+
+        context = named("contexts", context_name or kubeconfig.get("current-context"))
+        cluster = named("clusters", context["cluster"])
+        user = named("users", context["user"])
+        if "exec" in user or "auth-provider" in user:
+            raise AnaliticoException(f"K8Config - authentication plugins used by {context['user']} are not supported")
+
+        directory = os.path.dirname(os.path.abspath(path))
+
+        def filename(entry, key):
+            """ Returns the path of a file or of a temporary file holding the inline -data version of the entry """
+            if entry.get(key + "-data"):
+                return _save_credentials(base64.b64decode(entry[key + "-data"]))
+            if entry.get(key):
+                return os.path.join(directory, os.path.expanduser(entry[key]))
+            return None
+
+        verify = filename(cluster, "certificate-authority") or True
+        if cluster.get("insecure-skip-tls-verify"):
+            verify = False
+        cert = filename(user, "client-certificate")
+        cert = (cert, filename(user, "client-key")) if cert else None
+        token = user.get("token")
+        token_path = os.path.join(directory, user["tokenFile"]) if not token and user.get("tokenFile") else None
+        auth = (user["username"], user["password"]) if user.get("username") else None
+        return K8Config(cluster["server"], token=token, cert=cert, verify=verify, auth=auth, token_path=token_path)
+
+
+_credentials_dir = None
+
+
+def _save_credentials(data: bytes) -> str:
+    """ Saves inline certificates and keys to files which requests can load, files are removed on exit """
+    global _credentials_dir
+    if not _credentials_dir:
+        _credentials_dir = tempfile.mkdtemp(prefix="k8_")
+        atexit.register(shutil.rmtree, _credentials_dir, True)
+    fd, path = tempfile.mkstemp(dir=_credentials_dir)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return path
+
+
+##
+## API server
+##
+
+
+class K8HttpApiServer:
+    """
+    Sends requests to a Kubernetes API server over a pool of keep-alive connections.
+    K8Client talks to the API server only through the request method so the server
+    can be replaced, for example by an in-memory API server when testing.
+    """
+
+    def __init__(self, config: K8Config, pool_size: int = K8_API_POOL_SIZE):
+        self.config = config
+        # only idempotent calls are retried, see create_session
+        self.session = create_session(pool_size=pool_size, retries=K8_API_RETRIES)
+        self.session.verify = config.verify
+        self.session.cert = config.cert
+        self.session.auth = config.auth
+        self.session.headers["Accept"] = "application/json"
+
+    def request(
+        self, method: str, path: str, params: dict = None, body=None, content_type: str = None, stream: bool = False
+    ):
+        """
+        Calls the API server and returns the status code and the json response or, when streaming
+        a watch, the status code and an iterator of the json events that closes the connection when done.
+        A request that is unauthorized is sent again once with the token read again from its file.
+        """
+        headers = {"Content-Type": content_type or "application/json"} if body is not None else {}
+
+        def send(token: str):
+            if token:
+                headers["Authorization"] = "Bearer " + token
+            return self.session.request(
+                method,
+                self.config.server + path,
+                params=params,
+                data=json.dumps(body) if body is not None else None,
+                headers=headers,
+                stream=stream,
+                timeout=(K8_API_TIMEOUT, None if stream else K8_API_TIMEOUT),
+            )
+
+        response = send(self.config.get_token())
+        if response.status_code == status.HTTP_401_UNAUTHORIZED and self.config.token_path:
+            response.close()
+            response = send(self.config.get_token(refresh=True))
+        if stream and response.status_code < 400:
+            return response.status_code, self._iter_events(response)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, {"message": response.text}
+
+    def _iter_events(self, response):
+        try:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+        finally:
+            response.close()
+
+
+##
+## Client
+##
+
+
+class K8Client:
+    """
+    A client for the Kubernetes API with get, list, apply (server side), patch, delete and watch
+    methods for the resources in K8_RESOURCES. Calls that fail raise AnaliticoException with
+    the status code returned by the API server. The client also runs the subset of kubectl
+    commands used by api.k8, see kubectl.
+    """
+
+    def __init__(self, api_server=None, context_name: str = None):
+        self.api_server = api_server or K8HttpApiServer(K8Config.load(context_name))
+
+    def _path(self, resource: K8Resource, namespace: str = None, name: str = None, subresource: str = None) -> str:
+        path = "/api/" + resource.api_version if "/" not in resource.api_version else "/apis/" + resource.api_version
+        if resource.namespaced and namespace:
+            path += "/namespaces/" + namespace
+        path += "/" + resource.plural
+        if name:
+            path += "/" + urllib.parse.quote(name)
+            if subresource:
+                path += "/" + subresource
+        return path
+
+    def request(self, method: str, path: str, params: dict = None, body=None, content_type: str = None):
+        started_on = time_ms()
+        status_code, response = self.api_server.request(
+            method, path, params=params, body=body, content_type=content_type
+        )
+        logger.debug(f"K8Client - {method} {path} {params or ''} returned {status_code} in {time_ms(started_on)} ms")
+        if status_code >= 400:
+            message = response.get("message") if isinstance(response, dict) else None
+            raise AnaliticoException(
+                f"Kubernetes {method} {path} failed: {message or status_code}", status_code=status_code, extra=response
+            )
+        return response
+
+    def get(self, resource: str, name: str, namespace: str = None) -> dict:
+        """ Returns a resource, eg: get("job", "jb-123", "cloud") """
+        return self.request("GET", self._path(k8_get_resource(resource), namespace, name))
+
+    def list(
+        self,
+        resource: str,
+        namespace: str = None,
+        label_selector: str = None,
+        field_selector: str = None,
+        sort_by: str = None,
+    ) -> dict:
+        """ Returns a list of resources with an "items" array, optionally sorted by a field, eg: .metadata.name """
+        params = {}
+        if label_selector:
+            params["labelSelector"] = label_selector
+        if field_selector:
+            params["fieldSelector"] = field_selector
+        response = self.request("GET", self._path(k8_get_resource(resource), namespace), params=params)
+        response["items"] = k8_sort_items(response.get("items") or [], sort_by)
+        return response
+
+    def apply(self, manifest: dict, namespace: str = None, force: bool = True) -> dict:
+        """ Creates or updates a resource with server side apply and returns it """
+        resource = k8_get_resource_by_kind(manifest["apiVersion"], manifest["kind"])
+        namespace = get_dict_dot(manifest, "metadata.namespace") or namespace
+        path = self._path(resource, namespace, manifest["metadata"]["name"])
+        params = {"fieldManager": K8_FIELD_MANAGER, "force": "true" if force else "false"}
+        # json is valid yaml
+        return self.request("PATCH", path, params=params, body=manifest, content_type="application/apply-patch+yaml")
+
+    def create(self, manifest: dict, namespace: str = None) -> dict:
+        """ Creates a resource and returns it, fails with 409 if a resource with the same name exists already """
+        resource = k8_get_resource_by_kind(manifest["apiVersion"], manifest["kind"])
+        namespace = get_dict_dot(manifest, "metadata.namespace") or namespace
+        return self.request("POST", self._path(resource, namespace), body=manifest)
+
+    def patch(self, resource: str, name: str, patch: dict, namespace: str = None) -> dict:
+        """
+        Changes some fields of a resource with a json merge patch, None values remove fields. If the patch
+        has a metadata.resourceVersion it fails with 409 when the resource was changed since that version.
+        """
+        path = self._path(k8_get_resource(resource), namespace, name)
+        return self.request("PATCH", path, body=patch, content_type="application/merge-patch+json")
+
+    def scale(self, resource: str, name: str, replicas: int, namespace: str = None) -> dict:
+        return self.patch(resource, name, {"spec": {"replicas": replicas}}, namespace)
+
+    def delete(self, resource: str, name: str, namespace: str = None, propagation_policy="Background") -> dict:
+        """ Deletes a resource, dependents like the pods of a job are deleted in the background """
+        path = self._path(k8_get_resource(resource), namespace, name)
+        body = {"kind": "DeleteOptions", "apiVersion": "v1", "propagationPolicy": propagation_policy}
+        return self.request("DELETE", path, body=body)
+
+    def watch(
+        self,
+        resource: str,
+        namespace: str = None,
+        label_selector: str = None,
+        resource_version: str = None,
+        timeout_seconds: int = None,
+    ):
+        """
+        Yields (event_type, object) for each change to the resources after resource_version
+        where event_type is ADDED, MODIFIED, DELETED or BOOKMARK. Raises AnaliticoException
+        with status 410 when resource_version is too old and resources need to be listed again.
+        """
+        params = {"watch": "true", "allowWatchBookmarks": "true"}
+        if label_selector:
+            params["labelSelector"] = label_selector
+        if resource_version:
+            params["resourceVersion"] = resource_version
+        if timeout_seconds:
+            params["timeoutSeconds"] = int(timeout_seconds)
+        path = self._path(k8_get_resource(resource), namespace)
+        status_code, events = self.api_server.request("GET", path, params=params, stream=True)
+        if status_code >= 400:
+            raise AnaliticoException(f"Kubernetes watch {path} failed", status_code=status_code, extra=events)
+        for event in events:
+            if event["type"] == "ERROR":
+                code = get_dict_dot(event, "object.code", status.HTTP_500_INTERNAL_SERVER_ERROR)
+                raise AnaliticoException(
+                    f"Kubernetes watch {path} failed: {get_dict_dot(event, 'object.message')}",
+                    status_code=code,
+                    extra=event["object"],
+                )
+            yield event["type"], event["object"]
+
+    def wait(self, resource: str, condition: str, namespace: str = None, label_selector: str = None, timeout: int = 60):
+        """
+        Waits until all the selected resources have a condition (eg: Ready) or have been deleted
+        (condition=delete), like kubectl wait. Returns the resources or raises AnaliticoException
+        if there are no matching resources or the timeout expires.
+        """
+        expires_on = time.time() + timeout
+        listed = self.list(resource, namespace, label_selector)
+        items = {item["metadata"]["name"]: item for item in listed["items"]}
+        if not items:
+            raise AnaliticoException("no matching resources found", status_code=status.HTTP_404_NOT_FOUND)
+
+        def satisfied(item):
+            if condition == "delete":
+                return False
+            conditions = get_dict_dot(item, "status.conditions", [])
+            return any(c.get("type") == condition and c.get("status") == "True" for c in conditions)
+
+        resource_version = get_dict_dot(listed, "metadata.resourceVersion")
+        while not all(satisfied(item) for item in items.values()):
+            remaining = expires_on - time.time()
+            if remaining <= 0:
+                raise AnaliticoException(
+                    f"timed out waiting for {condition} on {resource}", status_code=status.HTTP_408_REQUEST_TIMEOUT
+                )
+            for event_type, item in self.watch(
+                resource, namespace, label_selector, resource_version, timeout_seconds=max(1, remaining)
+            ):
+                resource_version = get_dict_dot(item, "metadata.resourceVersion", resource_version)
+                name = get_dict_dot(item, "metadata.name")
+                if event_type == "DELETED":
+                    items.pop(name, None)
+                elif event_type != "BOOKMARK" and name in items:
+                    items[name] = item
+                if not items:
+                    return []
+                if all(satisfied(item) for item in items.values()):
+                    break
+            else:
+                time.sleep(min(1, max(0, expires_on - time.time())))  # watch expired or ended early
+        return list(items.values())
+
+    ##
+    ## kubectl commands
+    ##
+
+    def kubectl(self, namespace: str, action: str, resource: str, args: [] = []):
+        """
+        Runs a kubectl command with this client and returns what kubectl would return as json.
+        Supports the commands used by api.k8: get, delete, apply, wait, scale and annotate
+        with --selector, --sort-by, --filename, --for, --timeout, --replicas, --overwrite and --wait.
+        Raises NotImplementedError for anything else so callers can run kubectl instead.
+        """
+        if action not in ("get", "delete", "apply", "wait", "scale", "annotate"):
+            raise NotImplementedError(f"kubectl {action} is not supported by K8Client")
+        options, positional = k8_parse_kubectl_args(args)
+        selector = options.get("selector")
+        name = None
+        if resource and "/" in resource:
+            resource, name = resource.split("/", 1)
+        elif positional and action in ("get", "delete", "scale"):
+            name = positional.pop(0)
+
+        if action == "apply":
+            return self._kubectl_apply(options.get("filename"), namespace)
+        if action == "get":
+            if name:
+                return self.get(resource, name, namespace)
+            return self.list(resource, namespace, selector, sort_by=options.get("sort-by"))
+
+        if action == "wait":
+            condition = options["for"]
+            condition = condition.split("=", 1)[1] if condition.startswith("condition=") else condition
+            timeout = int(options.get("timeout", "30s").rstrip("s"))
+            items = self.wait(resource, condition, namespace, selector, timeout)
+            return {"apiVersion": "v1", "kind": "List", "items": items}
+
+        # delete, scale and annotate apply to the named resource or to all selected resources
+        if name:
+            names = [name]
+        elif selector:
+            names = [item["metadata"]["name"] for item in self.list(resource, namespace, selector)["items"]]
+        else:
+            raise AnaliticoException(
+                f"kubectl {action} needs a resource name or a selector", status_code=status.HTTP_400_BAD_REQUEST
+            )
+        if action == "delete":
+            for name in names:
+                self.delete(resource, name, namespace)
+            if options.get("wait") in ("", "true"):
+                for name in names:
+                    self._wait_deleted(resource, name, namespace)
+            return None
+        if action == "scale":
+            replicas = int(options["replicas"])
+            return [self.scale(resource, name, replicas, namespace) for name in names]
+
+        annotations = {}
+        for annotation in positional:
+            key, _, value = annotation.partition("=")
+            annotations[key.rstrip("-")] = value if _ else None  # key- removes the annotation
+        return [self.patch(resource, name, {"metadata": {"annotations": annotations}}, namespace) for name in names]
+
+    def _kubectl_apply(self, filename: str, namespace: str = None):
+        """ Applies all the manifests in a yaml file, returns a resource or a List like kubectl does """
+        with open(filename) as f:
+            manifests = [manifest for manifest in yaml.safe_load_all(f) if manifest]
+        items = [self.apply(manifest, namespace) for manifest in manifests]
+        return items[0] if len(items) == 1 else {"apiVersion": "v1", "kind": "List", "items": items}
+
+    def _wait_deleted(self, resource: str, name: str, namespace: str = None, timeout: int = K8_API_TIMEOUT):
+        expires_on = time.time() + timeout
+        while time.time() < expires_on:
+            try:
+                self.get(resource, name, namespace)
+            except AnaliticoException as exc:
+                if exc.status_code == status.HTTP_404_NOT_FOUND:
+                    return
+                raise
+            time.sleep(1)
+
+
+##
+## Leases
+##
+
+
+def k8_acquire_lease(client: K8Client, name: str, identity: str, duration: int, namespace: str) -> bool:
+    """
+    Acquires or renews a Lease so that only one of many processes, eg. one per replica of the server,
+    does some work at a time. Returns True if identity holds the lease for the next duration seconds,
+    False if it is held by someone else who renewed it recently. Processes that hold the lease should
+    renew it well before it expires and stop working when renewing fails. Updates are conditional on
+    the lease's resourceVersion so when two processes try to acquire it at the same time only one wins.
+    https://kubernetes.io/docs/reference/generated/kubernetes-api/v1.16/#lease-v1-coordination-k8s-io
+    """
+    now = datetime.now(timezone.utc)
+    now_str = now.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    spec = {"holderIdentity": identity, "leaseDurationSeconds": duration, "acquireTime": now_str, "renewTime": now_str}
+    try:
+        lease = client.get("lease", name, namespace)
+    except AnaliticoException as exc:
+        if exc.status_code != status.HTTP_404_NOT_FOUND:
+            raise
+        manifest = {"apiVersion": "coordination.k8s.io/v1", "kind": "Lease", "metadata": {"name": name}, "spec": spec}
+        try:
+            client.create(manifest, namespace)
+            return True
+        except AnaliticoException as exc:
+            if exc.status_code == status.HTTP_409_CONFLICT:
+                return False
+            raise
+
+    held = lease.get("spec") or {}
+    if held.get("holderIdentity") not in (None, identity) and held.get("renewTime"):
+        duration_held = timedelta(seconds=held.get("leaseDurationSeconds", duration))
+        if dateutil.parser.parse(held["renewTime"]) + duration_held > now:
+            return False
+    if held.get("holderIdentity") == identity:
+        spec.pop("acquireTime")
+    patch = {"metadata": {"resourceVersion": lease["metadata"]["resourceVersion"]}, "spec": spec}
+    try:
+        client.patch("lease", name, patch, namespace)
+        return True
+    except AnaliticoException as exc:
+        if exc.status_code == status.HTTP_409_CONFLICT:
+            return False
+        raise
+
+
+##
+## Shared clients
+##
+
+_clients = {}
+_clients_failed_at = {}  # monotonic time of the last failure to configure the client of a context
+_clients_lock = threading.Lock()
+
+
+def get_k8_client(context_name: str = None) -> K8Client:
+    """
+    Returns the client for the given kubectl context (or the default cluster) which is shared by all
+    threads so connections are reused, or None if the cluster cannot be reached without kubectl.
+    A client that could not be configured is configured again after K8_CLIENT_RETRY_SECONDS.
+    """
+    with _clients_lock:
+        client = _clients.get(context_name)
+        failed_at = _clients_failed_at.get(context_name)
+        if not client and (failed_at is None or time.monotonic() - failed_at > K8_CLIENT_RETRY_SECONDS):
+            try:
+                client = _clients[context_name] = K8Client(context_name=context_name)
+                _clients_failed_at.pop(context_name, None)
+            except Exception as exc:
+                logger.warning(f"get_k8_client - cannot configure Kubernetes client, kubectl will be used: {exc}")
+                _clients_failed_at[context_name] = time.monotonic()
+        return client
+
+
+def set_k8_client(client: K8Client, context_name: str = None):
+    """ Replaces the client used for a context, eg. with a client using an in-memory API server when testing """
+    with _clients_lock:
+        _clients_failed_at.pop(context_name, None)
+        if client:
+            _clients[context_name] = client
+        else:
+            _clients.pop(context_name, None)
@@ -0,0 +1,399 @@
+import os
+import copy
+import time
+import threading
+
+from rest_framework import status
+
+from analitico import AnaliticoException, logger
+from api.k8client import (
+    K8Client,
+    get_k8_client,
+    k8_get_resource,
+    k8_parse_label_selector,
+    k8_match_labels,
+    k8_parse_kubectl_args,
+    k8_sort_items,
+)
+
+# Informers keep an in-memory copy of the resources that the API reads most often so
+# they can be served without calling the cluster. Each informer lists its resources
+# once, then follows the changes with a watch and lists everything again every
+# resync period in case an event was missed. This is the same pattern used by the
+# informers in Kubernetes controllers:
+# https://kubernetes.io/docs/reference/using-api/api-concepts/#efficient-detection-of-changes
+
+# resources cached by informers
+K8_INFORMER_RESOURCES = ("job", "statefulset", "kservice", "revision", "pod")
+
+# namespaces whose resources are cached, each informer has its own watch so other namespaces are read
+# from the API server, eg. ANALITICO_K8_INFORMER_NAMESPACES=cloud,staging
+K8_INFORMER_NAMESPACES = tuple(os.environ.get("ANALITICO_K8_INFORMER_NAMESPACES", "cloud").split(","))
+
+# seconds between full lists of the resources
+K8_INFORMER_RESYNC_SECONDS = 300
+
+# seconds a single watch request is kept open before it is renewed
+K8_INFORMER_WATCH_SECONDS = 60
+
+# the cache is not used if nothing was heard from the API server for this long
+K8_INFORMER_MAX_STALENESS_SECONDS = 120
+
+# labels used to find resources in the cache without scanning them all
+K8_INFORMER_INDEXED_LABELS = (
+    "app",
+    "analitico.ai/item-id",
+    "analitico.ai/workspace-id",
+    "analitico.ai/target-id",
+    "analitico.ai/job-action",
+    "analitico.ai/dataset-hash",
+    "analitico.ai/service",
+    "serving.knative.dev/service",
+    "job-name",
+)
+
+# informers are disabled with ANALITICO_K8_INFORMERS=false, eg. in short lived commands
+K8_INFORMERS_ENABLED = os.environ.get("ANALITICO_K8_INFORMERS", "true").lower() not in ("false", "0", "no")
+
+
+class K8Informer:
+    """
+    An in-memory cache of the resources of one kind in a namespace, kept up to date with
+    a watch on the API server. Resources can be retrieved by name or listed with a label
+    selector, selectors on indexed labels only look at the matching resources. The cache
+    is fresh while the watch is receiving events or bookmarks, callers should use
+    the API server when it is not, see is_fresh.
+    """
+
+    def __init__(
+        self,
+        client: K8Client,
+        resource,
+        namespace: str = None,
+        resync_seconds: int = K8_INFORMER_RESYNC_SECONDS,
+        indexed_labels: tuple = K8_INFORMER_INDEXED_LABELS,
+    ):
+        self.client = client
+        self.k8_resource = k8_get_resource(resource)  # names like services are ambiguous, keep the resolved kind
+        self.resource = self.k8_resource.plural
+        self.namespace = namespace
+        self.resync_seconds = resync_seconds
+        self.indexed_labels = indexed_labels
+
+        self.lock = threading.RLock()
+        self.items = {}  # name -> resource
+        self.index = {label: {} for label in indexed_labels}  # label -> value -> names
+        self.resource_version = None
+
+        self.synced_on = None  # time of last complete list
+        self.contacted_on = None  # time of last list, event or bookmark from the API server
+        self.stats = dict.fromkeys(("syncs", "sync_ms", "watches", "events", "errors", "hits", "misses"), 0)
+        self.handlers = []
+        self._thread = None
+        self._stopped = threading.Event()
+
+    ##
+    ## Cache
+    ##
+
+    def _index_add(self, name: str, item: dict):
+        labels = item["metadata"].get("labels") or {}
+        for label in self.indexed_labels:
+            if label in labels:
+                self.index[label].setdefault(labels[label], set()).add(name)
+
+    def _index_remove(self, name: str, item: dict):
+        labels = item["metadata"].get("labels") or {}
+        for label in self.indexed_labels:
+            names = self.index[label].get(labels.get(label))
+            if names:
+                names.discard(name)
+                if not names:
+                    del self.index[label][labels[label]]
+
+    def _store(self, item: dict):
+        name = item["metadata"]["name"]
+        with self.lock:
+            if name in self.items:
+                self._index_remove(name, self.items[name])
+            self.items[name] = item
+            self._index_add(name, item)
+
+    def _remove(self, item: dict):
+        name = item["metadata"]["name"]
+        with self.lock:
+            if name in self.items:
+                self._index_remove(name, self.items.pop(name))
+
+    def observe(self, item: dict):
+        """ Stores a resource returned by a write to the API server so it can be read back right away """
+        with self.lock:
+            current = self.items.get(item["metadata"]["name"])
+            try:
+                if current and int(current["metadata"]["resourceVersion"]) > int(item["metadata"]["resourceVersion"]):
+                    return  # already have a newer version
+            except (KeyError, ValueError):
+                pass
+            self._store(copy.deepcopy(item))
+
+    def add_handler(self, handler):
+        """
+        Calls handler(event_type, resource) from the informer's thread after each change is applied
+        to the cache. When the resources are listed again all of them are reported as MODIFIED and
+        those that are no longer there as DELETED, so handlers also see changes missed by the watch.
+        """
+        self.handlers.append(handler)
+
+    def _notify(self, event_type: str, item: dict):
+        for handler in self.handlers:
+            try:
+                handler(event_type, item)
+            except Exception as exc:
+                self.stats["errors"] += 1
+                logger.error(f"K8Informer - {self.resource} handler failed on {event_type}: {exc}")
+
+    def handles(self, item: dict) -> bool:
+        """ True if the resource is of the kind cached by this informer """
+        return (item.get("apiVersion"), item.get("kind")) == (self.k8_resource.api_version, self.k8_resource.kind)
+
+    def is_fresh(self) -> bool:
+        contacted_on = self.contacted_on
+        return bool(self.synced_on and contacted_on and time.time() - contacted_on < K8_INFORMER_MAX_STALENESS_SECONDS)
+
+    def get(self, name: str) -> dict:
+        """ Returns a copy of the resource with the given name or None """
+        with self.lock:
+            item = self.items.get(name)
+            return copy.deepcopy(item) if item else None
+
+    def list(self, label_selector: str = None, sort_by: str = None) -> dict:
+        """ Returns copies of the resources matching the label selector in a List like the API server """
+        requirements = k8_parse_label_selector(label_selector)
+        with self.lock:
+            names = None
+            for key, op, values in requirements:
+                if key in self.index and op in ("=", "in"):
+                    matches = set().union(*(self.index[key].get(value, ()) for value in values))
+                    names = matches if names is None else names & matches
+            candidates = self.items.values() if names is None else (self.items[name] for name in names)
+            items = [
+                copy.deepcopy(item)
+                for item in candidates
+                if k8_match_labels(requirements, item["metadata"].get("labels"))
+            ]
+        return {"apiVersion": "v1", "kind": "List", "items": k8_sort_items(items, sort_by)}
+
+    ##
+    ## Sync with the API server
+    ##
+
+    def sync(self):
+        """ Lists all the resources and replaces the contents of the cache """
+        started_on = time.time()
+        response = self.client.list(self.k8_resource, self.namespace)
+        with self.lock:
+            previous, self.items = self.items, {}
+            self.index = {label: {} for label in self.indexed_labels}
+            for item in response["items"]:
+                self._store(item)
+            self.resource_version = response.get("metadata", {}).get("resourceVersion")
+            self.synced_on = self.contacted_on = time.time()
+        self.stats["syncs"] += 1
+        self.stats["sync_ms"] = int((time.time() - started_on) * 1000)
+        if self.handlers:
+            for item in response["items"]:
+                self._notify("MODIFIED", item)
+            for name, item in previous.items():
+                if name not in self.items:
+                    self._notify("DELETED", item)
+
+    def watch(self, timeout_seconds: int = K8_INFORMER_WATCH_SECONDS) -> int:
+        """ Applies the changes since the last sync or event until the watch ends, returns the number of events """
+        events = 0
+        for event_type, item in self.client.watch(
+            self.k8_resource, self.namespace, resource_version=self.resource_version, timeout_seconds=timeout_seconds
+        ):
+            with self.lock:
+                if event_type == "DELETED":
+                    self._remove(item)
+                elif event_type in ("ADDED", "MODIFIED"):
+                    self._store(item)
+                self.resource_version = item["metadata"].get("resourceVersion", self.resource_version)
+                self.contacted_on = time.time()
+            if event_type in ("ADDED", "MODIFIED", "DELETED"):
+                self._notify(event_type, item)
+            self.stats["events"] += 1
+            events += 1
+        # the server closes watches after timeout_seconds
+        self.contacted_on = time.time()
+        return events
+
+    def _run(self):
+        backoff = 1
+        while not self._stopped.is_set():
+            try:
+                if not self.synced_on or time.time() - self.synced_on > self.resync_seconds:
+                    self.sync()
+                started_on = time.time()
+                self.watch()
+                self.stats["watches"] += 1
+                backoff = 1
+                if time.time() - started_on < 1:
+                    self._stopped.wait(1)  # watch ended right away
+            except Exception as exc:
+                if isinstance(exc, AnaliticoException) and exc.status_code == status.HTTP_410_GONE:
+                    self.synced_on = None  # events were compacted, list everything again
+                    continue
+                self.stats["errors"] += 1
+                logger.warning(f"K8Informer - {self.resource} watch failed, retry in {backoff}s: {exc}")
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, K8_INFORMER_WATCH_SECONDS)
+
+    def start(self):
+        """ Starts keeping the cache up to date in a background thread """
+        with self.lock:
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name=f"k8-informer-{self.resource}", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def get_stats(self) -> dict:
+        """ Returns the size of the cache, how stale it is and counters of syncs, events, hits and misses """
+        now = time.time()
+        return {
+            "resource": self.resource,
+            "api_version": self.k8_resource.api_version,
+            "kind": self.k8_resource.kind,
+            "namespace": self.namespace,
+            "items": len(self.items),
+            "fresh": self.is_fresh(),
+            "resource_version": self.resource_version,
+            "synced_seconds_ago": round(now - self.synced_on, 3) if self.synced_on else None,
+            "staleness_seconds": round(now - self.contacted_on, 3) if self.contacted_on else None,
+            "resync_seconds": self.resync_seconds,
+            **self.stats,
+        }
+
+
+##
+## Shared informers
+##
+
+_informers = {}  # (api_version, kind, namespace) -> informer
+_informers_lock = threading.Lock()
+
+
+def _informer_key(resource, namespace: str) -> tuple:
+    resource = k8_get_resource(resource)
+    return (resource.api_version, resource.kind, namespace)
+
+
+def get_informer(resource, namespace: str, start: bool = True) -> K8Informer:
+    """ Returns the shared informer for the resource and namespace or None if it is not cached """
+    try:
+        resource = k8_get_resource(resource)
+    except AnaliticoException:
+        return None
+    if not K8_INFORMERS_ENABLED or resource not in _informed_resources() or namespace not in K8_INFORMER_NAMESPACES:
+        return None
+    with _informers_lock:
+        key = _informer_key(resource, namespace)
+        if key not in _informers:
+            client = get_k8_client()
+            if not client:
+                return None
+            _informers[key] = K8Informer(client, resource, namespace)
+        informer = _informers[key]
+    if start:
+        informer.start()
+    return informer
+
+
+def set_informer(informer: K8Informer):
+    """ Replaces a shared informer, eg. with one using an in-memory API server when testing """
+    with _informers_lock:
+        _informers[_informer_key(informer.k8_resource, informer.namespace)] = informer
+
+
+def clear_informers():
+    with _informers_lock:
+        for informer in _informers.values():
+            informer.stop()
+        _informers.clear()
+
+
+def get_informers_stats() -> [dict]:
+    with _informers_lock:
+        return [informer.get_stats() for informer in _informers.values()]
+
+
+def _informed_resources() -> set:
+    return {k8_get_resource(resource) for resource in K8_INFORMER_RESOURCES}
+
+
+def k8_informers_get(namespace: str, resource: str, args: [] = []):
+    """
+    Answers a kubectl get command from the shared informers. Returns the resource or List that
+    the API server would return or None if the resource is not cached or the cache is stale.
+    A resource that is not cached may have just been created by another replica, a job or the
+    tracker and its watch event may not have arrived yet, so it is read from the API server.
+    """
+    name = None
+    if resource and "/" in resource:
+        resource, name = resource.split("/", 1)
+    try:
+        options, positional = k8_parse_kubectl_args(args)
+    except NotImplementedError:
+        return None
+    if positional and not name:
+        name = positional.pop(0)
+    if positional or set(options) - {"selector", "sort-by"}:
+        return None
+
+    informer = get_informer(resource, namespace)
+    if not informer:
+        return None
+    if not informer.is_fresh():
+        informer.stats["misses"] += 1
+        return None
+    if name:
+        item = informer.get(name)
+        informer.stats["hits" if item else "misses"] += 1
+        return item
+    informer.stats["hits"] += 1
+    return informer.list(options.get("selector"), options.get("sort-by"))
+
+
+def k8_informers_observe(response):
+    """ Stores resources returned by writes to the API server in their informers, if any """
+    for item in response.get("items", [response]) if isinstance(response, dict) else response or []:
+        if isinstance(item, dict) and "metadata" in item and "kind" in item:
+            namespace = item["metadata"].get("namespace")
+            with _informers_lock:
+                informers = [i for (_, _, ns), i in _informers.items() if ns == namespace and i.handles(item)]
+            for informer in informers:
+                informer.observe(item)
+
+
+def k8_informers_forget(namespace: str, resource: str, args: [] = []):
+    """ Removes resources deleted with a kubectl delete command from their informer, if any """
+    name = None
+    if resource and "/" in resource:
+        resource, name = resource.split("/", 1)
+    options, positional = k8_parse_kubectl_args(args)
+    with _informers_lock:
+        try:
+            informer = _informers.get(_informer_key(resource, namespace))
+        except AnaliticoException:
+            return
+    if informer:
+        name = name or (positional[0] if positional else None)
+        if name:
+            deleted = [informer.get(name)]
+        else:
+            deleted = informer.list(options.get("selector"))["items"] if options.get("selector") else []
+        for item in deleted:
+            if item:
+                informer._remove(item)
@@ -0,0 +1,294 @@
+import time
+import threading
+import dateutil.parser
+
+from django.db import transaction
+from django.utils import timezone
+
+import analitico
+from analitico import logger
+from analitico.status import STATUS_RUNNING, STATUS_COMPLETED, STATUS_FAILED, STATUS_CANCELED
+from analitico.utilities import get_dict_dot
+
+from api.models import Job, Workspace
+from api.k8informers import K8Informer
+
+# Jobs run on Kubernetes are tracked by watching their Job and Pod resources. Each change marks
+# the job as dirty and dirty jobs are written to api.models.Job in batches with their status,
+# duration and the reason why they failed. The owners of the item are notified once when the
+# job completes or fails. The transition is recorded in the job's notify_status attribute in the
+# same transaction that saves the status and is cleared, and notified_status set, once it has
+# been sent. Rows are locked while they are updated and notified so that if more than one
+# tracker is running, or the job notification webhook is called, only one of them notifies.
+# Notifications that could not be sent are retried until they are.
+# pylint: disable=no-member
+
+# seconds between writes of the changed jobs to the database
+K8_JOB_TRACKER_BATCH_SECONDS = 2
+
+# a tracker runs with each replica of the server and the one holding this lease writes the jobs,
+# the lease is renewed every third of its duration and is taken over by another tracker if it expires
+K8_JOB_TRACKER_LEASE_NAME = "analitico-jobtracker"
+K8_JOB_TRACKER_LEASE_SECONDS = 30
+
+# statuses a job does not change from once it has reached them
+K8_JOB_FINAL_STATUSES = (STATUS_COMPLETED, STATUS_FAILED, STATUS_CANCELED)
+
+# jobs with these actions notify their item's owners when they complete or fail
+K8_JOB_NOTIFIED_ACTIONS = (analitico.ACTION_RUN, analitico.ACTION_BUILD, analitico.ACTION_RUN_AND_BUILD)
+K8_JOB_NOTIFIED_STATUSES = (STATUS_COMPLETED, STATUS_FAILED)
+
+# seconds between retries of the notifications that could not be sent and the number of
+# attempts after which a notification is dropped, eg. because the item has been deleted
+K8_JOB_NOTIFY_RETRY_SECONDS = 60
+K8_JOB_NOTIFY_MAX_ATTEMPTS = 10
+
+# job attributes written by the tracker
+K8_JOB_ATTRIBUTES = ("k8_job", "started_at", "completed_at", "duration", "exit_reason", "exit_code")
+
+
+def k8_job_get_state(job: dict, pods: [dict] = (), deleted: bool = False) -> dict:
+    """
+    Returns the status of a Kubernetes job as it should be saved in api.models.Job with the time
+    it started and completed, its duration in seconds and the reason and exit code of the container
+    that failed (eg. OOMKilled) taken from the job's pods, if any.
+    """
+    labels = job["metadata"].get("labels") or {}
+    state = {
+        "job_id": labels.get("analitico.ai/job-id"),
+        "workspace_id": labels.get("analitico.ai/workspace-id"),
+        "item_id": labels.get("analitico.ai/item-id", ""),
+        "action": labels.get("analitico.ai/job-action", ""),
+        "status": STATUS_RUNNING,
+        "k8_job": job["metadata"]["name"],
+        "started_at": get_dict_dot(job, "status.startTime"),
+        "completed_at": None,
+        "duration": None,
+        "exit_reason": None,
+        "exit_code": None,
+    }
+
+    conditions = {
+        condition["type"]: condition
+        for condition in get_dict_dot(job, "status.conditions") or []
+        if condition.get("status") == "True"
+    }
+    if "Complete" in conditions or int(get_dict_dot(job, "status.succeeded") or 0) > 0:
+        state["status"] = STATUS_COMPLETED
+        state["completed_at"] = get_dict_dot(job, "status.completionTime") or get_dict_dot(
+            conditions, "Complete.lastTransitionTime"
+        )
+    elif "Failed" in conditions:
+        state["status"] = STATUS_FAILED
+        state["completed_at"] = conditions["Failed"].get("lastTransitionTime")
+        state["exit_reason"] = conditions["Failed"].get("reason")  # eg. BackoffLimitExceeded, DeadlineExceeded
+    elif deleted:
+        state["status"] = STATUS_CANCELED
+        state["completed_at"] = timezone.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    # the containers that exited with an error tell why the job failed, eg. OOMKilled
+    for pod in pods:
+        containers = (get_dict_dot(pod, "status.initContainerStatuses") or []) + (
+            get_dict_dot(pod, "status.containerStatuses") or []
+        )
+        for container in containers:
+            terminated = get_dict_dot(container, "state.terminated") or get_dict_dot(container, "lastState.terminated")
+            if terminated and terminated.get("exitCode"):
+                state["exit_code"] = terminated["exitCode"]
+                state["exit_reason"] = terminated.get("reason") or state["exit_reason"]
+
+    if state["started_at"] and state["completed_at"]:
+        started_at = dateutil.parser.parse(state["started_at"])
+        completed_at = dateutil.parser.parse(state["completed_at"])
+        state["duration"] = max(0, int((completed_at - started_at).total_seconds()))
+    return state
+
+
+def k8_jobs_update(states: dict, create_status: str = None) -> [tuple]:
+    """
+    Saves the states of Kubernetes jobs returned by k8_job_get_state, keyed by job id,
+    to their api.models.Job. Jobs that are not in the database are created with create_status,
+    or with their current status if None, and only if their workspace exists. Returns a
+    list of (job, previous_status) for each job whose status has changed.
+    """
+    if not states:
+        return []
+
+    # create the jobs that are missing, another tracker may be creating them at the same time
+    existing = set(Job.objects.filter(id__in=states.keys()).values_list("id", flat=True))
+    missing = [state for job_id, state in states.items() if job_id not in existing]
+    if missing:
+        workspaces = {state["workspace_id"] for state in missing}
+        workspaces = set(Workspace.objects.filter(id__in=workspaces).values_list("id", flat=True))
+        jobs = [
+            Job(
+                id=state["job_id"],
+                workspace_id=state["workspace_id"],
+                item_id=state["item_id"],
+                action=state["action"],
+                status=create_status or state["status"],
+            )
+            for state in missing
+            if state["workspace_id"] in workspaces
+        ]
+        Job.objects.bulk_create(jobs, ignore_conflicts=True)
+
+    transitions, updated = [], []
+    now = timezone.now()
+    with transaction.atomic():
+        for job in Job.objects.select_for_update().filter(id__in=states.keys()):
+            state, previous = states[job.id], job.status
+            if previous in K8_JOB_FINAL_STATUSES:
+                continue
+            attributes = {key: state[key] for key in K8_JOB_ATTRIBUTES if state[key] is not None}
+            if state["status"] == previous and all(job.get_attribute(k) == v for k, v in attributes.items()):
+                continue
+            for key, value in attributes.items():
+                job.set_attribute(key, value)
+            job.status = state["status"]
+            job.updated_at = now
+            updated.append(job)
+            if job.status != previous:
+                transitions.append((job, previous))
+                if job.status in K8_JOB_NOTIFIED_STATUSES and job.action in K8_JOB_NOTIFIED_ACTIONS:
+                    job.set_attribute("notify_status", job.status)
+        if updated:
+            Job.objects.bulk_update(updated, ["status", "attributes", "updated_at"])
+
+    for job, previous in transitions:
+        logger.info(f"k8_jobs_update - job: {job.id} changed status from: {previous}, to: {job.status}")
+    return transitions
+
+
+def k8_jobs_notify(job_ids: [str]) -> [dict]:
+    """
+    Notifies the owners of the items of jobs that have completed or failed and have not been
+    notified yet, returns the notifications. Each job is locked while it is notified and marked
+    as notified in the same transaction. Notifications that fail stay pending and are retried.
+    """
+    from api.notifications import notify_job
+
+    notifications = []
+    for job_id in job_ids:
+        with transaction.atomic():
+            job = Job.objects.select_for_update().filter(id=job_id).first()
+            if not job or not job.get_attribute("notify_status"):
+                continue  # not to be notified or already notified
+            attributes = job.attributes
+            try:
+                notifications.append(notify_job(job))
+                attributes["notified_status"] = attributes.pop("notify_status")
+                attributes.pop("notify_attempts", None)
+            except Exception as exc:
+                attempts = attributes["notify_attempts"] = attributes.get("notify_attempts", 0) + 1
+                logger.error(f"k8_jobs_notify - could not notify job: {job.id}, attempt: {attempts}, exc: {exc}")
+                if attempts >= K8_JOB_NOTIFY_MAX_ATTEMPTS:
+                    attributes.pop("notify_status")  # give up
+            job.attributes = attributes
+            job.save(update_fields=["attributes"])
+    return notifications
+
+
+def k8_jobs_notify_pending() -> [dict]:
+    """ Sends the notifications of jobs that could not be notified earlier, returns the notifications """
+    job_ids = Job.objects.filter(attributes__icontains='"notify_status"').values_list("id", flat=True)
+    return k8_jobs_notify(list(job_ids))
+
+
+class K8JobTracker:
+    """
+    Keeps api.models.Job up to date with the jobs running on Kubernetes. Changes reported by
+    the jobs and pods informers mark the job as dirty and flush writes dirty jobs to the database
+    in a single transaction and sends the notifications for the jobs that completed or failed.
+    Notifications that could not be sent are retried every K8_JOB_NOTIFY_RETRY_SECONDS, and
+    when the tracker starts, for jobs that completed while no tracker was running. When a leader
+    function is given, eg. one that acquires a lease, jobs are written only while it returns True.
+    """
+
+    def __init__(
+        self,
+        jobs: K8Informer,
+        pods: K8Informer = None,
+        batch_seconds: float = K8_JOB_TRACKER_BATCH_SECONDS,
+        leader=None,
+    ):
+        self.jobs = jobs
+        self.pods = pods
+        self.batch_seconds = batch_seconds
+        self.leader = leader
+        self.is_leader = leader is None
+        self.leader_checked_at = None  # monotonic time of the last call to leader
+        self.lock = threading.Lock()
+        self.retried_at = 0  # monotonic time of the last retry of pending notifications
+        self.dirty = {}  # job name -> deleted job or None
+        self.stats = dict.fromkeys(("flushes", "updated", "transitions", "notifications", "errors"), 0)
+        jobs.add_handler(self._on_job)
+        if pods:
+            pods.add_handler(self._on_pod)
+
+    def _on_job(self, event_type: str, job: dict):
+        with self.lock:
+            self.dirty[job["metadata"]["name"]] = job if event_type == "DELETED" else None
+
+    def _on_pod(self, event_type: str, pod: dict):
+        job_name = (pod["metadata"].get("labels") or {}).get("job-name")
+        if job_name:
+            with self.lock:
+                self.dirty.setdefault(job_name, None)
+
+    def flush(self) -> [tuple]:
+        """ Saves the jobs that changed since the last flush, notifies and returns their transitions """
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+        states = {}
+        for name, deleted in dirty.items():
+            job = deleted or self.jobs.get(name)
+            if job:
+                pods = self.pods.list(f"job-name={name}")["items"] if self.pods else []
+                state = k8_job_get_state(job, pods, deleted is not None)
+                if state["job_id"]:
+                    states[state["job_id"]] = state
+
+        transitions = k8_jobs_update(states)
+        notifications = k8_jobs_notify([job.id for job, _ in transitions])
+        if not self.retried_at or time.monotonic() - self.retried_at > K8_JOB_NOTIFY_RETRY_SECONDS:
+            self.retried_at = time.monotonic()
+            notifications += k8_jobs_notify_pending()
+        self.stats["flushes"] += 1
+        self.stats["updated"] += len(states)
+        self.stats["transitions"] += len(transitions)
+        self.stats["notifications"] += len(notifications)
+        return transitions
+
+    def run(self, stopped: threading.Event = None):
+        """ Starts the informers and flushes the changed jobs every batch_seconds until stopped """
+        stopped = stopped or threading.Event()
+        self.jobs.start()
+        if self.pods:
+            self.pods.start()
+        while not stopped.wait(self.batch_seconds):
+            try:
+                if self.check_leader():
+                    self.flush()
+            except Exception as exc:
+                self.stats["errors"] += 1
+                logger.error(f"K8JobTracker - flush failed: {exc}")
+
+    def check_leader(self) -> bool:
+        """ Returns True if this tracker should write jobs, the leader function is called every third of a lease """
+        checked_at = self.leader_checked_at
+        if self.leader and (checked_at is None or time.monotonic() - checked_at > K8_JOB_TRACKER_LEASE_SECONDS / 3):
+            self.leader_checked_at = time.monotonic()
+            try:
+                is_leader = self.leader()
+            except Exception as exc:
+                # the lease may expire and be taken over by another tracker while we can't renew it
+                logger.error(f"K8JobTracker - could not renew lease: {exc}")
+                is_leader = False
+            if is_leader != self.is_leader:
+                logger.info(f"K8JobTracker - {'started' if is_leader else 'stopped'} writing jobs")
+            self.is_leader = is_leader
+        return self.is_leader
+
+    def get_stats(self) -> dict:
+        return {"dirty": len(self.dirty), "leader": self.is_leader, **self.stats}
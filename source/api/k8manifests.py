@@ -0,0 +1,128 @@
+import os
+import copy
+import string
+import threading
+import yaml
+
+from analitico import AnaliticoException
+
+# Kubernetes resources are created from yaml templates in serverless/templates that use
+# python's format syntax, eg. name: {job_id_slug}, with {{ and }} for literal braces.
+# Templates are parsed once into manifests where the strings containing placeholders are
+# replaced by K8TemplateValue, values are then substituted into a copy of the manifests.
+# Since values are never formatted into yaml text they can't change the structure of the
+# resource, eg. an environment variable containing ": " or a newline.
+
+# a placeholder is replaced by this marker while the template is parsed
+K8_TEMPLATE_MARKER = "__analitico_template_{}_{}__"
+
+
+class K8TemplateValue:
+    """
+    A string in a template that contains one or more placeholders. A placeholder that makes up
+    the whole string is replaced by its value as is, eg. a list of strings for a container's
+    command, unless it is quoted in the template, eg. "{replicas}", in which case the value is
+    converted to a string. Placeholders inside longer strings are formatted into the string.
+    A list item made up only of a placeholder whose value is a list is replaced by its items.
+    """
+
+    def __init__(self, parts: list):
+        self.parts = parts  # literal strings and (name, quoted) tuples
+
+    def render(self, values: dict):
+        if len(self.parts) == 1 and isinstance(self.parts[0], tuple):
+            name, quoted = self.parts[0]
+            value = _get_value(values, name)
+            return str(value) if quoted else copy.deepcopy(value)
+        return "".join(part if isinstance(part, str) else str(_get_value(values, part[0])) for part in self.parts)
+
+
+def _get_value(values: dict, name: str):
+    try:
+        return values[name]
+    except KeyError:
+        raise AnaliticoException(f"Kubernetes template value '{name}' is missing")
+
+
+class K8Template:
+    """ A yaml template parsed into the manifests of the resources it creates """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.modified_on = os.path.getmtime(path)
+        self.names = set()
+
+        # replace placeholders with markers that parse as plain yaml strings
+        markers = {}
+        text = ""
+        with open(path) as f:
+            for literal, name, _, _ in string.Formatter().parse(f.read()):
+                text += literal
+                if name is not None:
+                    quoted = bool(literal) and literal[-1] in "\"'"
+                    marker = K8_TEMPLATE_MARKER.format(len(markers), name)
+                    markers[marker] = (name, quoted)
+                    self.names.add(name)
+                    text += marker
+        try:
+            manifests = [manifest for manifest in yaml.safe_load_all(text) if manifest]
+        except yaml.YAMLError as exc:
+            raise AnaliticoException(f"Kubernetes template {path} is not valid yaml: {exc}") from exc
+        self.manifests = [self._compile(manifest, markers) for manifest in manifests]
+
+    def _compile(self, node, markers: dict):
+        """ Replaces the strings that contain markers with K8TemplateValue """
+        if isinstance(node, dict):
+            return {self._compile(key, markers): self._compile(value, markers) for key, value in node.items()}
+        if isinstance(node, list):
+            return [self._compile(value, markers) for value in node]
+        if isinstance(node, str) and "__analitico_template_" in node:
+            parts, remaining = [], node
+            for marker, placeholder in markers.items():
+                if marker in remaining:
+                    before, remaining = remaining.split(marker, 1)
+                    if before:
+                        parts.append(before)
+                    parts.append(placeholder)
+            if remaining:
+                parts.append(remaining)
+            return K8TemplateValue(parts)
+        return node
+
+    def _render(self, node, values: dict):
+        if isinstance(node, K8TemplateValue):
+            return node.render(values)
+        if isinstance(node, dict):
+            return {self._render(key, values): self._render(value, values) for key, value in node.items()}
+        if isinstance(node, list):
+            items = []
+            for item in node:
+                value = self._render(item, values)
+                if isinstance(item, K8TemplateValue) and isinstance(value, list):
+                    items.extend(value)  # list spliced into the list
+                else:
+                    items.append(value)
+            return items
+        return node
+
+    def render(self, **values) -> [dict]:
+        """ Returns the manifests of the resources in the template with the given values """
+        return [self._render(manifest, values) for manifest in self.manifests]
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def k8_get_template(path: str) -> K8Template:
+    """ Returns the parsed template, templates are parsed again only if their file changes """
+    with _templates_lock:
+        template = _templates.get(path)
+        if not template or template.modified_on != os.path.getmtime(path):
+            template = _templates[path] = K8Template(path)
+        return template
+
+
+def k8_render_template(path: str, **values) -> [dict]:
+    """ Returns the manifests of the resources in the template at path with the given values """
+    return k8_get_template(path).render(**values)
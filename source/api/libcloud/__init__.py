@@ -1,7 +1,11 @@
 from .webdavdrivers import WebdavStorageDriver, WebdavException, metadata_to_amz_meta_headers
+from .localdrivers import LocalStorageDriver
+from .rangeio import RangeIO
+from .iterio import IterIO, open_iterator
 
 # register driver so user can find
 from libcloud.compute.providers import set_driver
 
 # set_driver('webdav', 'api.libcloud.webdavdrivers', 'WebdavStorageDriver')
 set_driver("webdav", "api.libcloud", "WebdavStorageDriver")
+set_driver("local", "api.libcloud", "LocalStorageDriver")
@@ -0,0 +1,297 @@
+import os
+import json
+import shutil
+import mimetypes
+import email.utils
+import hashlib
+
+from libcloud.storage.base import Object, Container
+
+from .webdavdrivers import WebdavStorageDriver, WebdavException, DOWNLOAD_CHUNK_SIZE_BYTES
+
+# extended attribute used to store custom metadata on files
+METADATA_XATTR = "user.analitico.metadata"
+
+# on filesystems without extended attributes metadata is stored in a json file in this directory
+METADATA_SIDECAR_DIRECTORY = ".analitico/"
+METADATA_SIDECAR_SUFFIX = ".props.json"
+
+# content type reported for directories, same as WebDAV servers
+DIRECTORY_CONTENT_TYPE = "httpd/unix-directory"
+
+
+class LocalStorageDriver(WebdavStorageDriver):
+    """
+    A storage driver for files on the local filesystem, for example a storage box that is
+    already mounted at ANALITICO_DRIVE in a job or a directory used when developing or testing.
+    The driver has the same methods as WebdavStorageDriver and returns the same objects and
+    exceptions so it can be used wherever a WebDAV drive is expected. Paths are relative to
+    the root directory. Custom metadata is stored in extended attributes when the filesystem
+    supports them or in json files next to the files otherwise. Callers can check get_local_path
+    to read files directly instead of streaming them.
+    """
+
+    name = "Local"
+
+    def __init__(self, root: str, **kwargs):
+        assert root, "LocalStorageDriver needs the path of its root directory"
+        root = os.path.realpath(os.path.expanduser(root)).rstrip("/")
+        if not os.path.isdir(root):
+            raise ValueError(f"LocalStorageDriver - {root} is not a directory")
+        # files are read from disk directly so there is nothing worth caching
+        super().__init__(url="file://" + root, ls_cache_ttl=0, **kwargs)
+        self.root = root
+
+    def _local_path(self, path) -> str:
+        """ Returns the path on disk of the given storage path, paths cannot point outside of the root """
+        path = os.path.normpath("/" + self._absolute_path(path).lstrip("/"))
+        local_path = self.root + path if path != "/" else self.root
+        # symbolic links created on the drive could lead anywhere, the files they resolve to must be in the root
+        resolved_path = os.path.realpath(local_path)
+        if resolved_path != self.root and not resolved_path.startswith(self.root + "/"):
+            raise WebdavException("GET", path, 200, 403)
+        return local_path
+
+    def _check_exists(self, method, path, local_path, expected_code=200):
+        if not os.path.exists(local_path):
+            raise WebdavException(method, path, expected_code, 404)
+
+    def get_local_path(self, remote_path) -> str:
+        return self._local_path(remote_path)
+
+    ##
+    ## Metadata
+    ##
+
+    def _sidecar_path(self, local_path) -> str:
+        directory, name = os.path.split(local_path)
+        return os.path.join(directory, METADATA_SIDECAR_DIRECTORY, name + METADATA_SIDECAR_SUFFIX)
+
+    def _get_metadata(self, local_path) -> dict:
+        try:
+            return json.loads(os.getxattr(local_path, METADATA_XATTR))
+        except (AttributeError, OSError):
+            pass  # no attribute or extended attributes not supported
+        try:
+            with open(self._sidecar_path(local_path)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def set_metadata(self, remote_path, metadata=None) -> bool:
+        """ Stores custom metadata with the file, metadata is removed if None """
+        local_path = self._local_path(remote_path)
+        self._check_exists("PROPPATCH", remote_path, local_path, 207)
+        sidecar_path = self._sidecar_path(local_path)
+        if os.path.isfile(sidecar_path):
+            os.remove(sidecar_path)
+        try:
+            if metadata:
+                os.setxattr(local_path, METADATA_XATTR, json.dumps(metadata).encode())
+            else:
+                os.removexattr(local_path, METADATA_XATTR)
+            return True
+        except AttributeError:
+            pass  # extended attributes are not available on this platform
+        except OSError:
+            if not metadata:
+                return True  # there was no attribute
+        if metadata:
+            os.makedirs(os.path.dirname(sidecar_path), exist_ok=True)
+            with open(sidecar_path, "w") as f:
+                json.dump(metadata, f)
+        return True
+
+    ##
+    ## Listing
+    ##
+
+    def _make_item(self, local_path):
+        """ Returns an Object or Container for the given file or directory like _xml_element_to_object does """
+        stat = os.stat(local_path)
+        name = local_path[len(self.root) :] or "/"
+        is_directory = os.path.isdir(local_path)
+        if is_directory and not name.endswith("/"):
+            name += "/"
+
+        extra = {
+            "content_type": DIRECTORY_CONTENT_TYPE if is_directory else mimetypes.guess_type(local_path)[0],
+            "creation_time": email.utils.formatdate(stat.st_ctime, usegmt=True),
+            "last_modified": email.utils.formatdate(stat.st_mtime, usegmt=True),
+            "etag": f"{stat.st_mtime_ns:x}-{stat.st_size:x}",
+        }
+        if is_directory:
+            return Container(name=name, extra=extra, driver=self)
+
+        return Object(
+            name=name,
+            size=stat.st_size,
+            extra=extra,
+            driver=self,
+            container=None,
+            hash=hashlib.md5(extra["etag"].encode()).hexdigest(),
+            meta_data=self._get_metadata(local_path),
+        )
+
+    def ls(self, remote_path, cache=True):
+        """ List given path and return individual item or directory contents as list of Object and Container items. """
+        local_path = self._local_path(remote_path)
+        self._check_exists("PROPFIND", remote_path, local_path, 207)
+        items = [self._make_item(local_path)]
+        if os.path.isdir(local_path):
+            with os.scandir(local_path) as entries:
+                items.extend(self._make_item(entry.path) for entry in entries)
+
+        # link objects to parent container like WebdavStorageDriver.ls does
+        parent = Container(self._parent_path(items[0].name), None, self)
+        for item in items:
+            if isinstance(item, Object):
+                item.container = parent
+        return items
+
+    def ls_many(self, remote_path):
+        """ Returns all the files and directories contained in the given directory and its subdirectories """
+        local_path = self._local_path(remote_path)
+        self._check_exists("PROPFIND", remote_path, local_path, 207)
+        items = [self._make_item(local_path)]
+        for directory, directories, files in os.walk(local_path):
+            directories.sort()
+            parent = Container(self._make_item(directory).name, None, self)
+            for name in directories:
+                items.append(self._make_item(os.path.join(directory, name)))
+            for name in sorted(files):
+                item = self._make_item(os.path.join(directory, name))
+                item.container = parent
+                items.append(item)
+        return items
+
+    def exists(self, remote_path: str) -> bool:
+        return os.path.exists(self._local_path(remote_path))
+
+    ##
+    ## Files and directories
+    ##
+
+    def move(self, path, move_to_path):
+        """ Move a file or directory to the newly specified path (rename), metadata moves with it """
+        local_path, move_to_local_path = self._local_path(path), self._local_path(move_to_path)
+        self._check_exists("MOVE", path, local_path, 201)
+        sidecar_path = self._sidecar_path(local_path)
+        os.replace(local_path, move_to_local_path)
+        if os.path.isfile(sidecar_path):
+            move_to_sidecar_path = self._sidecar_path(move_to_local_path)
+            os.makedirs(os.path.dirname(move_to_sidecar_path), exist_ok=True)
+            os.replace(sidecar_path, move_to_sidecar_path)
+        return True
+
+    def copy(self, path, copy_to_path, depth="infinity"):
+        """ Copy a file or a directory and all its contents, replacing the destination if it exists """
+        local_path, copy_to_local_path = self._local_path(path), self._local_path(copy_to_path)
+        self._check_exists("COPY", path, local_path, 201)
+        if os.path.isdir(local_path):
+            if os.path.isdir(copy_to_local_path):
+                shutil.rmtree(copy_to_local_path)
+            if depth == "0":
+                os.makedirs(copy_to_local_path)
+            else:
+                shutil.copytree(local_path, copy_to_local_path)
+        else:
+            shutil.copy2(local_path, copy_to_local_path)
+            metadata = self._get_metadata(local_path)
+            if metadata:
+                self.set_metadata(copy_to_path, metadata)
+        return True
+
+    def mkdir(self, path, safe=False):
+        local_path = self._local_path(path)
+        if not os.path.isdir(os.path.dirname(local_path)):
+            raise WebdavException("MKCOL", path, 201, 409)
+        try:
+            os.mkdir(local_path)
+        except FileExistsError:
+            if not safe:
+                raise WebdavException("MKCOL", path, 201, 405)
+
+    def mkdirs(self, path):
+        """ Create directories structure, takes a path or Path object. """
+        os.makedirs(self._local_path(path), exist_ok=True)
+
+    def rmdir(self, path, safe=False):
+        """ Delete directory with given path and its contents. """
+        local_path = self._local_path(path)
+        if not os.path.isdir(local_path):
+            if safe:
+                return
+            raise WebdavException("DELETE", path, 204, 404)
+        shutil.rmtree(local_path)
+
+    def delete(self, path):
+        """ Delete specific file. """
+        local_path = self._local_path(path)
+        self._check_exists("DELETE", path, local_path, 204)
+        if os.path.isdir(local_path):
+            shutil.rmtree(local_path)
+        else:
+            os.remove(local_path)
+        sidecar_path = self._sidecar_path(local_path)
+        if os.path.isfile(sidecar_path):
+            os.remove(sidecar_path)
+        return True
+
+    def upload(self, local_path_or_fileobj, remote_path, metadata=None):
+        """ Write a file from a filename, file-like object or iterator of bytes, the file is replaced when complete """
+        local_path = self._local_path(remote_path)
+        if not os.path.isdir(os.path.dirname(local_path)):
+            raise WebdavException("PUT", remote_path, (200, 201, 204), 409)
+        temp_path = os.path.join(os.path.dirname(local_path), ".~" + os.path.basename(local_path))
+        try:
+            if isinstance(local_path_or_fileobj, (str, os.PathLike)):
+                shutil.copyfile(local_path_or_fileobj, temp_path)
+            else:
+                with open(temp_path, "wb") as f:
+                    if isinstance(local_path_or_fileobj, bytes):
+                        f.write(local_path_or_fileobj)
+                    elif hasattr(local_path_or_fileobj, "read"):
+                        shutil.copyfileobj(local_path_or_fileobj, f, DOWNLOAD_CHUNK_SIZE_BYTES)
+                    else:
+                        for chunk in local_path_or_fileobj:
+                            f.write(chunk)
+            os.replace(temp_path, local_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.set_metadata(remote_path, metadata)
+
+    def download_range(self, remote_path, start: int, end: int = None) -> bytes:
+        """ Returns bytes from start to end (inclusive, as in http ranges) or to the end of the file """
+        local_path = self._local_path(remote_path)
+        self._check_exists("GET", remote_path, local_path, (200, 206))
+        with open(local_path, "rb") as f:
+            f.seek(start)
+            return f.read() if end is None else f.read(end - start + 1)
+
+    def download(self, remote_path, local_path_or_fileobj, resume=False, threads=None):
+        """ Copies a file to a local path or file object, the kernel copies the data when possible """
+        local_path = self._local_path(remote_path)
+        self._check_exists("GET", remote_path, local_path)
+        if isinstance(local_path_or_fileobj, (str, os.PathLike)):
+            shutil.copyfile(local_path, local_path_or_fileobj)
+        else:
+            with open(local_path, "rb") as f:
+                shutil.copyfileobj(f, local_path_or_fileobj, DOWNLOAD_CHUNK_SIZE_BYTES)
+
+    def download_as_stream(self, remote_path, chunk_size=DOWNLOAD_CHUNK_SIZE_BYTES, start=0, end=None):
+        """ Streaming read of a file, optionally only from start to end (inclusive) """
+        local_path = self._local_path(remote_path)
+        self._check_exists("GET", remote_path, local_path, (200, 206))
+        chunk_size = chunk_size or DOWNLOAD_CHUNK_SIZE_BYTES
+        with open(local_path, "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
@@ -0,0 +1,62 @@
+import io
+
+# minimum number of bytes requested from the server on each read
+RANGE_BLOCK_SIZE = 1024 * 1024  # 1 MiB
+
+
+class RangeIO(io.RawIOBase):
+    """
+    A readonly, seekable file like object over a file stored on a WebDAV server.
+    Each read is served with an http range request so readers that only need a few
+    parts of a large file, for example the footer and some row groups of a parquet
+    file, do not have to download the whole file. The last block read is kept in memory
+    so many small reads in the same area of the file only make a single request.
+    """
+
+    def __init__(self, driver, remote_path: str, size: int, block_size: int = RANGE_BLOCK_SIZE):
+        super().__init__()
+        self.driver = driver
+        self.remote_path = remote_path
+        self.size = size
+        self.block_size = block_size
+        self._position = 0
+        self._block_start = 0
+        self._block = b""
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"RangeIO - invalid whence: {whence}")
+        if position < 0:
+            raise ValueError(f"RangeIO - negative seek position: {position}")
+        self._position = position
+        return position
+
+    def readinto(self, b):
+        length = min(len(b), self.size - self._position)
+        if length <= 0:
+            return 0
+        offset = self._position - self._block_start
+        if offset < 0 or offset + length > len(self._block):
+            # fetch a new block starting at the current position
+            end = min(self.size, self._position + max(length, self.block_size)) - 1
+            self._block = self.driver.download_range(self.remote_path, self._position, end)
+            self._block_start, offset = self._position, 0
+            length = min(length, len(self._block))
+        b[:length] = self._block[offset : offset + length]
+        self._position += length
+        return length
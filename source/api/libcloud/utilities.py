@@ -1,13 +1,69 @@
-import tempfile
+import concurrent.futures
 import libcloud.storage.base
 
-from pathlib import Path
 from analitico import logger
 
+# number of files copied at once when cloning between different storage servers
+CLONE_THREADS = 4
+
+
+def is_same_server(driver1, driver2) -> bool:
+    """ True if both drivers access the same WebDAV server with the same credentials """
+    return driver1 is driver2 or (driver1.url == driver2.url and driver1.session.auth == driver2.session.auth)
+
+
+def copy_files(item_driver, item_path: str, clone_driver, clone_path: str, threads: int = CLONE_THREADS):
+    """
+    Copies all files and directories in item_path on item_driver to clone_path on clone_driver
+    without storing them locally. Directories are created first, then each file is streamed
+    from its download straight into its upload with multiple files being copied in parallel.
+    """
+    items = item_driver.ls_many(item_path)
+    clone_driver.mkdirs(clone_path)
+    for item_file in items[1:]:
+        if isinstance(item_file, libcloud.storage.base.Container):
+            clone_driver.mkdirs(clone_path + item_file.name[len(item_path) :])
+
+    def _copy_file(item_file):
+        clone_file = clone_path + item_file.name[len(item_path) :]
+        clone_driver.upload(item_driver.download_as_stream(item_file.name), clone_file, metadata=item_file.meta_data)
+
+    files = [item_file for item_file in items if isinstance(item_file, libcloud.storage.base.Object)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        # consume results to raise exceptions from the copies
+        list(executor.map(_copy_file, files))
+
+
+def copy_files_on_server(driver, item_path: str, clone_path: str):
+    """
+    Copies all files and directories in item_path to clone_path on the same server with WebDAV COPY
+    and merges them with the files already in clone_path. A directory that is not in clone_path yet
+    is copied with a single COPY, directories that are already there are merged one entry at a time
+    so their other files are kept. Files that are in both are replaced, as copy_files does.
+    """
+    if not item_path.endswith("/") or not driver.exists(clone_path):
+        clone_parent = driver._parent_path(clone_path)
+        if clone_parent:
+            driver.mkdirs(clone_parent)
+        driver.copy(item_path, clone_path)
+        return
+
+    existing = {entry.name for entry in driver.ls(clone_path, cache=False)}
+    for entry in driver.ls(item_path, cache=False):
+        if entry.name == item_path:
+            continue  # the directory itself
+        clone_entry = clone_path + entry.name[len(item_path) :]
+        if isinstance(entry, libcloud.storage.base.Container) and clone_entry in existing:
+            copy_files_on_server(driver, entry.name, clone_entry)
+        else:
+            driver.copy(entry.name, clone_entry)
+
 
 def clone_files(item, clone, item_path=None, item_driver=None, clone_driver=None):
     """
-    Recursively clone storage files and directories in item to clone.
+    Recursively clone storage files and directories in item to clone, files already in clone are
+    kept unless item has a file with the same name. When both items are on the same server, files
+    are copied on the server with WebDAV COPY, otherwise they are streamed from one server to the other.
     
     Arguments:
         item {Dataset, Recipe, Notebook} -- Item we copy files from.
@@ -20,31 +76,15 @@ def clone_files(item, clone, item_path=None, item_driver=None, clone_driver=None
             clone_driver = clone.storage.driver
         if not item_path:
             item_path = item.storage_base_path
-
-        # current directory exists?
-        clone_path_checked = False
+        clone_path = item_path.replace(item.storage_base_path, clone.storage_base_path)
 
         if item_driver.exists(item_path):
-            ls = item_driver.ls(item_path)
-            # check all except / which is base directory path
-            for item_file in ls[1:]:
-                clone_path = item_file.name.replace(item.storage_base_path, clone.storage_base_path)
-                if isinstance(item_file, libcloud.storage.base.Container):
-                    # clone entire directory recursively
-                    clone_driver.mkdirs(clone_path)
-                    clone_files(item, clone, item_file.name, item_driver, clone_driver)
-                    clone_path_checked = True
-                else:
-                    # check if the directory containing the file actually does exist, if not make it
-                    if not clone_path_checked:
-                        clone_dir = clone_path[: clone_path.rfind("/") + 1]
-                        clone_driver.mkdirs(clone_dir)
-                        clone_path_checked = True
-                    suffix = Path(item_file.name).suffix
-                    # clone single file by downloading + uploading
-                    with tempfile.NamedTemporaryFile(prefix="clone_", suffix=suffix) as f:
-                        item_driver.download(item_file.name, f.name)
-                        clone_driver.upload(f.name, clone_path)
+            if is_same_server(item_driver, clone_driver):
+                copy_files_on_server(item_driver, item_path, clone_path)
+                # copy was made by a different driver, make sure clone_driver does not have stale listings
+                clone_driver._invalidate(clone_path)
+            else:
+                copy_files(item_driver, item_path, clone_driver, clone_path)
 
     except Exception as exc:
         logger.error(f"clone_files - item: {item.id}, clone: {clone.id}, base_path: {item_path}, exc: {exc}")
@@ -19,6 +19,7 @@ from __future__ import with_statement
 
 import os
 import re
+import copy
 import unicodedata
 import simplejson as json
 
@@ -36,6 +37,9 @@ from libcloud.storage.types import (
 
 import urllib
 import requests
+import concurrent.futures
+
+from cacheout import Cache
 import xml.etree.cElementTree as xml
 from xml.sax.saxutils import escape
 from collections import OrderedDict
@@ -49,6 +53,19 @@ logger = logging.getLogger("webdav")
 
 DOWNLOAD_CHUNK_SIZE_BYTES = 1 * 1024 * 1024
 
+# parallel downloads fetch files in ranges of this size, files smaller than the minimum are downloaded in one go
+DOWNLOAD_RANGE_SIZE_BYTES = 16 * 1024 * 1024
+DOWNLOAD_PARALLEL_MIN_SIZE_BYTES = 2 * DOWNLOAD_RANGE_SIZE_BYTES
+
+# while a file is downloaded the version of the remote file (its ETag or Last-Modified) is kept in
+# a file with this suffix next to it, downloads are only resumed if the remote file is the same
+DOWNLOAD_RESUME_SUFFIX = ".download"
+
+# directory listings are cached briefly by each driver and invalidated when the driver changes them
+# https://cacheout.readthedocs.io/en/latest/cache.html
+LS_CACHE_SIZE = 1024
+LS_CACHE_TTL = 10  # seconds
+
 # tag used in extra for object metadata.
 # we use meta_data to be compatible with s3.
 METADATA_EXTRA_TAG = "meta_data"
@@ -114,6 +131,14 @@ def metadata_to_amz_meta_headers(metadata: dict) -> dict:
     return headers
 
 
+def _get_version(headers) -> str:
+    """ Returns the strong ETag of a response or its Last-Modified date, either can be used in If-Range """
+    etag = headers.get("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("last-modified")
+
+
 class WebdavException(LibcloudError):
     """ WebdavException shows method, expected status codes and actual status code reported by server. """
 
@@ -124,7 +149,9 @@ class WebdavException(LibcloudError):
         DELETE="delete",
         MKCOL="create directory",
         PROPFIND="list directory",
+        PROPPATCH="update properties",
         MOVE="rename",
+        COPY="copy",
     )
 
     def __init__(self, method, path, expected_code, actual_code):
@@ -152,12 +179,17 @@ class WebdavStorageDriver(StorageDriver):
     # server base url
     url = None
 
-    def __init__(self, url, username=None, password=None, auth=None, verify_ssl=True, certificate=None):
+    def __init__(
+        self, url, username=None, password=None, auth=None, verify_ssl=True, certificate=None, ls_cache_ttl=LS_CACHE_TTL
+    ):
         assert url and not url.endswith("/"), "WebDAV server url should not end with slash"
 
         self.url = url
         self.cwd = "/"
 
+        # listings keyed by path and depth, writes made by other drivers are seen once the listing expires
+        self.ls_cache = Cache(maxsize=LS_CACHE_SIZE, ttl=ls_cache_ttl) if ls_cache_ttl else None
+
         self.session = requests.session()
         self.session.verify = verify_ssl
         self.session.stream = True
@@ -276,6 +308,33 @@ class WebdavStorageDriver(StorageDriver):
             raise WebdavException(method, path, expected_code, response.status_code)
         return response
 
+    def _absolute_path(self, path) -> str:
+        """ Returns the absolute path on the server of a path that may be relative to the current directory """
+        path = str(path).strip()
+        return path if path.startswith("/") else self.cwd + path
+
+    def _invalidate(self, *paths):
+        """ Removes cached listings of the given paths, their parent directories and their contents """
+        if self.ls_cache is None:
+            return
+        changed = [self._absolute_path(path).rstrip("/") for path in paths]
+        for key in list(self.ls_cache.keys()):
+            cached = key[0].rstrip("/")
+            for path in changed:
+                if path == cached or path.startswith(cached + "/") or cached.startswith(path + "/"):
+                    self.ls_cache.delete(key)
+                    break
+
+    def _send_and_invalidate(self, method, path, expected_code, invalidate=None, **kwargs):
+        """
+        Sends a request that changes the given paths and removes their cached listings once it completes,
+        a listing cached by a concurrent ls while the request was in flight would otherwise be stale.
+        """
+        try:
+            return self._send(method, path, expected_code, **kwargs)
+        finally:
+            self._invalidate(*(invalidate or (path,)))
+
     def cd(self, path):
         path = path.strip()
         if not path:
@@ -290,13 +349,21 @@ class WebdavStorageDriver(StorageDriver):
 
     def move(self, path, move_to_path):
         """ Move a file or group of files from their current location to the newly specified path (rename). """
-        move_to_path = urllib.parse.urljoin(self.url, move_to_path)
-        self._send("MOVE", path, (200, 201, 204), headers={"destination": move_to_path})
+        move_to_url = urllib.parse.urljoin(self.url, move_to_path)
+        headers = {"destination": move_to_url}
+        self._send_and_invalidate("MOVE", path, (200, 201, 204), invalidate=(path, move_to_path), headers=headers)
+        return True
+
+    def copy(self, path, copy_to_path, depth="infinity"):
+        """ Copy a file or a directory and all its contents on the server, replacing the destination if it exists. """
+        copy_to_url = urllib.parse.urljoin(self.url, copy_to_path)
+        headers = {"destination": copy_to_url, "depth": depth, "overwrite": "T"}
+        self._send_and_invalidate("COPY", path, (201, 204), invalidate=(copy_to_path,), headers=headers)
         return True
 
     def mkdir(self, path, safe=False):
         expected_codes = 201 if not safe else (201, 301, 405)
-        self._send("MKCOL", path, expected_codes)
+        self._send_and_invalidate("MKCOL", path, expected_codes)
 
     def mkdirs(self, path):
         """ Create directories structure, takes a path or Path object. """
@@ -323,46 +390,169 @@ class WebdavStorageDriver(StorageDriver):
         """ Delete directory with given path. """
         path = str(path).rstrip("/") + "/"
         expected_codes = 204 if not safe else (204, 404)
-        self._send("DELETE", path, expected_codes)
+        self._send_and_invalidate("DELETE", path, expected_codes)
 
     def delete(self, path):
         """ Delete specific file. """
-        self._send("DELETE", path, 204)
+        self._send_and_invalidate("DELETE", path, 204)
         return True
 
     def upload(self, local_path_or_fileobj, remote_path, metadata=None):
         """ Upload a single file from filename or file-like object. """
         if isinstance(local_path_or_fileobj, str):
             with open(local_path_or_fileobj, "rb") as f:
-                self._send("PUT", remote_path, (200, 201, 204), data=f)
+                self._send_and_invalidate("PUT", remote_path, (200, 201, 204), data=f)
         else:
-            self._send("PUT", remote_path, (200, 201, 204), data=local_path_or_fileobj)
+            self._send_and_invalidate("PUT", remote_path, (200, 201, 204), data=local_path_or_fileobj)
 
         # store custom properties with object, if the object had some metadata
         # associated with it already it will be overwritten by the new metadata
         self.set_metadata(remote_path, metadata)
 
-    def download(self, remote_path, local_path_or_fileobj):
-        response = self._send("GET", remote_path, 200, stream=True)
+    def get_local_path(self, remote_path) -> str:
+        """ Returns the path of a file on a local or mounted filesystem, None if it can only be accessed remotely """
+        return None
+
+    def _range_headers(self, start=0, end=None):
+        """ Returns headers requesting bytes from start to end (inclusive) or to the end of the file """
+        if not start and end is None:
+            return {}
+        return {"Range": f"bytes={start}-{'' if end is None else end}"}
+
+    def _iter_range(self, response, start=0, end=None, chunk_size=DOWNLOAD_CHUNK_SIZE_BYTES):
+        """ Yields the requested range from a response, servers that ignore Range send the whole file with 200 """
+        skip = start if response.status_code == 200 else 0
+        remaining = None if end is None else end - start + 1
+        for chunk in response.iter_content(chunk_size):
+            if skip:
+                if len(chunk) <= skip:
+                    skip -= len(chunk)
+                    continue
+                chunk, skip = chunk[skip:], 0
+            if remaining is not None:
+                chunk = chunk[:remaining]
+                remaining -= len(chunk)
+            if chunk:
+                yield chunk
+            if remaining == 0:
+                break
+        response.close()
+
+    def download_range(self, remote_path, start: int, end: int = None) -> bytes:
+        """ Returns bytes from start to end (inclusive, as in http ranges) or to the end of the file """
+        response = self._send("GET", remote_path, (200, 206), headers=self._range_headers(start, end), stream=True)
+        return b"".join(self._iter_range(response, start, end))
+
+    def download(self, remote_path, local_path_or_fileobj, resume=False, threads=None):
+        """
+        Downloads a remote file to a local path or file object. If resume is True and the local file
+        already exists, only the missing bytes at the end of the file are downloaded provided that the
+        remote file has not changed since the download started, otherwise the file is downloaded again.
+        If threads is greater than one, large files are downloaded as multiple ranges in parallel and
+        written in place in the local file. Servers that do not support ranges get a regular download.
+        """
         if isinstance(local_path_or_fileobj, str) or isinstance(local_path_or_fileobj, Path):
-            with open(local_path_or_fileobj, "wb") as f:
-                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE_BYTES):
-                    f.write(chunk)
+            local_path = str(local_path_or_fileobj)
+            if threads and threads > 1 and self._download_parallel(remote_path, local_path, threads):
+                return
+            self._download_resume(remote_path, local_path, resume)
         else:
+            response = self._send("GET", remote_path, 200, stream=True)
             for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE_BYTES):
                 local_path_or_fileobj.write(chunk)
 
-    def download_as_stream(self, remote_path, chunk_size=DOWNLOAD_CHUNK_SIZE_BYTES):
-        """ Streaming download of remote path. """
-        response = self._send("GET", remote_path, 200, stream=True)
-        for chunk in response.iter_content(chunk_size):
-            yield chunk
-
-    def ls(self, remote_path):
-        """ List given path and return individual item or directory contents as list of Object and Container items. """
-        remote_path = self._normalize_path(remote_path)
-        headers = {"Depth": "1"}
-        response = self._send("PROPFIND", remote_path, (207, 301), headers=headers)
+    def _download_resume(self, remote_path, local_path, resume):
+        """ Downloads a file to a local path, continues a previous download of the same version if resume is True """
+        resume_path = local_path + DOWNLOAD_RESUME_SUFFIX
+        start, version = 0, None
+        if resume and os.path.isfile(local_path) and os.path.isfile(resume_path):
+            with open(resume_path) as f:
+                version = f.read().strip()
+            start = os.path.getsize(local_path) if version else 0
+
+        response = None
+        if start:
+            # If-Range returns the whole file (200) instead of the range if the remote file has changed
+            headers = {**self._range_headers(start), "If-Range": version}
+            response = self._send("GET", remote_path, (200, 206, 416), headers=headers, stream=True)
+            if response.status_code == 416:
+                # range starts at the end of the file or after it, the local file is complete if it has
+                # the same size as the remote file, eg. Content-Range: bytes */1234, and the same version
+                response.close()
+                size = response.headers.get("content-range", "").rpartition("/")[2]
+                if size == str(start) and _get_version(self._send("HEAD", remote_path, 200).headers) == version:
+                    os.remove(resume_path)
+                    return
+                response = None
+            elif response.status_code == 206 and (
+                _get_version(response.headers) != version
+                or not response.headers.get("content-range", "").startswith(f"bytes {start}-")
+            ):
+                response.close()  # server ignored If-Range or sent another range
+                response = None
+        if response is None or response.status_code != 206:
+            if response is None:
+                response = self._send("GET", remote_path, 200, stream=True)
+            start = 0
+
+        # keep the version being downloaded so an interrupted download can be resumed
+        with open(resume_path, "w") as f:
+            f.write(_get_version(response.headers) or "")
+        with open(local_path, "ab" if start else "wb") as f:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE_BYTES):
+                f.write(chunk)
+        os.remove(resume_path)
+
+    def _download_parallel(self, remote_path, local_path, threads) -> bool:
+        """ Downloads ranges of a large file in parallel into a local file, False if ranges are not supported """
+        response = self._send("HEAD", remote_path, 200)
+        size = int(response.headers.get("content-length", 0))
+        if size < DOWNLOAD_PARALLEL_MIN_SIZE_BYTES or response.headers.get("accept-ranges") != "bytes":
+            return False
+        version = _get_version(response.headers)
+
+        downloaded = False
+        try:
+            with open(local_path, "wb") as f:
+                f.truncate(size)
+                fileno = f.fileno()
+
+                def _download_range(start):
+                    end = min(start + DOWNLOAD_RANGE_SIZE_BYTES, size) - 1
+                    headers = self._range_headers(start, end)
+                    if version:
+                        headers["If-Range"] = version  # all ranges must come from the same version of the file
+                    range_response = self._send("GET", remote_path, (200, 206), headers=headers, stream=True)
+                    if range_response.status_code != 206:
+                        range_response.close()
+                        return False
+                    offset = start
+                    for chunk in range_response.iter_content(DOWNLOAD_CHUNK_SIZE_BYTES):
+                        os.pwrite(fileno, chunk, offset)
+                        offset += len(chunk)
+                    return offset == end + 1
+
+                with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+                    downloaded = all(executor.map(_download_range, range(0, size, DOWNLOAD_RANGE_SIZE_BYTES)))
+        finally:
+            if not downloaded:
+                # the file is full size but parts of it are zeros, it must not be mistaken for a partial download
+                for path in (local_path, local_path + DOWNLOAD_RESUME_SUFFIX):
+                    if os.path.isfile(path):
+                        os.remove(path)
+        if not downloaded:
+            logger.warning(f"WebdavStorageDriver - {remote_path} could not be downloaded in ranges")
+        return downloaded
+
+    def download_as_stream(self, remote_path, chunk_size=DOWNLOAD_CHUNK_SIZE_BYTES, start=0, end=None):
+        """ Streaming download of remote path, optionally only from start to end (inclusive) """
+        headers = self._range_headers(start, end)
+        response = self._send("GET", remote_path, (200, 206), headers=headers, stream=True)
+        yield from self._iter_range(response, start, end, chunk_size)
+
+    def _propfind(self, remote_path, depth):
+        """ Returns the xml tree with the properties of given path, following redirects """
+        response = self._send("PROPFIND", remote_path, (207, 301), headers={"Depth": depth})
 
         # follow redirects if content has moved to a new location
         # this will not follow content
@@ -370,11 +560,28 @@ class WebdavStorageDriver(StorageDriver):
             redirect_url = response.headers["location"]
             redirect_path = urlparse(redirect_url).path
             if remote_path != redirect_path:
-                return self.ls(redirect_path)
+                return self._propfind(redirect_path, depth)
             else:
                 raise LibcloudError(f"Content has been moved (301). {response.content}", driver=self)
+        return xml.fromstring(response.content)
 
-        tree = xml.fromstring(response.content)
+    def _copy_item(self, item):
+        """ Returns a copy of a cached item that callers can modify without changing the cache """
+        item = copy.copy(item)
+        item.extra = dict(item.extra) if item.extra else item.extra
+        if isinstance(item, Object) and item.meta_data:
+            item.meta_data = dict(item.meta_data)
+        return item
+
+    def ls(self, remote_path, cache=True):
+        """ List given path and return individual item or directory contents as list of Object and Container items. """
+        remote_path = self._normalize_path(remote_path)
+        if cache and self.ls_cache is not None:
+            items = self.ls_cache.get((remote_path, "1"))
+            if items is not None:
+                return [self._copy_item(item) for item in items]
+
+        tree = self._propfind(remote_path, "1")
         items = [self._xml_element_to_object(elem) for elem in tree.findall("{DAV:}response")]
 
         # link objects to parent container
@@ -385,6 +592,62 @@ class WebdavStorageDriver(StorageDriver):
             for item in items:
                 if isinstance(item, Object):
                     item.container = parent
+
+        if self.ls_cache is not None:
+            self.ls_cache.set((remote_path, "1"), items)
+            # files in a directory listing can be listed individually without another roundtrip
+            if remote_path.endswith("/"):
+                for item in items:
+                    if isinstance(item, Object):
+                        file_item = self._copy_item(item)
+                        file_item.container = Container(remote_path, None, self)
+                        self.ls_cache.set((item.name, "1"), [file_item])
+            return [self._copy_item(item) for item in items]
+        return items
+
+    def ls_many(self, remote_path):
+        """
+        Returns all the files and directories contained in the given directory and its subdirectories
+        as a list of Object and Container items retrieved with a single PROPFIND with Depth: infinity.
+        Servers that do not allow infinite depth are listed one directory at a time. The listing of each
+        directory and file is also cached so that following calls to ls() do not need to reach the server.
+        """
+        remote_path = self._normalize_container_name(self._absolute_path(remote_path))
+        try:
+            tree = self._propfind(remote_path, "infinity")
+            items = [self._xml_element_to_object(elem) for elem in tree.findall("{DAV:}response")]
+        except WebdavException as exc:
+            if exc.actual_code not in (400, 403, 501):
+                raise
+            # infinite depth is disabled on the server, walk the tree instead
+            items, directories = [], [remote_path]
+            while directories:
+                listing = self.ls(directories.pop(0))
+                items.extend(listing if not items else listing[1:])
+                directories.extend(item.name for item in listing[1:] if isinstance(item, Container))
+            return items
+
+        # link objects to their directory like ls() of the object's path would
+        for item in items:
+            if isinstance(item, Object):
+                item.container = Container(self._parent_path(item.name), None, self)
+
+        if self.ls_cache is not None:
+            # cache listing of each file and directory (the directory itself, then its children)
+            # objects in a directory listing are linked to the directory's parent like in ls()
+            listings = OrderedDict((item.name, [item]) for item in items if isinstance(item, Container))
+            for item in items:
+                if isinstance(item, Object):
+                    self.ls_cache.set((item.name, "1"), [item])
+                parent_path = self._parent_path(item.name)
+                if item.name != remote_path and parent_path in listings:
+                    if isinstance(item, Object):
+                        item = self._copy_item(item)
+                        item.container = Container(self._parent_path(parent_path), None, self)
+                    listings[parent_path].append(item)
+            for path, listing in listings.items():
+                self.ls_cache.set((path, "1"), listing)
+            return [self._copy_item(item) for item in items]
         return items
 
     def exists(self, remote_path: str) -> bool:
@@ -415,7 +678,7 @@ class WebdavStorageDriver(StorageDriver):
         patch_xml += "</dav:propertyupdate>"
 
         # should apply and reply with 207
-        self._send("PROPPATCH", remote_path, (200, 207), data=patch_xml)
+        self._send_and_invalidate("PROPPATCH", remote_path, (200, 207), data=patch_xml)
         # TODO should really check the content of 207 responses and exctract and 500 inside the xml payload
         return True
 
@@ -0,0 +1,60 @@
+import os
+import socket
+import functools
+
+from django.core.management.base import BaseCommand
+
+from analitico import logger, AnaliticoException
+
+from api.k8 import K8_DEFAULT_NAMESPACE
+from api.k8client import get_k8_client, k8_acquire_lease
+from api.k8informers import get_informer
+from api.k8jobtracker import (
+    K8JobTracker,
+    K8_JOB_TRACKER_BATCH_SECONDS,
+    K8_JOB_TRACKER_LEASE_NAME,
+    K8_JOB_TRACKER_LEASE_SECONDS,
+)
+
+# Writing custom django-admin commands
+# https://docs.djangoproject.com/en/2.1/howto/custom-management-commands/
+
+
+class Command(BaseCommand):
+    """
+    A django command that keeps jobs in the database up to date with the jobs running on Kubernetes.
+    The command is started with each replica of the server by scripts/api-start.sh and the tracker
+    holding the K8_JOB_TRACKER_LEASE_NAME lease writes the jobs while the others wait to take over.
+    """
+
+    help = "Watch jobs and pods on Kubernetes, save their status to the database and notify when they complete."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--namespace", type=str, default=K8_DEFAULT_NAMESPACE, help="Namespace of the jobs")
+        parser.add_argument(
+            "--batch", type=float, default=K8_JOB_TRACKER_BATCH_SECONDS, help="Seconds between database updates"
+        )
+
+    def handle(self, *args, **options):
+        jobs = get_informer("job", options["namespace"], start=False)
+        pods = get_informer("pod", options["namespace"], start=False)
+        if not jobs:
+            raise AnaliticoException(
+                f"Informers are not available for namespace {options['namespace']}, check that the Kubernetes API "
+                "server is configured and the namespace is in ANALITICO_K8_INFORMER_NAMESPACES"
+            )
+
+        # only one tracker at a time writes jobs, the others take over if it stops renewing its lease
+        identity = f"{socket.gethostname()}-{os.getpid()}"
+        leader = functools.partial(
+            k8_acquire_lease,
+            get_k8_client(),
+            K8_JOB_TRACKER_LEASE_NAME,
+            identity,
+            K8_JOB_TRACKER_LEASE_SECONDS,
+            options["namespace"],
+        )
+
+        logger.info(f"Job tracker {identity} watching jobs in namespace: {options['namespace']}")
+        K8JobTracker(jobs, pods, batch_seconds=options["batch"], leader=leader).run()
+        return 0
@@ -1,6 +1,15 @@
+import io
 import tempfile
 import pandas as pd
+import numpy as np
+import pyarrow
+import pyarrow.parquet
 import os
+import re
+import ast
+import bisect
+import tokenize
+import itertools
 import libcloud.storage
 
 from pathlib import Path
@@ -10,10 +19,12 @@ import analitico.pandas
 import analitico.schema
 import analitico.utilities
 from analitico import AnaliticoException, logger, PARQUET_SUFFIXES, CSV_SUFFIXES, EXCEL_SUFFIXES, HDF_SUFFIXES
-from analitico.pandas import pd_read_csv
+from analitico.pandas import pd_read_csv, CSV_CHUNKSIZE
+from analitico.profile import profile_dataframe_chunks
 from api.k8 import k8_job_generate_dataset_metadata, kubectl, K8_DEFAULT_NAMESPACE
 from api.models import ItemMixin
 
+import api.libcloud
 import api.libcloud.iterio
 from api.libcloud.webdavdrivers import WebdavStorageDriver
 
@@ -23,9 +34,23 @@ from api.libcloud.webdavdrivers import WebdavStorageDriver
 # https://simplejson.readthedocs.io/en/latest/
 import simplejson as json
 
-# dataframe size limit for exploring, quering and generating metadata
+# dataframe size limit for files that need to be loaded in memory as a whole
 DATAFRAME_OPEN_SIZE_LIMIT_MB = 100
 
+# csv and parquet files up to this size are profiled while their metadata is requested, larger files in a job
+METADATA_SYNC_SIZE_LIMIT_MB = 256
+
+# the row offsets index of csv files keeps the byte offset of one data row every this many rows
+CSV_INDEX_INTERVAL = 1000
+
+# quotes and newlines, used to find where rows start in csv files with quoted fields
+CSV_QUOTES_NEWLINES_RE = re.compile(rb'["\n]')
+
+# comparisons in ?query= that can be checked against the statistics of parquet row groups
+QUERY_COMPARISONS = {ast.Eq: "==", ast.NotEq: "!=", ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">="}
+QUERY_COMPARISONS_REVERSED = {"==": "==", "!=": "!=", "<": ">", "<=": ">=", ">": "<", ">=": "<="}
+QUERY_BOOLEAN_OPERATORS = {"&": "and", "|": "or"}
+
 
 ##
 ## Public methods
@@ -40,6 +65,14 @@ def get_metadata_path(path: str):
     return os.path.join(os.path.dirname(path), ".analitico/", os.path.basename(path) + ".json")
 
 
+def get_index_path(path: str):
+    """
+    Return the path where the row offsets index of a csv file is saved.
+    Eg: datasets/ds_titanic/.analitico/titanic.csv.index.json
+    """
+    return os.path.join(os.path.dirname(path), ".analitico/", os.path.basename(path) + ".index.json")
+
+
 def get_file_metadata(item: ItemMixin, driver: WebdavStorageDriver, path: str, refresh: bool = True) -> dict:
     """
     Retrieve file object from path.
@@ -87,8 +120,13 @@ def get_file_metadata(item: ItemMixin, driver: WebdavStorageDriver, path: str, r
         if not metadata and refresh:
             metadata = {}
 
-            # generate metadata asyncronous due to memory limits
-            # to open the dataset with Pandas.
+            # files are profiled in a single streaming pass, smaller files right away
+            streamed = suffix in CSV_SUFFIXES or suffix in PARQUET_SUFFIXES
+            size_limit_mb = METADATA_SYNC_SIZE_LIMIT_MB if streamed else DATAFRAME_OPEN_SIZE_LIMIT_MB
+            if obj.size <= analitico.utilities.size_to_bytes(f"{size_limit_mb}MB"):
+                return generate_file_metadata(driver, path, obj)
+
+            # larger files are profiled asyncronously in a job.
             # First check the job is not already running.
             jobs, _ = kubectl(
                 K8_DEFAULT_NAMESPACE,
@@ -109,6 +147,290 @@ def get_file_metadata(item: ItemMixin, driver: WebdavStorageDriver, path: str, r
     return metadata
 
 
+def generate_file_metadata(driver: WebdavStorageDriver, path: str, obj) -> dict:
+    """
+    Profiles a data file and saves its metadata next to it. Csv files are read in chunks and
+    parquet files one row group at a time so memory use does not depend on the size of the file.
+    Metadata includes the number of records, the schema and statistics on each column, see
+    analitico.profile.DataFrameProfiler.
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix in CSV_SUFFIXES or suffix in PARQUET_SUFFIXES:
+        chunks = iter_file_dataframes(driver, path, obj.size)
+    else:
+        chunks = [get_file_dataframe(driver, path)[0]]
+
+    metadata = profile_dataframe_chunks(chunks)
+    metadata["hash"] = obj.hash
+
+    metadata_path = get_metadata_path(path)
+    driver.mkdirs(os.path.dirname(metadata_path))
+    driver.upload(io.BytesIO(json.dumps(metadata, ignore_nan=True).encode()), metadata_path)
+    return metadata
+
+
+##
+## Paging
+##
+
+
+def _query_dataframe(df: pd.DataFrame, query: str) -> pd.DataFrame:
+    """ Returns the rows matching the given pandas query """
+    try:
+        # examples:
+        # https://www.geeksforgeeks.org/python-filtering-data-with-pandas-query-method/
+        return df.query(query)
+    except Exception as exc:
+        raise AnaliticoException(
+            f"Query could not be completed: {exc}",
+            status_code=status.HTTP_400_BAD_REQUEST,
+            extra={"query": query, "error": str(exc)},
+        ) from exc
+
+
+def _get_sort_columns(sort: str) -> (list, list):
+    """ Returns columns and ascending flags from a sort string, eg: ?sort=Name,-Age """
+    by, ascending = [], []
+    for column in sort.split(","):
+        if column.startswith("-"):
+            by.append(column[1:])
+            ascending.append(False)
+        else:
+            by.append(column)
+            ascending.append(True)
+    return by, ascending
+
+
+def _sort_dataframe(df: pd.DataFrame, sort: str) -> pd.DataFrame:
+    by, ascending = _get_sort_columns(sort)
+    return df.sort_values(by, ascending=ascending)
+
+
+def _get_query_columns(query: str, columns: list) -> list:
+    """ Returns the columns used in a pandas query or None if they cannot be determined """
+    names = set(re.findall(r"`([^`]+)`", query))
+    try:
+        tree = ast.parse(re.sub(r"`[^`]+`", "0", query).strip(), mode="eval")
+    except SyntaxError:
+        return None
+    names.update(node.id for node in ast.walk(tree) if isinstance(node, ast.Name))
+    return [column for column in columns if column in names]
+
+
+def _get_query_predicates(query: str) -> list:
+    """
+    Returns the simple comparisons that all rows matching the query have to satisfy,
+    eg: "Age > 30 and Sex == 'male'" returns [("Age", ">", 30), ("Sex", "==", "male")].
+    Other parts of the query are ignored, the query itself is always applied to the rows.
+    """
+    try:
+        # pandas gives & and | the precedence of 'and' and 'or', eg: "Age > 30 & Sex == 'male'"
+        tokens = [
+            (tokenize.NAME, QUERY_BOOLEAN_OPERATORS[token.string])
+            if token.type == tokenize.OP and token.string in QUERY_BOOLEAN_OPERATORS
+            else (token.type, token.string)
+            for token in tokenize.generate_tokens(io.StringIO(query.strip()).readline)
+        ]
+        tree = ast.parse(tokenize.untokenize(tokens).strip(), mode="eval")
+    except (SyntaxError, tokenize.TokenError):
+        return []
+
+    predicates = []
+
+    def _visit(node):
+        if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+            for value in node.values:
+                _visit(value)
+        elif isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in QUERY_COMPARISONS:
+            left, op, right = node.left, QUERY_COMPARISONS[type(node.ops[0])], node.comparators[0]
+            if isinstance(right, ast.Name) and not isinstance(left, ast.Name):
+                left, op, right = right, QUERY_COMPARISONS_REVERSED[op], left
+            if isinstance(left, ast.Name):
+                try:
+                    predicates.append((left.id, op, ast.literal_eval(right)))
+                except ValueError:
+                    pass  # compared to another column or expression
+
+    _visit(tree.body)
+    return predicates
+
+
+def _row_group_may_match(row_group, column_indexes: dict, predicates: list) -> bool:
+    """ Returns False if the min/max statistics of a parquet row group show that no row can match the predicates """
+    for column, op, value in predicates:
+        if column not in column_indexes:
+            continue
+        statistics = row_group.column(column_indexes[column]).statistics
+        if statistics is None or not statistics.has_min_max:
+            continue
+        low, high = statistics.min, statistics.max
+        try:
+            if (
+                (op == "==" and not low <= value <= high)
+                or (op == "!=" and low == high == value)
+                or (op == "<" and not low < value)
+                or (op == "<=" and not low <= value)
+                or (op == ">" and not high > value)
+                or (op == ">=" and not high >= value)
+            ):
+                return False
+        except TypeError:
+            pass  # value is not comparable with the column's type
+    return True
+
+
+def _open_parquet(driver: WebdavStorageDriver, path: str, size: int):
+    """ Opens a parquet file memory mapped if it is on a local drive or via http range requests if it is remote """
+    local_path = driver.get_local_path(path)
+    if local_path:
+        return pyarrow.parquet.ParquetFile(local_path, memory_map=True)
+    return pyarrow.parquet.ParquetFile(api.libcloud.RangeIO(driver, path, size))
+
+
+def _get_parquet_page(
+    driver: WebdavStorageDriver, path: str, size: int, page: int, page_size: int, query: str = None, sort: str = None
+) -> (pd.DataFrame, int):
+    """
+    Returns a page of records from a parquet file and the total number of records matching the query.
+    The file's footer is used to find the row groups holding the requested rows and only those are
+    downloaded using ranged requests. When filtering or sorting, only the columns used by the query
+    and sort are read from all row groups (skipping row groups whose statistics rule out a match),
+    then all columns are read for the row groups holding the rows in the page.
+    """
+    parquet = _open_parquet(driver, path, size)
+    metadata = parquet.metadata
+    group_rows = [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+    group_starts = [0] + list(itertools.accumulate(group_rows))[:-1]
+    page_start = page * page_size
+
+    def _read_row_group(i, columns=None):
+        return parquet.read_row_group(i, columns=columns, use_pandas_metadata=columns is None).to_pandas()
+
+    if not query and not sort:
+        frames = []
+        for i, start in enumerate(group_starts):
+            if start < page_start + page_size and start + group_rows[i] > page_start:
+                df = _read_row_group(i)
+                frames.append(df.iloc[max(0, page_start - start) : page_start + page_size - start])
+        if not frames and group_rows:
+            frames.append(_read_row_group(0).iloc[0:0])
+        return (pd.concat(frames) if frames else pd.DataFrame()), metadata.num_rows
+
+    # read the columns needed to filter and sort, keyed by the position of each row in the file
+    columns = [metadata.schema.column(i).path for i in range(metadata.num_columns)]
+    key_columns = set(_get_sort_columns(sort)[0]) if sort else set()
+    if query:
+        query_columns = _get_query_columns(query, columns)
+        key_columns = key_columns.union(query_columns) if query_columns is not None else set(columns)
+    predicates = _get_query_predicates(query) if query else []
+    column_indexes = {column: i for i, column in enumerate(columns)}
+
+    keys = []
+    for i, start in enumerate(group_starts):
+        if predicates and not _row_group_may_match(metadata.row_group(i), column_indexes, predicates):
+            continue
+        df = _read_row_group(i, [column for column in columns if column in key_columns] or None)
+        df.index = pd.RangeIndex(start, start + group_rows[i])
+        if query:
+            df = _query_dataframe(df, query)
+        keys.append(df)
+    if not keys:
+        return pd.DataFrame(columns=[column for column in columns if not column.startswith("__")]), 0
+    keys = pd.concat(keys)
+    if sort:
+        keys = _sort_dataframe(keys, sort)
+
+    # read the row groups holding the rows in the page, then put the rows back in sorted order
+    selected = keys.index[page_start : page_start + page_size]
+    positions = {}
+    for row in selected:
+        i = bisect.bisect_right(group_starts, row) - 1
+        positions.setdefault(i, []).append(row - group_starts[i])
+    frames, rows = [], []
+    for i, group_positions in positions.items():
+        frames.append(_read_row_group(i).iloc[group_positions])
+        rows.extend(group_starts[i] + position for position in group_positions)
+    if not frames:
+        return _read_row_group(0).iloc[0:0], len(keys.index)
+    order = pd.Series(np.arange(len(rows)), index=rows)[selected].values
+    return pd.concat(frames).iloc[order], len(keys.index)
+
+
+def _build_csv_index(driver: WebdavStorageDriver, path: str) -> dict:
+    """
+    Reads a csv file once and returns the byte offsets where every CSV_INDEX_INTERVAL-th data row starts
+    and the number of data rows. Newlines inside quoted fields do not start a new row.
+    """
+    offsets, starts_count, last_start, position, quoted = [], 0, None, 0, False
+    for chunk in driver.download_as_stream(path):
+        if quoted or b'"' in chunk:
+            starts = []
+            for match in CSV_QUOTES_NEWLINES_RE.finditer(chunk):
+                if match.group() == b'"':
+                    quoted = not quoted
+                elif not quoted:
+                    starts.append(match.end())
+            starts = np.array(starts, dtype=np.int64)
+        else:
+            starts = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n")) + 1
+        if len(starts):
+            # the first newline ends the header and starts data row 0
+            starts += position
+            offsets.extend(int(start) for start in starts[(-starts_count) % CSV_INDEX_INTERVAL :: CSV_INDEX_INTERVAL])
+            starts_count += len(starts)
+            last_start = int(starts[-1])
+        position += len(chunk)
+    # a newline at the end of the file does not start a row
+    rows = starts_count
+    if last_start == position:
+        rows -= 1
+        if offsets and offsets[-1] == position:
+            offsets.pop()
+    return {"interval": CSV_INDEX_INTERVAL, "rows": rows, "offsets": offsets}
+
+
+def _get_csv_index(driver: WebdavStorageDriver, path: str, obj) -> dict:
+    """ Returns the row offsets index of a csv file, the index is built and saved when missing or stale """
+    index_path = get_index_path(path)
+    try:
+        index = json.loads(b"".join(driver.download_as_stream(index_path)))
+        if index.get("hash") == obj.hash and index.get("interval") == CSV_INDEX_INTERVAL:
+            return index
+    except Exception:
+        logger.debug(f"index for the file {path} does not exist")
+
+    index = _build_csv_index(driver, path)
+    index["hash"] = obj.hash
+    try:
+        driver.mkdirs(os.path.dirname(index_path))
+        driver.upload(io.BytesIO(json.dumps(index).encode()), index_path)
+    except Exception as exc:
+        logger.warning("get_csv_index - could not save index for %s, exc: %s", path, exc)
+    return index
+
+
+def _get_csv_page(driver: WebdavStorageDriver, path: str, obj, page: int, page_size: int) -> (pd.DataFrame, int):
+    """ Returns a page of records from a csv file and the total number of records using the file's row offsets index """
+    index = _get_csv_index(driver, path, obj)
+    offsets, page_start = index["offsets"], page * page_size
+    if not offsets:
+        return pd_read_csv(api.libcloud.iterio.open_iterator(driver.download_as_stream(path))), index["rows"]
+
+    # the header is followed by the rows from the closest indexed row before the page
+    header = driver.download_range(path, 0, offsets[0] - 1)
+    if page_start >= index["rows"]:
+        return pd_read_csv(io.BytesIO(header)), index["rows"]
+    offset = page_start // index["interval"]
+    skip = page_start - offset * index["interval"]
+    obj_stream = driver.download_as_stream(path, start=offsets[offset])
+    try:
+        obj_io = api.libcloud.iterio.open_iterator(itertools.chain([header], obj_stream))
+        df = pd_read_csv(obj_io, skiprows=range(1, skip + 1), nrows=page_size)
+    finally:
+        obj_stream.close()
+    return df, index["rows"]
+
+
 def get_file_dataframe(
     driver: WebdavStorageDriver, path: str, page: int = 0, page_size: int = None, query: str = None, sort: str = None
 ) -> (pd.DataFrame, int):
@@ -118,6 +440,10 @@ def get_file_dataframe(
     dataset and return only the filtered rows. The file must be one of the
     supported formats, see: analitico.PANDAS_SUFFIXES
 
+    Pages of parquet files are read from the row groups holding the requested rows
+    and pages of csv files are read starting from a row offsets index, so files of
+    any size can be paged. Other formats and unpaged reads load the whole file.
+
     Arguments:
         driver {WebdavStorageDriver} -- Storage driver used to retrieve the file
         path {str} -- The path of the asset on disk
@@ -132,82 +458,165 @@ def get_file_dataframe(
         pd.DataFrame -- Records as a Pandas dataframe.
         int -- Number of rows in dataframe (if known).
     """
-    # skip metadata for big files otherwise request can stuck
     ls = driver.ls(path)
-    if len(ls) == 1 and isinstance(ls[0], libcloud.storage.base.Object):
-        obj = ls[0]
-        if obj.size > analitico.utilities.size_to_bytes(f"{DATAFRAME_OPEN_SIZE_LIMIT_MB}MB"):
-            raise AnaliticoException(
-                f"Dataframe is too large to be opened (limit set to {DATAFRAME_OPEN_SIZE_LIMIT_MB}MB)",
-                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-            )
-
-    obj_stream = driver.download_as_stream(path)
-    obj_io = api.libcloud.iterio.IterIO(obj_stream)
+    obj = ls[0] if len(ls) == 1 and isinstance(ls[0], libcloud.storage.base.Object) else None
+    suffix = Path(path).suffix
 
-    # true if dataframe has already been paged
-    already_paged = False
+    if obj and page_size:
+        if suffix in PARQUET_SUFFIXES:
+            return _get_parquet_page(driver, path, obj.size, page, page_size, query, sort)
+        if suffix in CSV_SUFFIXES and not query:
+            # sorting applies to the rows in the page
+            df, rows = _get_csv_page(driver, path, obj, page, page_size)
+            return (_sort_dataframe(df, sort) if sort else df), rows
+
+    # skip big files that would need to be loaded in memory otherwise request can stuck
+    if obj and obj.size > analitico.utilities.size_to_bytes(f"{DATAFRAME_OPEN_SIZE_LIMIT_MB}MB"):
+        raise AnaliticoException(
+            f"Dataframe is too large to be opened (limit set to {DATAFRAME_OPEN_SIZE_LIMIT_MB}MB)",
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+
+    # files on local drives are read directly, remote files are streamed
+    local_path = driver.get_local_path(path)
+    obj_io = local_path or api.libcloud.iterio.open_iterator(driver.download_as_stream(path))
 
-    suffix = Path(path).suffix
     if suffix in CSV_SUFFIXES:
-        if not query and page_size:
-            # read csv from stream, skip offset rows, read only rows we care about
-            df = pd_read_csv(obj_io, skiprows=range(1, (page * page_size) + 1), nrows=page_size)
-            already_paged = True
-        else:
-            df = pd_read_csv(obj_io)
+        df = pd_read_csv(obj_io)
     elif suffix in PARQUET_SUFFIXES:
         df = pd.read_parquet(obj_io)
     elif suffix in EXCEL_SUFFIXES:
-        # reading stream is not supported yet
-        with tempfile.NamedTemporaryFile(suffix=suffix) as f:
-            driver.download(path, f.name)
-            df = pd.read_excel(f.name)
+        if local_path:
+            df = pd.read_excel(local_path)
+        else:
+            # reading stream is not supported yet
+            with tempfile.NamedTemporaryFile(suffix=suffix) as f:
+                driver.download(path, f.name)
+                df = pd.read_excel(f.name)
     elif suffix in HDF_SUFFIXES:
-        # reading stream is not supported yet
-        with tempfile.NamedTemporaryFile(suffix=suffix) as f:
-            driver.download(path, f.name)
-            df = pd.read_hdf(f.name, "df")
+        if local_path:
+            df = pd.read_hdf(local_path, "df")
+        else:
+            # reading stream is not supported yet
+            with tempfile.NamedTemporaryFile(suffix=suffix) as f:
+                driver.download(path, f.name)
+                df = pd.read_hdf(f.name, "df")
     else:
         raise AnaliticoException(f"Unknown format for {path}.", status_code=status.HTTP_400_BAD_REQUEST)
 
     if query:
-        try:
-            # examples:
-            # https://www.geeksforgeeks.org/python-filtering-data-with-pandas-query-method/
-            df.query(query, inplace=True)
-        except Exception as exc:
-            raise AnaliticoException(
-                f"Query could not be completed: {exc}",
-                status_code=status.HTTP_400_BAD_REQUEST,
-                extra={"query": query, "error": str(exc)},
-            ) from exc
-
+        df = _query_dataframe(df, query)
     if sort:
-        # eg: ?sort=Name,-Age
-        columns = sort.split(",")
-        by = []
-        ascending = []
-        for column in columns:
-            if column.startswith("-"):
-                by.append(column[1:])
-                ascending.append(False)
-            else:
-                by.append(column)
-                ascending.append(True)
-
-        df.sort_values(by, ascending=ascending, inplace=True)
-
-    # number of total rows is unknown if we're prepaging the file
-    rows = None if already_paged else len(df.index)
-
-    if not already_paged and page_size:
+        df = _sort_dataframe(df, sort)
+
+    rows = len(df.index)
+    if page_size:
         page_offset = page * page_size
         df = df.iloc[page_offset : page_offset + page_size]
 
     return df, rows
 
 
+##
+## Conversions
+##
+
+
+def iter_file_dataframes(driver: WebdavStorageDriver, path: str, size: int):
+    """ Yields the records of a csv file in chunks or those of a parquet file one row group at a time """
+    suffix = Path(path).suffix.lower()
+    local_path = driver.get_local_path(path)
+    if suffix in CSV_SUFFIXES:
+        obj_io = local_path or api.libcloud.iterio.open_iterator(driver.download_as_stream(path))
+        yield from pd_read_csv(obj_io, chunksize=CSV_CHUNKSIZE)
+    elif suffix in PARQUET_SUFFIXES:
+        parquet = _open_parquet(driver, path, size)
+        for i in range(parquet.num_row_groups):
+            yield parquet.read_row_group(i, use_pandas_metadata=True).to_pandas()
+    else:
+        raise AnaliticoException(f"Can't stream records from {path}.", status_code=status.HTTP_400_BAD_REQUEST)
+
+
+def _iter_csv_bytes(dataframes):
+    """ Yields chunks of a csv file written one dataframe at a time """
+    header = True
+    for df in dataframes:
+        yield df.to_csv(index=False, header=header).encode()
+        header = False
+
+
+class _ChunksSink(io.RawIOBase):
+    """ A writable stream that collects written bytes so they can be yielded as chunks """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._position
+
+    def pop(self) -> bytes:
+        chunk, self._chunks = b"".join(self._chunks), []
+        return chunk
+
+
+def _without_nullable_integers(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the dataframe with its nullable integer columns, eg. Int64, converted to int64 or to float64
+    when they have missing values. The pyarrow version we use cannot convert pandas extension types.
+    """
+    columns = {
+        column: df[column].astype("float64" if df[column].hasnans else "int64")
+        for column, dtype in df.dtypes.items()
+        if pd.api.types.is_extension_array_dtype(dtype) and pd.api.types.is_integer_dtype(dtype)
+    }
+    return df.assign(**columns) if columns else df
+
+
+def _iter_parquet_bytes(dataframes):
+    """
+    Yields chunks of a parquet file written one dataframe at a time, each dataframe becomes a row group.
+    The types of the columns are those of the first dataframe, columns that have no values in it are
+    written as strings since values of any type found in later dataframes can be converted to strings.
+    """
+    sink = _ChunksSink()
+    writer = None
+    for df in dataframes:
+        df = _without_nullable_integers(df)
+        # a default index is different in each chunk and is not saved
+        table = pyarrow.Table.from_pandas(df, preserve_index=not isinstance(df.index, pd.RangeIndex))
+        if writer is None:
+            if table.num_rows:
+                fields = [
+                    field.with_type(pyarrow.string()) if table.column(i).null_count == table.num_rows else field
+                    for i, field in enumerate(table.schema)
+                ]
+                table = table.cast(pyarrow.schema(fields, metadata=table.schema.metadata))
+            writer = pyarrow.parquet.ParquetWriter(sink, table.schema)
+        elif not table.schema.equals(writer.schema, check_metadata=False):
+            # eg. a column that had no missing values in the first chunk
+            try:
+                table = table.cast(writer.schema)
+            except Exception as exc:
+                msg = f"Column types change within the file and cannot be converted, please specify a schema: {exc}"
+                raise AnaliticoException(msg, status_code=status.HTTP_400_BAD_REQUEST) from exc
+        writer.write_table(table)
+        yield sink.pop()
+    if writer is None:
+        writer = pyarrow.parquet.ParquetWriter(sink, pyarrow.Table.from_pandas(pd.DataFrame()).schema)
+    writer.close()
+    yield sink.pop()
+
+
 def apply_conversions(driver: WebdavStorageDriver, path: str, new_path: str = None, new_schema: dict = None):
     """
     Converts data files from a format to another or applies a new schema to transform columns, etc.
@@ -221,6 +630,42 @@ def apply_conversions(driver: WebdavStorageDriver, path: str, new_path: str = No
         new_schema {dict} -- The new schema to be applied (default: {None})
     """
 
+    # csv and parquet files are converted one chunk at a time while the new file is uploaded
+    suffix = Path(path).suffix.lower()
+    new_suffix = Path(new_path if new_path else path).suffix.lower()
+    streamed = CSV_SUFFIXES + PARQUET_SUFFIXES
+    if suffix in streamed and new_suffix in streamed:
+        ls = driver.ls(path)
+        if len(ls) != 1 or not isinstance(ls[0], libcloud.storage.base.Object):
+            raise AnaliticoException(f"Can't convert {path}.", status_code=status.HTTP_400_BAD_REQUEST)
+        size_limit = analitico.utilities.size_to_bytes(f"{DATAFRAME_OPEN_SIZE_LIMIT_MB}MB")
+        if suffix in CSV_SUFFIXES and ls[0].size <= size_limit:
+            # types of small csv files are inferred from all their records, as when they are opened
+            dataframes = [get_file_dataframe(driver, path)[0]]
+        else:
+            dataframes = iter_file_dataframes(driver, path, ls[0].size)
+        if new_schema:
+            plan = analitico.schema.compile_schema(new_schema)
+            dataframes = (analitico.schema.apply_schema(df, plan) for df in dataframes)
+        data = _iter_csv_bytes(dataframes) if new_suffix in CSV_SUFFIXES else _iter_parquet_bytes(dataframes)
+
+        # upload next to the destination then rename so that the source, which may be the
+        # destination itself, is not overwritten while it is being read
+        target_path = new_path if new_path else path
+        upload_path = os.path.join(os.path.dirname(target_path), ".~" + analitico.utilities.id_generator() + new_suffix)
+        try:
+            driver.upload(data, upload_path)
+        except Exception:
+            try:
+                driver.delete(upload_path)
+            except Exception:
+                pass
+            raise
+        driver.move(upload_path, target_path)
+        if new_path and path != new_path:
+            driver.delete(path)
+        return True
+
     # read dataframe in its entirety, no paging
     df, _ = get_file_dataframe(driver, path)
 
@@ -228,9 +673,6 @@ def apply_conversions(driver: WebdavStorageDriver, path: str, new_path: str = No
     if new_schema:
         df = analitico.schema.apply_schema(df, new_schema)
 
-    # what format do we write to?
-    new_suffix = Path(new_path if new_path else path).suffix.lower()
-
     # write dataframe to a temp file then upload to storage path
     with tempfile.NamedTemporaryFile(mode="w+", prefix="df_", suffix=new_suffix) as f:
         if new_suffix in CSV_SUFFIXES:
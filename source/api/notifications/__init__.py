@@ -7,4 +7,4 @@ from .slack import (
 
 from .email import email_notify, email_send_template
 
-from .notify import get_job_completion_webhook, notifications_webhook
+from .notify import get_job_completion_webhook, notifications_webhook, notify_job
@@ -14,7 +14,7 @@ from rest_framework.response import Response
 import analitico
 from analitico import logger, AnaliticoException
 from analitico.utilities import get_dict_dot
-from analitico.status import STATUS_COMPLETED, STATUS_FAILED
+from analitico.status import STATUS_COMPLETED, STATUS_RUNNING
 
 from api.factory import factory
 from api.utilities import get_query_parameter, get_signed_secret
@@ -34,30 +34,27 @@ def _get_job_secret(item_id: str, job_id: str):
     return api.utilities.get_signed_secret(f"{item_id}-{job_id}")
 
 
-def _notify_job(item_id: str, job_id: str):
-    item = factory.get_item(item_id)
-    job = k8_jobs_get(item, job_id)
+def notify_job(job) -> dict:
+    """ Notifies the owners of the job's item over slack and email that the job has completed or failed """
+    item = factory.get_item(job.item_id)
 
     # links to job and target item
     item_url = f"https://analitico.ai/app/{item.type}s/{item.id}"
-
-    job_id = job["metadata"]["name"]
-    job_url = f"{item_url}/jobs#{job_id}"
-    job_succeeded = int(get_dict_dot(job, "status.succeeded", 0))
-    job_status = STATUS_COMPLETED if job_succeeded else STATUS_FAILED
+    job_url = f"{item_url}/jobs#{job.get_attribute('k8_job', job.id)}"
+    job_succeeded = job.status == STATUS_COMPLETED
 
     # notification level
     level = logging.INFO if job_succeeded else logging.ERROR
 
     # elapsed time (if available)
     elapsed_sec = ""
-    try:
-        start_time = dateutil.parser.parse(job["status"]["startTime"])
-        completion_time = dateutil.parser.parse(job["status"]["conditions"][0]["lastTransitionTime"])
-        elapsed_sec = int((completion_time - start_time).total_seconds())
-        elapsed_sec = f" in {int(elapsed_sec/60):02d}:{elapsed_sec%60:02d}"
-    except Exception as exc:
-        logger.warning("Can't extract completion time from job %s: %s", job_id, exc)
+    duration = job.get_attribute("duration")
+    if duration is not None:
+        elapsed_sec = f" in {int(duration/60):02d}:{duration%60:02d}"
+
+    # reason why the job failed, eg. OOMKilled
+    exit_reason = job.get_attribute("exit_reason")
+    exit_reason = f" ({exit_reason})" if exit_reason and not job_succeeded else ""
 
     # message shows item name (if named)
     message = f"{item.title} _({item.id})_" if item.title else item.id
@@ -66,10 +63,8 @@ def _notify_job(item_id: str, job_id: str):
     # https://api.slack.com/incoming-webhooks
     # https://api.slack.com/docs/message-attachments
     message = {
-        "text": f"Job {job_status}{elapsed_sec}",
-        "attachments": [
-            {"text": message, "color": "good" if job_status == analitico.status.STATUS_COMPLETED else "danger"}
-        ],
+        "text": f"Job {job.status}{elapsed_sec}{exit_reason}",
+        "attachments": [{"text": message, "color": "good" if job_succeeded else "danger"}],
     }
 
     return {
@@ -78,6 +73,22 @@ def _notify_job(item_id: str, job_id: str):
     }
 
 
+def _notify_job(item_id: str, job_id: str):
+    """
+    Saves the status of the job and notifies if it has not been notified already by api.k8jobtracker.
+    A pod that fails and will be retried, eg. by build jobs with a backoffLimit, leaves the job running
+    so nothing is notified here, the tracker notifies when the job completes or fails for good.
+    """
+    from api.k8jobtracker import k8_job_get_state, k8_jobs_update, k8_jobs_notify
+
+    item = factory.get_item(item_id)
+    state = k8_job_get_state(k8_jobs_get(item, job_id))
+    state["job_id"] = state["job_id"] or job_id
+    k8_jobs_update({state["job_id"]: state}, create_status=STATUS_RUNNING)
+    notifications = k8_jobs_notify([state["job_id"]])
+    return notifications[0] if notifications else {"type": "analitico/notifications", "attributes": {}}
+
+
 def get_job_completion_webhook(item_id: str, job_id: str, delay: int = 0):
     secret = _get_job_secret(item_id, job_id)
     return (
@@ -98,7 +109,10 @@ def get_job_completion_webhook(item_id: str, job_id: str, delay: int = 0):
 def notifications_webhook(request: Request) -> Response:
     """
     This webhook is called whenever we need to trigger a notification, for example when a job
-    has completed and we need to warn the owner over slack or email. The complete url for a job
+    has completed and we need to warn the owner over slack or email. Jobs call the webhook when
+    they end and are also tracked by api.k8jobtracker, which runs with the server and notifies
+    jobs that are killed or fail without calling it, eg. when out of memory. Both save the job's
+    status the same way so that it is notified only once. The complete url for a job
     notification is created using get_job_completion_webhook. This API can be called without
     any authentication and is secured by a signed secret which is created by the server and later
     rechecked before executing the notifications.
@@ -1,5 +1,7 @@
+import os
 import django.conf
 
+from rest_framework import status
 from rest_framework.exceptions import NotFound
 
 import libcloud
@@ -25,6 +27,13 @@ import api.libcloud
 #   }
 # }
 
+# Files can also be accessed directly on the local filesystem, for example a directory used
+# for development or a storage box that is mounted at ANALITICO_DRIVE in a job:
+# { "driver": "local", "url": "/path/to/files" }
+# { "driver": "mounted" }
+# Local paths are server configuration: a local url must be inside one of the directories
+# in settings.LOCAL_STORAGE_ROOTS and mounted drives are always at ANALITICO_DRIVE.
+
 # Apache Libcloud
 # https://libcloud.apache.org
 
@@ -70,8 +79,12 @@ class Storage:
             assert settings, "Storage.factory - no settings for this item"
 
             driver = settings["driver"]
-            credentials = settings["credentials"]
             assert driver
+
+            if driver == "local" or driver == "mounted":
+                return Storage(settings, api.libcloud.LocalStorageDriver(Storage.get_local_root(settings)))
+
+            credentials = settings["credentials"]
             assert credentials
 
             if driver == "google-storage":
@@ -94,6 +107,26 @@ class Storage:
         except Exception as exc:
             raise exc
 
+    @staticmethod
+    def get_local_root(settings: dict) -> str:
+        """ Returns the directory used by local or mounted storage if the server allows it, raises otherwise """
+        if settings["driver"] == "mounted":
+            # mounted drives are always where the storage is mounted in jobs
+            root = os.environ.get("ANALITICO_DRIVE")
+            if not root:
+                raise AnaliticoException("Storage.factory - mounted storage needs ANALITICO_DRIVE to be set.")
+            return root
+
+        root = os.path.realpath(settings.get("url") or "/")
+        for allowed in getattr(django.conf.settings, "LOCAL_STORAGE_ROOTS", None) or []:
+            allowed = os.path.realpath(allowed)
+            if root == allowed or root.startswith(allowed.rstrip("/") + "/"):
+                return root
+        raise AnaliticoException(
+            f"Storage.factory - {root} is not a local storage directory allowed on this server.",
+            status_code=status.HTTP_403_FORBIDDEN,
+        )
+
     def upload_object(self, file_path, object_name, extra=None, headers=None):
         """ 
         Upload an object currently located on a disk. 
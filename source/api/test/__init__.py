@@ -15,6 +15,8 @@ from .test_api_filters import FiltersTests
 from .test_api_notebooks import NotebooksTests
 from .test_api_docker import DockerTests
 from .test_api_k8 import K8Tests
+from .test_api_k8client import K8ClientTests
+from .test_api_k8jobtracker import K8JobTrackerTests
 from .test_api_slack import SlackTests
 from .test_api_lifecycle import LifecycleTests
 from .test_api_billing import BillingTests
@@ -0,0 +1,133 @@
+import re
+import copy
+import uuid
+import threading
+from datetime import datetime
+
+from analitico.utilities import get_dict_dot
+from api.k8client import k8_parse_label_selector, k8_match_labels
+
+# /api/v1/namespaces/cloud/jobs/name or /apis/batch/v1/jobs
+K8_PATH_RE = re.compile(
+    r"^(?P<prefix>/api/[^/]+|/apis/[^/]+/[^/]+)(?:/namespaces/(?P<namespace>[^/]+))?"
+    r"/(?P<plural>[^/]+)(?:/(?P<name>[^/]+))?(?:/(?P<subresource>[^/]+))?$"
+)
+
+
+def _merge(target: dict, patch: dict) -> dict:
+    """ Json merge patch, dictionaries are merged, other values are replaced and None removes a key """
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+    return target
+
+
+class K8FakeApiServer:
+    """
+    An in-memory Kubernetes API server used to test K8Client and the code built on it without a cluster.
+    Resources are stored as dictionaries, lists honor label selectors and every change is recorded
+    with a resource version so watches can replay the changes that happened after a given version.
+    Watches return the recorded changes and end instead of blocking. Requests are saved in .requests.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.resources = {}  # (prefix, plural) -> {(namespace, name): resource}
+        self.events = []  # (resource_version, prefix, plural, namespace, type, resource)
+        self.resource_version = 0
+        self.requests = []
+
+    def _status(self, code: int, message: str):
+        return code, {"kind": "Status", "apiVersion": "v1", "status": "Failure", "message": message, "code": code}
+
+    def _record(self, prefix, plural, namespace, event_type, resource):
+        self.resource_version += 1
+        resource["metadata"]["resourceVersion"] = str(self.resource_version)
+        self.events.append((self.resource_version, prefix, plural, namespace, event_type, copy.deepcopy(resource)))
+
+    def request(self, method: str, path: str, params: dict = None, body=None, content_type: str = None, stream=False):
+        params = params or {}
+        with self.lock:
+            self.requests.append((method, path, params))
+            match = K8_PATH_RE.match(path)
+            if not match:
+                return self._status(404, f"the server could not find the requested resource {path}")
+            prefix, namespace, plural, name = match.group("prefix", "namespace", "plural", "name")
+            resources = self.resources.setdefault((prefix, plural), {})
+            requirements = k8_parse_label_selector(params.get("labelSelector"))
+
+            def selected(resource_namespace, resource):
+                if namespace and resource_namespace != namespace:
+                    return False
+                return k8_match_labels(requirements, resource["metadata"].get("labels"))
+
+            if method == "GET" and params.get("watch"):
+                since = int(params.get("resourceVersion") or 0)
+                events = [
+                    {"type": event_type, "object": copy.deepcopy(resource)}
+                    for version, p, pl, ns, event_type, resource in self.events
+                    if version > since and (p, pl) == (prefix, plural) and selected(ns, resource)
+                ]
+                return 200, iter(events)
+
+            if method == "GET" and not name:
+                items = [copy.deepcopy(r) for (ns, _), r in sorted(resources.items()) if selected(ns, r)]
+                return 200, {
+                    "kind": "List",
+                    "metadata": {"resourceVersion": str(self.resource_version)},
+                    "items": items,
+                }
+
+            key = (namespace, name)
+            if method == "GET":
+                if key not in resources:
+                    return self._status(404, f'{plural} "{name}" not found')
+                return 200, copy.deepcopy(resources[key])
+
+            if method == "POST" and not name:
+                name = get_dict_dot(body, "metadata.name")
+                if (namespace, name) in resources:
+                    return self._status(409, f'{plural} "{name}" already exists')
+                resource = copy.deepcopy(body)
+                resource["metadata"]["uid"] = str(uuid.uuid4())
+                resource["metadata"]["creationTimestamp"] = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+                if namespace:
+                    resource["metadata"]["namespace"] = namespace
+                resources[(namespace, name)] = resource
+                self._record(prefix, plural, namespace, "ADDED", resource)
+                return 201, copy.deepcopy(resource)
+
+            if method == "PATCH":
+                # a merge patch with a resourceVersion is applied only if the resource has not changed since
+                version = get_dict_dot(body, "metadata.resourceVersion")
+                if content_type == "application/merge-patch+json" and key in resources and version:
+                    if version != resources[key]["metadata"]["resourceVersion"]:
+                        return self._status(409, f'the object has been modified, {plural} "{name}"')
+                if key not in resources:
+                    if content_type != "application/apply-patch+yaml":
+                        return self._status(404, f'{plural} "{name}" not found')
+                    resource = {"metadata": {"name": name, "namespace": namespace}}
+                    resource["metadata"]["uid"] = str(uuid.uuid4())
+                    resource["metadata"]["creationTimestamp"] = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+                    event_type = "ADDED"
+                else:
+                    resource, event_type = resources[key], "MODIFIED"
+                _merge(resource, body)
+                if not namespace:
+                    resource["metadata"].pop("namespace", None)
+                resources[key] = resource
+                self._record(prefix, plural, namespace, event_type, resource)
+                return 200, copy.deepcopy(resource)
+
+            if method == "DELETE":
+                if key not in resources:
+                    return self._status(404, f'{plural} "{name}" not found')
+                resource = resources.pop(key)
+                self._record(prefix, plural, namespace, "DELETED", resource)
+                return 200, copy.deepcopy(resource)
+
+            return self._status(405, f"method {method} is not supported")
@@ -1,7 +1,11 @@
+import io
 import os
+import json
 import os.path
 import numpy as np
 import pandas as pd
+import pyarrow
+import pyarrow.parquet
 import tempfile
 import random
 import string
@@ -10,6 +14,8 @@ import sklearn
 import sklearn.datasets
 import urllib.parse
 
+from unittest import mock
+
 from django.test import tag
 from django.urls import reverse
 
@@ -19,6 +25,8 @@ from analitico.utilities import time_ms
 import analitico
 import analitico.plugin
 import api.models
+import api.metadata
+import api.libcloud
 
 from analitico import logger
 from analitico.pandas import pd_read_csv
@@ -36,6 +44,36 @@ TEST_DATA_SUFFIXES = (".csv", ".parquet")
 PARQUET_MIME_TYPE = "application/octet-stream"
 
 
+class FakeStorageDriver:
+    """ A storage driver keeping files in memory, streams are returned in chunks of the given size """
+
+    def __init__(self, files: dict = None, chunk_size: int = 1024):
+        self.files = files or {}
+        self.chunk_size = chunk_size
+        self.streams = []  # paths of the streams downloaded
+        self.ranges = []  # (start, end) of the ranges downloaded
+
+    def download_as_stream(self, path, start=0):
+        if path not in self.files:
+            raise Exception(f"{path} not found")
+        self.streams.append(path)
+        data = self.files[path]
+        return (data[i : i + self.chunk_size] for i in range(start, len(data), self.chunk_size))
+
+    def download_range(self, path, start, end):
+        self.ranges.append((start, end))
+        return self.files[path][start : end + 1]
+
+    def get_local_path(self, path):
+        return None
+
+    def mkdirs(self, path):
+        pass
+
+    def upload(self, stream, path):
+        self.files[path] = stream.read()
+
+
 @pytest.mark.django_db
 class DatasetTests(AnaliticoApiTestCase):
     """ Test datasets operations like uploading assets, processing pipelines, downloading data, etc """
@@ -842,3 +880,178 @@ class DatasetTests(AnaliticoApiTestCase):
         self.auth_token(self.token1)
         response = self.client.get(url + "?metadata=true&refresh=true")
         self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_dataset_parquet_chunks_widen_types(self):
+        """ Columns with no values in the first chunk are written as strings so later values can be converted """
+        chunks = [
+            pd.DataFrame({"id": [1, 2], "notes": [np.nan, np.nan]}),
+            pd.DataFrame({"id": [3, 4], "notes": ["late", None]}),
+        ]
+        data = b"".join(api.metadata._iter_parquet_bytes(chunks))
+        df = pd.read_parquet(io.BytesIO(data))
+        self.assertEqual(list(df["id"]), [1, 2, 3, 4])
+        self.assertEqual(list(df["notes"]), [None, None, "late", None])
+
+    def test_dataset_parquet_chunks_nullable_integers(self):
+        """ Integer columns read from csv chunks as Int64 are written to parquet as plain numbers """
+        chunks = pd_read_csv(io.BytesIO(b"id,count\n1,10\n2,20\n3,\n4,40\n"), chunksize=2)
+        from_pandas = pyarrow.Table.from_pandas
+
+        def from_pandas_without_extension_types(df, **kwargs):
+            # the pyarrow version used by the server cannot convert pandas extension types
+            self.assertFalse([dtype for dtype in df.dtypes if pd.api.types.is_extension_array_dtype(dtype)])
+            return from_pandas(df, **kwargs)
+
+        with mock.patch("api.metadata.pyarrow.Table", mock.Mock(from_pandas=from_pandas_without_extension_types)):
+            data = b"".join(api.metadata._iter_parquet_bytes(chunks))
+        df = pd.read_parquet(io.BytesIO(data))
+        self.assertEqual(list(df["id"]), [1, 2, 3, 4])
+        self.assertEqual(df["count"].isnull().tolist(), [False, False, True, False])
+        self.assertEqual(list(df["count"].dropna()), [10, 20, 40])
+
+    def get_csv_rows(self, rows: int, quoted_every: int = 3) -> (bytes, list):
+        """ Returns a csv with some quoted newlines and the offsets where each data row starts """
+        data, starts = b"id,text\n", []
+        for i in range(rows):
+            starts.append(len(data))
+            text = f'"line {i}\nsplit, quoted"' if i % quoted_every == 0 else f"line {i}"
+            data += f"{i},{text}\n".encode()
+        return data, starts
+
+    def test_dataset_csv_index_quoted_newlines(self):
+        """ Newlines inside quoted fields do not start a row in the csv index """
+        data, starts = self.get_csv_rows(10)
+        with mock.patch("api.metadata.CSV_INDEX_INTERVAL", 3):
+            index = api.metadata._build_csv_index(FakeStorageDriver({"a.csv": data}), "a.csv")
+        self.assertEqual(index, {"interval": 3, "rows": 10, "offsets": starts[::3]})
+
+    def test_dataset_csv_index_trailing_newline(self):
+        """ A newline at the end of the file is not counted as a row or indexed as a row's start """
+        for rows in (6, 7):
+            data, starts = self.get_csv_rows(rows)
+            for csv in (data, data.rstrip(b"\n")):
+                with mock.patch("api.metadata.CSV_INDEX_INTERVAL", 2):
+                    index = api.metadata._build_csv_index(FakeStorageDriver({"a.csv": csv}), "a.csv")
+                self.assertEqual(index, {"interval": 2, "rows": rows, "offsets": starts[::2]})
+
+    def test_dataset_csv_index_chunks_split_rows(self):
+        """ The index is the same however the stream's chunks split rows, quotes and newlines """
+        data, starts = self.get_csv_rows(12, quoted_every=2)
+        for chunk_size in range(1, 40):
+            with mock.patch("api.metadata.CSV_INDEX_INTERVAL", 5):
+                index = api.metadata._build_csv_index(FakeStorageDriver({"a.csv": data}, chunk_size), "a.csv")
+            self.assertEqual(index, {"interval": 5, "rows": 12, "offsets": starts[::5]}, f"chunk_size: {chunk_size}")
+
+    def test_dataset_csv_index_stale_hash_rebuilt(self):
+        """ The saved index is used while the file's hash matches and rebuilt when the file changes """
+        data, starts = self.get_csv_rows(6)
+        index_path = api.metadata.get_index_path("ds/a.csv")
+        driver = FakeStorageDriver({"ds/a.csv": data})
+        with mock.patch("api.metadata.CSV_INDEX_INTERVAL", 2):
+            index = api.metadata._get_csv_index(driver, "ds/a.csv", mock.Mock(hash="h1"))
+            self.assertEqual(index["offsets"], starts[::2])
+            self.assertEqual(json.loads(driver.files[index_path])["hash"], "h1")
+
+            # saved index matches the file, the csv is not read again
+            driver.streams = []
+            self.assertEqual(api.metadata._get_csv_index(driver, "ds/a.csv", mock.Mock(hash="h1")), index)
+            self.assertEqual(driver.streams, [index_path])
+
+            # file was changed, the stale index is rebuilt and saved
+            driver.files["ds/a.csv"], starts = self.get_csv_rows(9)
+            index = api.metadata._get_csv_index(driver, "ds/a.csv", mock.Mock(hash="h2"))
+            self.assertEqual(index["rows"], 9)
+            self.assertEqual(index["offsets"], starts[::2])
+            self.assertEqual(driver.streams, [index_path, index_path, "ds/a.csv"])
+            self.assertEqual(json.loads(driver.files[index_path])["hash"], "h2")
+
+    def test_dataset_csv_page_from_index(self):
+        """ Pages read from the indexed offsets match the rows read from the whole file """
+        data, _ = self.get_csv_rows(11)
+        expected = pd_read_csv(io.BytesIO(data))
+        driver = FakeStorageDriver({"ds/a.csv": data}, chunk_size=7)
+        with mock.patch("api.metadata.CSV_INDEX_INTERVAL", 3):
+            for page in range(4):
+                df, total = api.metadata._get_csv_page(driver, "ds/a.csv", mock.Mock(hash="h1"), page, 4)
+                self.assertEqual(total, 11)
+                self.assertEqual(df.to_dict("list"), expected.iloc[page * 4 : page * 4 + 4].to_dict("list"))
+
+    def test_dataset_query_predicates(self):
+        """ Simple comparisons are extracted from queries combined with 'and' or '&' """
+        expected = [("Age", ">", 30), ("Sex", "==", "male")]
+        self.assertEqual(api.metadata._get_query_predicates("Age > 30 and Sex == 'male'"), expected)
+        self.assertEqual(api.metadata._get_query_predicates("(Age > 30) & (Sex == 'male')"), expected)
+        self.assertEqual(api.metadata._get_query_predicates("(30 < Age) & ('male' == Sex)"), expected)
+        # like pandas, & has the precedence of 'and' rather than python's precedence
+        self.assertEqual(api.metadata._get_query_predicates("Age > 30 & Sex == 'male'"), expected)
+        self.assertEqual(
+            api.metadata._get_query_predicates("30 >= Age and 2 != Pclass"), [("Age", "<=", 30), ("Pclass", "!=", 2)]
+        )
+        # alternatives, comparisons between columns and chained comparisons cannot rule out rows
+        self.assertEqual(api.metadata._get_query_predicates("Age > 30 or Sex == 'male'"), [])
+        self.assertEqual(api.metadata._get_query_predicates("(Age > 30) | (Sex == 'male')"), [])
+        self.assertEqual(api.metadata._get_query_predicates("Age > 30 | Sex == 'male'"), [])
+        self.assertEqual(api.metadata._get_query_predicates("Age > Fare"), [])
+        self.assertEqual(api.metadata._get_query_predicates("20 < Age < 30"), [])
+        self.assertEqual(api.metadata._get_query_predicates("Age >"), [])
+
+    def get_parquet_driver(self, df: pd.DataFrame, row_group_size: int) -> (FakeStorageDriver, int):
+        parquet = io.BytesIO()
+        df.to_parquet(parquet, row_group_size=row_group_size)
+        data = parquet.getvalue()
+        return FakeStorageDriver({"a.parquet": data}), len(data)
+
+    def test_dataset_parquet_page_row_groups_pruned(self):
+        """ Row groups whose statistics rule out the query are not read """
+        df = pd.DataFrame({"id": range(50), "value": [i % 7 for i in range(50)]})
+        driver, size = self.get_parquet_driver(df, 10)
+        read_row_group = pyarrow.parquet.ParquetFile.read_row_group
+        with mock.patch.object(
+            pyarrow.parquet.ParquetFile, "read_row_group", autospec=True, side_effect=read_row_group
+        ) as read_mock:
+            page, total = api.metadata._get_parquet_page(driver, "a.parquet", size, 0, 5, query="id >= 33 & value != 0")
+        expected = df.query("id >= 33 & value != 0")
+        self.assertEqual(total, len(expected))
+        self.assertEqual(page.to_dict("list"), expected.iloc[:5].to_dict("list"))
+        # row groups 0, 1 and 2 hold ids 0-29 and are skipped
+        self.assertEqual(sorted(set(call[0][1] for call in read_mock.call_args_list)), [3, 4])
+
+    def test_dataset_parquet_page_sorted_across_row_groups(self):
+        """ Pages of sorted rows collect the rows from many row groups in sorted order """
+        values = random.Random(42).sample(range(1000), 60)
+        df = pd.DataFrame({"id": range(60), "value": values, "text": [f"row {i}" for i in range(60)]})
+        driver, size = self.get_parquet_driver(df, 8)
+        expected = df.sort_values("value", ascending=False)
+        for page in range(5):
+            df_page, total = api.metadata._get_parquet_page(driver, "a.parquet", size, page, 13, sort="-value")
+            self.assertEqual(total, 60)
+            self.assertEqual(df_page.to_dict("list"), expected.iloc[page * 13 : page * 13 + 13].to_dict("list"))
+        df_page, _ = api.metadata._get_parquet_page(driver, "a.parquet", size, 1, 10, query="value > 500", sort="id")
+        self.assertEqual(list(df_page["id"]), list(df[df["value"] > 500]["id"][10:20]))
+
+    def test_dataset_rangeio_seek_and_block_reuse(self):
+        """ RangeIO requests a block per read and serves reads inside the last block without requests """
+        data = bytes(range(100))
+        driver = FakeStorageDriver({"a.bin": data})
+        obj = api.libcloud.RangeIO(driver, "a.bin", len(data), block_size=16)
+        self.assertEqual(obj.read(4), data[0:4])
+        self.assertEqual(obj.read(8), data[4:12])
+        self.assertEqual(driver.ranges, [(0, 15)])
+
+        # seeking outside of the block requests a new block
+        self.assertEqual(obj.seek(50), 50)
+        self.assertEqual(obj.read(4), data[50:54])
+        self.assertEqual(obj.seek(-2, io.SEEK_CUR), 52)
+        self.assertEqual(obj.read(4), data[52:56])
+        self.assertEqual(driver.ranges, [(0, 15), (50, 65)])
+
+        # reads larger than a block and reads past the end of the file
+        obj.seek(10)
+        self.assertEqual(obj.read(30), data[10:40])
+        self.assertEqual(obj.seek(-4, io.SEEK_END), 96)
+        self.assertEqual(obj.read(10), data[96:100])
+        self.assertEqual(obj.read(10), b"")
+        self.assertEqual(obj.tell(), 100)
+        self.assertEqual(driver.ranges, [(0, 15), (50, 65), (10, 39), (96, 99)])
+        with self.assertRaises(ValueError):
+            obj.seek(-1)
@@ -170,6 +170,23 @@ class ItemsTests(AnaliticoApiTestCase):
         patch_item = self.patch_item(analitico.WORKSPACE_TYPE, "ws_001", patch, self.token1)
         self.assertIsNone(patch_item["attributes"].get("made_up_attribute"))
 
+    def test_workspace_patch_storage(self):
+        # storage can't point to the server's own files, not even for admins
+        patch = {"data": {"id": "ws_001", "attributes": {"storage": {"driver": "local", "url": "/"}}}}
+        self.patch_item(analitico.WORKSPACE_TYPE, "ws_001", patch, self.token1, status.HTTP_403_FORBIDDEN)
+        patch["data"]["attributes"]["storage"] = {"driver": "mounted"}
+        self.patch_item(analitico.WORKSPACE_TYPE, "ws_001", patch, self.token1, status.HTTP_403_FORBIDDEN)
+
+        # users can't change the storage of their workspace
+        storage = Workspace.objects.get(pk="ws_002").get_attribute("storage")
+        patch = {"data": {"id": "ws_002", "attributes": {"storage": {**storage, "url": "https://example.com"}}}}
+        self.patch_item(analitico.WORKSPACE_TYPE, "ws_002", patch, self.token2, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Workspace.objects.get(pk="ws_002").get_attribute("storage"), storage)
+
+        # but they can save it back unchanged
+        patch["data"]["attributes"]["storage"] = storage
+        self.patch_item(analitico.WORKSPACE_TYPE, "ws_002", patch, self.token2)
+
     def test_workspace_delete(self):
         item = self.delete_item(analitico.WORKSPACE_TYPE, "ws_001", self.token1, status.HTTP_204_NO_CONTENT)
         self.assertIsNone(item)
@@ -0,0 +1,436 @@
+import os
+import base64
+import tempfile
+import yaml
+
+from datetime import datetime, timedelta
+from unittest import mock
+
+import api.k8
+from analitico import AnaliticoException
+from api.k8client import K8Client, K8Config, K8HttpApiServer, k8_parse_label_selector, k8_match_labels
+from api.k8client import get_k8_client, set_k8_client, k8_acquire_lease
+from api.k8informers import K8Informer, get_informer, set_informer, clear_informers
+from api.k8manifests import k8_get_template, k8_render_template
+from .k8fake import K8FakeApiServer
+from .utils import AnaliticoApiTestCase
+
+# pylint: disable=no-member
+
+
+def get_job(name: str, item_id: str = "rx_1", action: str = "run") -> dict:
+    return {
+        "apiVersion": "batch/v1",
+        "kind": "Job",
+        "metadata": {
+            "name": name,
+            "namespace": "cloud",
+            "labels": {"analitico.ai/item-id": item_id, "analitico.ai/job-action": action},
+        },
+        "spec": {"backoffLimit": 0},
+    }
+
+
+def get_jupyter(name: str, workspace_id: str, enabled: str = "true") -> [dict]:
+    """ Returns a jupyter statefulset with scale to zero and its pod created an hour ago """
+    labels = {"app": name, "analitico.ai/service": "jupyter", "analitico.ai/workspace-id": workspace_id}
+    annotations = {"analitico.ai/enable-scale-to-zero": enabled, "analitico.ai/scale-to-zero-grace-period": "30"}
+    created_at = (datetime.utcnow() - timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return [
+        {
+            "apiVersion": "apps/v1",
+            "kind": "StatefulSet",
+            "metadata": {"name": name, "namespace": "cloud", "labels": labels, "annotations": annotations},
+            "spec": {"replicas": 1},
+        },
+        {
+            "apiVersion": "v1",
+            "kind": "Pod",
+            "metadata": {"name": name + "-0", "namespace": "cloud", "labels": labels, "creationTimestamp": created_at},
+        },
+    ]
+
+
+def get_prometheus_response(label: str, values: dict) -> mock.Mock:
+    result = [{"metric": {label: key}, "value": [1575000000, str(value)]} for key, value in values.items()]
+    return mock.Mock(status_code=200, json=lambda: {"status": "success", "data": {"result": result}})
+
+
+class K8ClientTests(AnaliticoApiTestCase):
+    """ Test the Kubernetes API client against an in-memory API server """
+
+    def setUp(self):
+        self.server = K8FakeApiServer()
+        self.client = K8Client(api_server=self.server)
+
+    def tearDown(self):
+        set_k8_client(None)
+        clear_informers()
+
+    def test_k8client_label_selector(self):
+        requirements = k8_parse_label_selector("analitico.ai/job-action in (build, run),app=jupyter,!deleted")
+        self.assertEqual(len(requirements), 3)
+        self.assertTrue(k8_match_labels(requirements, {"analitico.ai/job-action": "run", "app": "jupyter"}))
+        self.assertFalse(k8_match_labels(requirements, {"analitico.ai/job-action": "process", "app": "jupyter"}))
+        self.assertFalse(
+            k8_match_labels(requirements, {"analitico.ai/job-action": "run", "app": "jupyter", "deleted": "y"})
+        )
+        self.assertTrue(k8_match_labels(k8_parse_label_selector("app!=api"), {}))
+
+    def test_k8client_apply_get_list_delete(self):
+        job = self.client.apply(get_job("jb-1"))
+        self.assertEqual(job["metadata"]["name"], "jb-1")
+        self.client.apply(get_job("jb-2", action="process"))
+        self.client.apply(get_job("jb-3", item_id="rx_2"))
+
+        # server side apply updates the existing job
+        job = get_job("jb-1")
+        job["spec"]["backoffLimit"] = 2
+        self.assertEqual(self.client.apply(job)["spec"]["backoffLimit"], 2)
+        self.assertEqual(self.server.requests[-1][0], "PATCH")
+        self.assertEqual(self.server.requests[-1][2]["fieldManager"], "analitico")
+
+        jobs = self.client.list("job", "cloud", "analitico.ai/job-action in (build, run)", sort_by=".metadata.name")
+        self.assertEqual([job["metadata"]["name"] for job in jobs["items"]], ["jb-1", "jb-3"])
+        self.assertEqual(self.client.get("jobs", "jb-2", "cloud")["metadata"]["labels"]["analitico.ai/item-id"], "rx_1")
+
+        self.client.delete("job", "jb-2", "cloud")
+        with self.assertRaises(AnaliticoException) as context:
+            self.client.get("job", "jb-2", "cloud")
+        self.assertEqual(context.exception.status_code, 404)
+
+        events = list(self.client.watch("job", "cloud", resource_version="0"))
+        self.assertEqual([event_type for event_type, _ in events], ["ADDED", "ADDED", "ADDED", "MODIFIED", "DELETED"])
+
+    def test_k8client_kubectl_commands(self):
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".yaml") as f:
+            f.write(yaml.safe_dump(get_job("jb-1")) + "---\n" + yaml.safe_dump(get_job("jb-2")))
+            f.flush()
+            applied = self.client.kubectl(None, "apply", None, args=["--filename", f.name])
+        self.assertEqual(applied["kind"], "List")
+        self.assertEqual(len(applied["items"]), 2)
+
+        statefulset = {
+            "apiVersion": "apps/v1",
+            "kind": "StatefulSet",
+            "metadata": {"name": "jupyter-1", "namespace": "cloud", "labels": {"app": "jupyter-1"}},
+            "spec": {"replicas": 1},
+        }
+        self.client.apply(statefulset)
+        self.client.kubectl("cloud", "scale", "statefulSet", args=["--replicas=0", "--selector", "app=jupyter-1"])
+        self.client.kubectl(
+            "cloud", "annotate", "statefulSet", args=["-l", "app=jupyter-1", "title=Hello", "--overwrite"]
+        )
+        statefulset = self.client.kubectl("cloud", "get", "statefulset/jupyter-1")
+        self.assertEqual(statefulset["spec"]["replicas"], 0)
+        self.assertEqual(statefulset["metadata"]["annotations"]["title"], "Hello")
+
+        self.client.kubectl("cloud", "delete", "job", args=["--selector", "analitico.ai/item-id=rx_1"])
+        self.assertEqual(self.client.kubectl("cloud", "get", "jobs")["items"], [])
+
+        # commands that are not supported are left to kubectl
+        with self.assertRaises(NotImplementedError):
+            self.client.kubectl("cloud", "logs", "pod/jupyter-1-0")
+
+    def test_k8client_kubectl_facade(self):
+        """ api.k8 functions go through the client when one is configured """
+        set_k8_client(self.client)
+        self.client.apply(get_job("jb-1"))
+        self.client.apply(get_job("jb-2", item_id="rx_2"))
+
+        class Item:
+            id = "rx_1"
+            type = "recipe"
+
+        jobs = api.k8.k8_jobs_list(Item())
+        self.assertEqual([job["metadata"]["name"] for job in jobs["items"]], ["jb-1"])
+        self.assertEqual(api.k8.k8_jobs_get(Item(), "jb-1")["metadata"]["name"], "jb-1")
+        with self.assertRaises(AnaliticoException):
+            api.k8.k8_jobs_get(Item(), "jb-2")  # job of another item
+
+        api.k8.k8_job_delete("jb-1")
+        with self.assertRaises(AnaliticoException) as context:
+            api.k8.kubectl("cloud", "get", "job/jb-1")
+        self.assertEqual(context.exception.status_code, 404)
+
+    def test_k8client_kubeconfig(self):
+        with tempfile.TemporaryDirectory() as directory:
+            kubeconfig = {
+                "current-context": "admin@cloud",
+                "contexts": [{"name": "admin@cloud", "context": {"cluster": "cloud", "user": "admin"}}],
+                "clusters": [
+                    {
+                        "name": "cloud",
+                        "cluster": {
+                            "server": "https://cloud.analitico.ai:6443/",
+                            "certificate-authority-data": base64.b64encode(b"ca").decode(),
+                        },
+                    }
+                ],
+                "users": [{"name": "admin", "user": {"token": "tok_123"}}],
+            }
+            path = os.path.join(directory, "config")
+            with open(path, "w") as f:
+                yaml.safe_dump(kubeconfig, f)
+
+            config = K8Config.load_kubeconfig(path)
+            self.assertEqual(config.server, "https://cloud.analitico.ai:6443")
+            self.assertEqual(config.token, "tok_123")
+            with open(config.verify, "rb") as f:
+                self.assertEqual(f.read(), b"ca")
+
+            with self.assertRaises(AnaliticoException):
+                K8Config.load_kubeconfig(path, context_name="missing")
+
+    def test_k8client_token_rotation(self):
+        """ Tokens read from a file are read again when they expire or are refused by the API server """
+        with tempfile.TemporaryDirectory() as directory:
+            token_path = os.path.join(directory, "token")
+            with open(token_path, "w") as f:
+                f.write("tok_1\n")
+            config = K8Config("https://cloud.analitico.ai:6443", token_path=token_path)
+            self.assertEqual(config.get_token(), "tok_1")
+
+            # kubelet rotates the token
+            with open(token_path, "w") as f:
+                f.write("tok_2\n")
+            self.assertEqual(config.get_token(), "tok_1")
+            with mock.patch("api.k8client.K8_TOKEN_REFRESH_SECONDS", -1):
+                self.assertEqual(config.get_token(), "tok_2")
+
+            # request refused with the old token is sent again with the new one
+            with open(token_path, "w") as f:
+                f.write("tok_3\n")
+            server = K8HttpApiServer(config)
+            responses = [mock.Mock(status_code=401), mock.Mock(status_code=200, json=lambda: {"kind": "JobList"})]
+            tokens = []
+
+            def request(method, url, headers, **kwargs):
+                tokens.append(headers["Authorization"])
+                return responses.pop(0)
+
+            with mock.patch.object(server.session, "request", side_effect=request):
+                self.assertEqual(server.request("GET", "/apis/batch/v1/jobs"), (200, {"kind": "JobList"}))
+            self.assertEqual(tokens, ["Bearer tok_2", "Bearer tok_3"])
+
+    def test_k8client_configuration_retried(self):
+        """ A client that could not be configured is configured again after a while """
+        try:
+            with mock.patch("api.k8client.K8Client", side_effect=AnaliticoException("no cluster")) as client:
+                self.assertIsNone(get_k8_client("retried"))
+                self.assertIsNone(get_k8_client("retried"))
+                self.assertEqual(client.call_count, 1)
+
+            with mock.patch("api.k8client.K8Client", return_value=self.client) as client:
+                self.assertIsNone(get_k8_client("retried"))
+                with mock.patch("api.k8client.K8_CLIENT_RETRY_SECONDS", -1):
+                    self.assertIs(get_k8_client("retried"), self.client)
+                self.assertIs(get_k8_client("retried"), self.client)
+                self.assertEqual(client.call_count, 1)
+        finally:
+            set_k8_client(None, "retried")
+
+    def test_k8client_lease(self):
+        """ Only one process at a time holds a lease and another one takes over when it expires """
+        self.assertTrue(k8_acquire_lease(self.client, "tracker", "a", 30, "cloud"))
+        self.assertFalse(k8_acquire_lease(self.client, "tracker", "b", 30, "cloud"))
+        self.assertTrue(k8_acquire_lease(self.client, "tracker", "a", 30, "cloud"))
+        self.assertEqual(self.client.get("lease", "tracker", "cloud")["spec"]["holderIdentity"], "a")
+
+        # a lease that was not renewed is taken over
+        expired = {"spec": {"renewTime": "2019-10-01T10:00:00.000000Z"}}
+        self.client.patch("lease", "tracker", expired, "cloud")
+        self.assertTrue(k8_acquire_lease(self.client, "tracker", "b", 30, "cloud"))
+        self.assertFalse(k8_acquire_lease(self.client, "tracker", "a", 30, "cloud"))
+        self.assertEqual(self.client.get("lease", "tracker", "cloud")["spec"]["holderIdentity"], "b")
+
+        # when two processes take over an expired lease at the same time only the first one gets it
+        self.client.patch("lease", "tracker", expired, "cloud")
+        lease = self.client.get("lease", "tracker", "cloud")
+        self.assertTrue(k8_acquire_lease(self.client, "tracker", "a", 30, "cloud"))
+        with mock.patch.object(self.client, "get", return_value=lease):
+            self.assertFalse(k8_acquire_lease(self.client, "tracker", "c", 30, "cloud"))
+        self.assertEqual(self.client.get("lease", "tracker", "cloud")["spec"]["holderIdentity"], "a")
+
+    def test_k8client_informer_sync_and_watch(self):
+        self.client.apply(get_job("jb-1"))
+        self.client.apply(get_job("jb-2", action="process"))
+        informer = K8Informer(self.client, "job", "cloud")
+        self.assertFalse(informer.is_fresh())
+        informer.sync()
+        self.assertTrue(informer.is_fresh())
+        self.assertEqual(len(informer.list()["items"]), 2)
+
+        # changes after the list are applied by the watch
+        self.client.apply(get_job("jb-3", item_id="rx_2"))
+        self.client.patch("job", "jb-1", {"metadata": {"labels": {"analitico.ai/job-action": "build"}}}, "cloud")
+        self.client.delete("job", "jb-2", "cloud")
+        self.assertEqual(informer.watch(), 3)
+        self.assertIsNone(informer.get("jb-2"))
+        self.assertEqual(informer.get("jb-1")["metadata"]["labels"]["analitico.ai/job-action"], "build")
+
+        # indexed and unindexed selectors
+        jobs = informer.list("analitico.ai/item-id=rx_1")["items"]
+        self.assertEqual([job["metadata"]["name"] for job in jobs], ["jb-1"])
+        jobs = informer.list("analitico.ai/item-id in (rx_1,rx_2),analitico.ai/job-action!=build")["items"]
+        self.assertEqual([job["metadata"]["name"] for job in jobs], ["jb-3"])
+        jobs = informer.list(sort_by=".metadata.name")["items"]
+        self.assertEqual([job["metadata"]["name"] for job in jobs], ["jb-1", "jb-3"])
+
+        # results are copies of the cached resources
+        informer.get("jb-1")["metadata"]["name"] = "changed"
+        self.assertEqual(informer.get("jb-1")["metadata"]["name"], "jb-1")
+        self.assertEqual(informer.get_stats()["items"], 2)
+
+    def test_k8client_informer_kubectl_facade(self):
+        """ api.k8.kubectl reads from a fresh informer and writes through to it """
+        set_k8_client(self.client)
+        self.client.apply(get_job("jb-1"))
+        informer = K8Informer(self.client, "job", "cloud")
+        informer.sync()
+        informer._thread = True  # keep it from being started
+        set_informer(informer)
+
+        requests = len(self.server.requests)
+        jobs, _ = api.k8.kubectl("cloud", "get", "job", args=["--selector", "analitico.ai/item-id=rx_1"])
+        self.assertEqual([job["metadata"]["name"] for job in jobs["items"]], ["jb-1"])
+        self.assertEqual(api.k8.kubectl("cloud", "get", "job/jb-1")[0]["metadata"]["name"], "jb-1")
+        self.assertEqual(len(self.server.requests), requests)
+        self.assertEqual(informer.get_stats()["hits"], 2)
+
+        # resources written with kubectl can be read back right away
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".yaml") as f:
+            f.write(yaml.safe_dump(get_job("jb-2")))
+            f.flush()
+            api.k8.kubectl("cloud", "apply", None, args=["--filename", f.name])
+        self.assertEqual(api.k8.kubectl("cloud", "get", "job/jb-2")[0]["metadata"]["name"], "jb-2")
+        api.k8.kubectl("cloud", "delete", "job/jb-2")
+        with self.assertRaises(AnaliticoException) as context:
+            api.k8.kubectl("cloud", "get", "job/jb-2")
+        self.assertEqual(context.exception.status_code, 404)
+        self.assertEqual(informer.get_stats()["misses"], 1)
+
+        # resources created elsewhere whose watch event has not arrived yet are read from the API server
+        self.client.apply(get_job("jb-3"))
+        self.assertEqual(api.k8.kubectl("cloud", "get", "job/jb-3")[0]["metadata"]["name"], "jb-3")
+        self.assertEqual(informer.get_stats()["misses"], 2)
+
+        # stale caches are not used
+        informer.contacted_on = 0
+        self.assertEqual(len(api.k8.kubectl("cloud", "get", "jobs")[0]["items"]), 2)
+        self.assertEqual(informer.get_stats()["misses"], 3)
+
+    def test_k8client_informer_kservice(self):
+        """ Knative services are cached apart from core services with the same name """
+        set_k8_client(self.client)
+        metadata = {"name": "api-staging", "namespace": "cloud"}
+        self.client.apply(
+            {"apiVersion": "v1", "kind": "Service", "metadata": metadata, "spec": {"type": "ExternalName"}}
+        )
+        self.client.apply(
+            {
+                "apiVersion": "serving.knative.dev/v1",
+                "kind": "Service",
+                "metadata": metadata,
+                "status": {"url": "https://api-staging.cloud.analitico.ai"},
+            }
+        )
+        informer = K8Informer(self.client, "ksvc", "cloud")
+        informer.sync()
+        self.assertEqual(informer.get("api-staging")["apiVersion"], "serving.knative.dev/v1")
+        self.assertEqual(len(informer.list()["items"]), 1)
+        informer._thread = True  # keep it from being started
+        set_informer(informer)
+
+        ksvc, _ = api.k8.kubectl("cloud", "get", "ksvc/api-staging")
+        self.assertEqual(ksvc["status"]["url"], "https://api-staging.cloud.analitico.ai")
+        self.assertEqual(informer.get_stats()["hits"], 1)
+        self.assertEqual(api.k8.kubectl("cloud", "get", "service/api-staging")[0]["apiVersion"], "v1")
+        self.assertEqual(informer.get_stats()["hits"], 1)
+
+        # only known namespaces are cached
+        self.assertIs(get_informer("ksvc", "cloud", start=False), informer)
+        self.assertIsNone(get_informer("ksvc", "made-up", start=False))
+        self.assertIsNone(get_informer("service", "cloud", start=False))
+
+    def test_k8client_customize_and_apply_all(self):
+        """ Templates are parsed once and their resources applied in a single batch """
+        set_k8_client(self.client)
+        configs = {
+            "service_namespace": "cloud",
+            "workspace_id": "ws_1",
+            "workspace_id_slug": "ws-1",
+            "volume_username": "dXNlcg==",
+            "volume_password": "cGFzcw==",
+            "volume_network_path": "//drive/user",
+            "job_id": "jb_1",
+            "job_id_slug": "jb-1",
+            "job_action": "run",
+            "notification_url": "https://analitico.ai/api/notifications/webhook",
+            "item_id": "rx_1",
+            "item_type": "recipe",
+            "notebook_name": "notebook.ipynb",
+            "blessed_model_id": "",
+            "run_image": "analitico-client:latest",
+            "run_command": ["python3", "./tasks/job.py", "$ANALITICO_DRIVE/recipes/rx_1/notebook.ipynb"],
+            "env_vars": [{"name": "TITLE", "value": "key: value\n- item"}],
+            "cpu_request": "500m",
+            "memory_request": "4Gi",
+            "cpu_limit": "2",
+            "memory_limit": "8Gi",
+        }
+        secret_template = os.path.join(api.k8.TEMPLATE_DIR, "drive-secret-template.yaml")
+        job_template = os.path.join(api.k8.TEMPLATE_DIR, "job-run-template.yaml")
+        self.assertIs(k8_get_template(job_template), k8_get_template(job_template))
+
+        # values can't change the structure of the manifest
+        job = k8_render_template(job_template, **configs)[0]
+        container = job["spec"]["template"]["spec"]["containers"][0]
+        self.assertEqual(container["command"], configs["run_command"])
+        self.assertEqual(container["env"][-1], configs["env_vars"][0])
+        self.assertEqual(
+            job["spec"]["template"]["spec"]["volumes"][0]["flexVolume"]["secretRef"]["name"], "analitico-drive-ws-1"
+        )
+
+        requests = len(self.server.requests)
+        secret, job = api.k8.k8_customize_and_apply_all([secret_template, job_template], **configs)
+        self.assertEqual(secret["kind"], "Secret")
+        self.assertEqual(job["metadata"]["labels"]["analitico.ai/job-id"], "jb_1")
+        self.assertEqual([request[0] for request in self.server.requests[requests:]], ["PATCH", "PATCH"])
+
+        with self.assertRaises(AnaliticoException):
+            k8_render_template(job_template, job_id="jb_2")
+
+    def test_k8client_scale_to_zero(self):
+        """ Metrics of all the services are retrieved with one query each and idle services are scaled to zero """
+        set_k8_client(self.client)
+        for resource in get_jupyter("jupyter-1", "ws_1") + get_jupyter("jupyter-2", "ws_2"):
+            self.client.apply(resource)
+        for resource in get_jupyter("jupyter-3", "ws_3", enabled="false"):
+            self.client.apply(resource)
+        controllers = self.client.list("statefulset", "cloud")["items"]
+
+        responses = [
+            get_prometheus_response("pod", {"jupyter-1-0": 0.01, "jupyter-2-0": 0.5}),
+            get_prometheus_response("destination_service_name", {"jupyter-2": 1.2}),
+        ]
+        with mock.patch("api.k8.requests.post", side_effect=responses) as post:
+            self.assertEqual(api.k8.k8_scale_to_zero(controllers), (1, 0))
+        self.assertEqual(post.call_count, 2)
+        self.assertIn('pod=~"jupyter-1-0|jupyter-2-0"', post.call_args_list[0][1]["data"]["query"])
+
+        # only the idle service is scaled, disabled services are not evaluated
+        replicas = {
+            item["metadata"]["name"]: item["spec"]["replicas"] for item in self.client.list("sts", "cloud")["items"]
+        }
+        self.assertEqual(replicas, {"jupyter-1": 0, "jupyter-2": 1, "jupyter-3": 1})
+
+        stats = api.k8.k8_scale_to_zero_get_stats()["last_pass"]
+        self.assertEqual(stats["candidates"], 2)
+        self.assertEqual((stats["scaled"], stats["kept"], stats["errors"], stats["queries"]), (1, 1, 0, 2))
+
+        # services are kept when Prometheus can't be reached
+        controllers = self.client.list("statefulset", "cloud")["items"]
+        with mock.patch("api.k8.requests.post", return_value=mock.Mock(status_code=503, text="unavailable")):
+            self.assertEqual(api.k8.k8_scale_to_zero(controllers), (0, 0))
+        self.assertEqual(api.k8.k8_scale_to_zero_get_stats()["last_pass"]["kept"], 1)
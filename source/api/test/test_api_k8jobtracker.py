@@ -0,0 +1,205 @@
+import pytest
+
+from unittest import mock
+
+from analitico import AnaliticoException
+from analitico.status import STATUS_RUNNING, STATUS_COMPLETED, STATUS_FAILED, STATUS_CANCELED
+from api.models import Job
+from api.k8client import K8Client
+from api.k8informers import K8Informer
+from api.k8jobtracker import K8JobTracker, k8_job_get_state, k8_jobs_update, k8_jobs_notify, k8_jobs_notify_pending
+from .k8fake import K8FakeApiServer
+from .utils import AnaliticoApiTestCase
+
+# pylint: disable=no-member
+
+
+def get_job(job_id: str, workspace_id: str, action: str = "run") -> dict:
+    return {
+        "apiVersion": "batch/v1",
+        "kind": "Job",
+        "metadata": {
+            "name": job_id.replace("_", "-"),
+            "namespace": "cloud",
+            "labels": {
+                "analitico.ai/workspace-id": workspace_id,
+                "analitico.ai/item-id": "rx_1",
+                "analitico.ai/job-action": action,
+                "analitico.ai/job-id": job_id,
+            },
+        },
+        "status": {"startTime": "2019-10-01T10:00:00Z", "active": 1},
+    }
+
+
+def get_pod(job_name: str, reason: str, exit_code: int) -> dict:
+    return {
+        "apiVersion": "v1",
+        "kind": "Pod",
+        "metadata": {"name": job_name + "-x1", "namespace": "cloud", "labels": {"job-name": job_name}},
+        "status": {
+            "phase": "Failed",
+            "containerStatuses": [{"state": {"terminated": {"reason": reason, "exitCode": exit_code}}}],
+        },
+    }
+
+
+@pytest.mark.django_db
+class K8JobTrackerTests(AnaliticoApiTestCase):
+    """ Test tracking of Kubernetes jobs into api.models.Job """
+
+    def setUp(self):
+        self.setup_basics()
+        self.server = K8FakeApiServer()
+        self.client = K8Client(api_server=self.server)
+
+    def test_k8jobtracker_job_state(self):
+        job = get_job("jb_1", self.ws1.id)
+        self.assertEqual(k8_job_get_state(job)["status"], STATUS_RUNNING)
+        self.assertEqual(k8_job_get_state(job, deleted=True)["status"], STATUS_CANCELED)
+
+        job["status"] = {
+            "startTime": "2019-10-01T10:00:00Z",
+            "failed": 1,
+            "conditions": [
+                {
+                    "type": "Failed",
+                    "status": "True",
+                    "reason": "BackoffLimitExceeded",
+                    "lastTransitionTime": "2019-10-01T10:01:30Z",
+                }
+            ],
+        }
+        state = k8_job_get_state(job)
+        self.assertEqual(state["status"], STATUS_FAILED)
+        self.assertEqual(state["duration"], 90)
+        self.assertEqual(state["exit_reason"], "BackoffLimitExceeded")
+
+        # reason the container was killed is more specific than the job's
+        state = k8_job_get_state(job, [get_pod("jb-1", "OOMKilled", 137)])
+        self.assertEqual(state["exit_reason"], "OOMKilled")
+        self.assertEqual(state["exit_code"], 137)
+
+    def test_k8jobtracker_updates_and_notifies_once(self):
+        Job(id="jb_1", workspace=self.ws1, item_id="rx_1", action="run", status=STATUS_RUNNING).save()
+        self.client.apply(get_job("jb_1", self.ws1.id))
+        self.client.apply(get_job("jb_2", self.ws1.id))
+
+        jobs = K8Informer(self.client, "job", "cloud")
+        pods = K8Informer(self.client, "pod", "cloud")
+        tracker = K8JobTracker(jobs, pods)
+        jobs.sync()
+        pods.sync()
+
+        with mock.patch("api.notifications.notify_job") as notify_job:
+            # jobs that were not tracked are created with their current status
+            self.assertEqual(tracker.flush(), [])
+            self.assertEqual(Job.objects.get(pk="jb_2").status, STATUS_RUNNING)
+
+            # job is oom killed
+            self.client.apply(get_pod("jb-1", "OOMKilled", 137))
+            self.client.patch(
+                "job",
+                "jb-1",
+                {
+                    "status": {
+                        "active": None,
+                        "failed": 1,
+                        "conditions": [
+                            {"type": "Failed", "status": "True", "lastTransitionTime": "2019-10-01T10:02:00Z"}
+                        ],
+                    }
+                },
+                "cloud",
+            )
+            jobs.watch()
+            pods.watch()
+            transitions = tracker.flush()
+            self.assertEqual([(job.id, previous) for job, previous in transitions], [("jb_1", STATUS_RUNNING)])
+            self.assertEqual(notify_job.call_count, 1)
+
+            job = Job.objects.get(pk="jb_1")
+            self.assertEqual(job.status, STATUS_FAILED)
+            self.assertEqual(job.get_attribute("duration"), 120)
+            self.assertEqual(job.get_attribute("exit_reason"), "OOMKilled")
+
+            # the same transition seen again, eg. by the webhook or after a resync, is not notified
+            jobs.sync()
+            self.assertEqual(tracker.flush(), [])
+            state = k8_job_get_state(jobs.get("jb-1"))
+            self.assertEqual(k8_jobs_update({"jb_1": state}, create_status=STATUS_RUNNING), [])
+            self.assertEqual(notify_job.call_count, 1)
+
+            # deleting a job that is still running cancels it
+            self.client.delete("job", "jb-2", "cloud")
+            jobs.watch()
+            tracker.flush()
+            self.assertEqual(Job.objects.get(pk="jb_2").status, STATUS_CANCELED)
+            self.assertEqual(notify_job.call_count, 1)
+
+            # a completed job is notified
+            Job(id="jb_3", workspace=self.ws1, item_id="rx_1", action="run", status=STATUS_RUNNING).save()
+            job = get_job("jb_3", self.ws1.id)
+            job["status"] = {
+                "startTime": "2019-10-01T10:00:00Z",
+                "completionTime": "2019-10-01T10:00:05Z",
+                "succeeded": 1,
+            }
+            self.client.apply(job)
+            jobs.watch()
+            tracker.flush()
+            self.assertEqual(Job.objects.get(pk="jb_3").status, STATUS_COMPLETED)
+            self.assertEqual(Job.objects.get(pk="jb_3").get_attribute("notified_status"), STATUS_COMPLETED)
+            self.assertEqual(notify_job.call_count, 2)
+
+    def test_k8jobtracker_retries_notifications(self):
+        Job(id="jb_1", workspace=self.ws1, item_id="rx_1", action="run", status=STATUS_RUNNING).save()
+        job = get_job("jb_1", self.ws1.id)
+        job["status"] = {"startTime": "2019-10-01T10:00:00Z", "completionTime": "2019-10-01T10:00:05Z", "succeeded": 1}
+
+        with mock.patch("api.notifications.notify_job", side_effect=Exception("slack is down")) as notify_job:
+            transitions = k8_jobs_update({"jb_1": k8_job_get_state(job)})
+            self.assertEqual(k8_jobs_notify([job.id for job, _ in transitions]), [])
+            self.assertEqual(notify_job.call_count, 1)
+
+        # the transition was saved with the status and stays pending until it is sent
+        job = Job.objects.get(pk="jb_1")
+        self.assertEqual(job.status, STATUS_COMPLETED)
+        self.assertEqual(job.get_attribute("notify_status"), STATUS_COMPLETED)
+        self.assertEqual(job.get_attribute("notify_attempts"), 1)
+
+        with mock.patch("api.notifications.notify_job", return_value={}) as notify_job:
+            self.assertEqual(len(k8_jobs_notify_pending()), 1)
+            self.assertEqual(len(k8_jobs_notify_pending()), 0)
+            self.assertEqual(k8_jobs_notify(["jb_1"]), [])
+            self.assertEqual(notify_job.call_count, 1)
+
+        job = Job.objects.get(pk="jb_1")
+        self.assertIsNone(job.get_attribute("notify_status"))
+        self.assertIsNone(job.get_attribute("notify_attempts"))
+        self.assertEqual(job.get_attribute("notified_status"), STATUS_COMPLETED)
+
+    def test_k8jobtracker_writes_jobs_only_while_leader(self):
+        jobs = K8Informer(self.client, "job", "cloud")
+        leader = mock.Mock(return_value=False)
+        tracker = K8JobTracker(jobs, leader=leader)
+        self.assertFalse(tracker.check_leader())
+        self.assertFalse(tracker.get_stats()["leader"])
+
+        # the lease is renewed every third of its duration
+        leader.return_value = True
+        self.assertFalse(tracker.check_leader())
+        self.assertEqual(leader.call_count, 1)
+        with mock.patch("api.k8jobtracker.K8_JOB_TRACKER_LEASE_SECONDS", -1):
+            self.assertTrue(tracker.check_leader())
+            self.assertEqual(leader.call_count, 2)
+
+            # a tracker that can't renew its lease stops writing jobs as another one may take over
+            leader.side_effect = AnaliticoException("the API server can't be reached")
+            self.assertFalse(tracker.check_leader())
+
+        # jobs are flushed only by the leader
+        stopped = mock.Mock(wait=mock.Mock(side_effect=[False, True]))
+        with mock.patch.object(jobs, "start"), mock.patch.object(tracker, "flush") as flush:
+            tracker.run(stopped)
+        flush.assert_not_called()
@@ -1,5 +1,9 @@
 import io
 import os
+import gzip
+import types
+import threading
+import http.server
 import os.path
 import pytest
 import random
@@ -7,7 +11,7 @@ import string
 
 from PIL import Image
 from django.conf import settings
-from django.test import TestCase, tag
+from django.test import TestCase, RequestFactory, tag
 from django.urls import reverse
 from django.http.response import StreamingHttpResponse
 from django.utils.dateparse import parse_datetime
@@ -34,10 +38,18 @@ import api
 import analitico
 import api.models
 import api.libcloud
+import api.storage
 from .utils import AnaliticoApiTestCase, NOTEBOOKS_PATH
+from api.views.filesviewsetmixin import UPLOADS_DIRECTORY
+from api.libcloud.utilities import clone_files, is_same_server
+from api.webdav.proxy import WebDavProxyMiddleware, PROXY_CHUNK_SIZE
 
 import libcloud
 import tempfile
+import requests
+import pandas as pd
+
+from unittest import mock
 
 # conflicts with django's dynamically generated model.objects
 # pylint: disable=no-member
@@ -48,6 +60,81 @@ ASSETS_PATH = os.path.dirname(os.path.realpath(__file__)) + "/assets/"
 UNICORN_FILENAME = "unicorns-do-it-better.png"
 
 
+class RangeSession:
+    """ Serves a file from memory like a WebDAV server, with HEAD, Range and If-Range """
+
+    def __init__(self, data: bytes, etag: str):
+        self.data, self.etag = data, etag
+        self.requests = []
+
+    def request(self, method, url, allow_redirects=False, headers=None, **kwargs):
+        headers = headers or {}
+        self.requests.append((method, headers.get("Range"), headers.get("If-Range")))
+        response = requests.models.Response()
+        response.status_code, body = 200, self.data
+        response.headers.update({"ETag": self.etag, "Accept-Ranges": "bytes", "Content-Length": str(len(self.data))})
+        if method == "HEAD":
+            body = b""
+        elif headers.get("Range") and headers.get("If-Range", self.etag) == self.etag:
+            start, _, end = headers["Range"][len("bytes=") :].partition("-")
+            start, end = int(start), min(int(end or len(self.data) - 1), len(self.data) - 1)
+            if start >= len(self.data):
+                response.status_code, body = 416, b""
+                response.headers["Content-Range"] = f"bytes */{len(self.data)}"
+            else:
+                response.status_code, body = 206, self.data[start : end + 1]
+                response.headers["Content-Range"] = f"bytes {start}-{end}/{len(self.data)}"
+        response.raw = io.BytesIO(body)
+        return response
+
+    def close(self):
+        pass
+
+
+class ProxiedRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ Storage box behind the WebDAV proxy, records the requests it receives and serves plain or gzipped files """
+
+    protocol_version = "HTTP/1.1"
+
+    # lowercase headers of the last request and sizes of the chunks of its body
+    headers = None
+    chunks = []
+    # set when the first chunk of a request body has been received
+    first_chunk = threading.Event()
+
+    def do_PUT(self):
+        ProxiedRequestHandler.headers = {key.lower(): value for key, value in self.headers.items()}
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            data = self.rfile.read(size)
+            self.rfile.readline()
+            if not size:
+                break
+            ProxiedRequestHandler.chunks.append(len(data))
+            ProxiedRequestHandler.first_chunk.set()
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        ProxiedRequestHandler.headers = {key.lower(): value for key, value in self.headers.items()}
+        body = b"unicorns do it better" * 100
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        if self.path.startswith("/gzip"):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Keep-Alive", "timeout=5")
+        self.send_header("Proxy-Authenticate", "Basic")
+        self.send_header("X-Storage", "box-1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
 @pytest.mark.django_db
 class WebdavTests(AnaliticoApiTestCase):
     def get_driver(self, item=None):
@@ -453,6 +540,75 @@ class WebdavTests(AnaliticoApiTestCase):
         self.assertTrue(isinstance(container, libcloud.storage.base.Container))
         self.assertEqual(container.name, "/")
 
+    def test_webdav_driver_ls_cache(self):
+        """ Listings are cached and invalidated when the driver changes the directory. """
+        driver = self.get_driver()
+
+        dir_name = self.get_random_path() + "/"
+        driver.mkdirs(dir_name + "sub1/")
+        driver.upload(io.BytesIO(b"one"), dir_name + "file1.txt")
+
+        ls1 = driver.ls(dir_name)
+        self.assertEqual(len(ls1), 3)
+        self.assertIn((dir_name, "1"), driver.ls_cache.keys())
+        # files listed with their directory are cached too
+        self.assertIn((dir_name + "file1.txt", "1"), driver.ls_cache.keys())
+
+        # cached items are copies that callers can modify
+        ls1[1].meta_data = {"title": "changed"}
+        self.assertNotEqual(driver.ls(dir_name)[1].meta_data, {"title": "changed"})
+
+        # upload invalidates the listing of the parent directory
+        driver.upload(io.BytesIO(b"two"), dir_name + "sub1/file2.txt")
+        self.assertNotIn((dir_name, "1"), driver.ls_cache.keys())
+        ls2 = driver.ls(dir_name + "sub1/")
+        self.assertEqual(len(ls2), 2)
+
+        # delete invalidates the listing
+        driver.delete(dir_name + "sub1/file2.txt")
+        self.assertEqual(len(driver.ls(dir_name + "sub1/")), 1)
+
+        # a listing cached by a concurrent ls while the delete is in flight is invalidated once it completes
+        driver.upload(io.BytesIO(b"three"), dir_name + "sub1/file3.txt")
+        send = driver._send
+
+        def send_and_list(method, path, *args, **kwargs):
+            if method == "DELETE":
+                driver.ls(dir_name + "sub1/")
+            return send(method, path, *args, **kwargs)
+
+        driver._send = send_and_list
+        driver.delete(dir_name + "sub1/file3.txt")
+        driver._send = send
+        self.assertEqual(len(driver.ls(dir_name + "sub1/")), 1)
+
+        driver.rmdir(dir_name)
+
+    def test_webdav_driver_ls_many(self):
+        """ List a whole directory tree at once. """
+        driver = self.get_driver()
+
+        dir_name = self.get_random_path() + "/"
+        driver.mkdirs(dir_name + "sub1/sub2/")
+        driver.upload(io.BytesIO(b"one"), dir_name + "file1.txt")
+        driver.upload(io.BytesIO(b"two"), dir_name + "sub1/sub2/file2.txt")
+
+        items = driver.ls_many(dir_name)
+        names = [item.name for item in items]
+        self.assertEqual(names[0], dir_name)
+        self.assertIn(dir_name + "file1.txt", names)
+        self.assertIn(dir_name + "sub1/", names)
+        self.assertIn(dir_name + "sub1/sub2/", names)
+        self.assertIn(dir_name + "sub1/sub2/file2.txt", names)
+
+        # listings of the subtree are now cached and match regular listings
+        ls = driver.ls(dir_name + "sub1/sub2/")
+        self.assertEqual([item.name for item in ls], [dir_name + "sub1/sub2/", dir_name + "sub1/sub2/file2.txt"])
+        ls_uncached = driver.ls(dir_name + "sub1/sub2/", cache=False)
+        self.assertEqual([item.name for item in ls], [item.name for item in ls_uncached])
+
+        driver.rmdir(dir_name)
+
     def test_webdav_driver_mkdir(self):
         """ Make a directory. """
         driver = self.get_driver()
@@ -558,6 +714,151 @@ class WebdavTests(AnaliticoApiTestCase):
 
         driver.rmdir(dir_name)
 
+    def test_webdav_driver_download_range(self):
+        """ Download ranges of a file, resume a partial download, download in parallel. """
+        driver = self.get_driver()
+
+        dir_name = "/" + django.utils.crypto.get_random_string() + "/"
+        remote_path = dir_name + "file.data"
+        file_data = bytearray(os.urandom(3 * api.libcloud.webdavdrivers.DOWNLOAD_RANGE_SIZE_BYTES + 100))
+
+        driver.mkdirs(dir_name)
+        driver.upload(io.BytesIO(file_data), remote_path)
+
+        # ranges include both start and end bytes
+        self.assertEqual(driver.download_range(remote_path, 10, 19), file_data[10:20])
+        self.assertEqual(driver.download_range(remote_path, len(file_data) - 10), file_data[-10:])
+        remote_data = b"".join(driver.download_as_stream(remote_path, start=100, end=199))
+        self.assertEqual(remote_data, file_data[100:200])
+
+        with tempfile.NamedTemporaryFile() as f:
+            # resume a partial download
+            f.write(file_data[:1000])
+            f.flush()
+            driver.download(remote_path, f.name, resume=True)
+            with open(f.name, "rb") as f2:
+                self.assertEqual(f2.read(), file_data)
+
+        with tempfile.NamedTemporaryFile() as f:
+            # download ranges in parallel
+            driver.download(remote_path, f.name, threads=4)
+            with open(f.name, "rb") as f2:
+                self.assertEqual(f2.read(), file_data)
+
+        driver.rmdir(dir_name)
+
+    def get_range_driver(self, data: bytes, etag: str):
+        driver = api.libcloud.WebdavStorageDriver("https://webdav.analitico.ai", ls_cache_ttl=0)
+        driver.session = RangeSession(data, etag)
+        return driver
+
+    def test_webdav_driver_download_resume(self):
+        """ Downloads are resumed only if the remote file is the same version """
+        data = os.urandom(5000)
+        with tempfile.TemporaryDirectory() as directory:
+            local_path = os.path.join(directory, "file.bin")
+            driver = self.get_range_driver(data, '"v1"')
+            driver.download("/file.bin", local_path)
+            self.assertFalse(os.path.exists(local_path + api.libcloud.webdavdrivers.DOWNLOAD_RESUME_SUFFIX))
+
+            # interrupted download of the same version is resumed
+            with open(local_path, "r+b") as f:
+                f.truncate(1000)
+            with open(local_path + api.libcloud.webdavdrivers.DOWNLOAD_RESUME_SUFFIX, "w") as f:
+                f.write('"v1"')
+            driver.download("/file.bin", local_path, resume=True)
+            self.assertEqual(driver.session.requests[-1], ("GET", "bytes=1000-", '"v1"'))
+            with open(local_path, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+            # remote file changed since the download started, it is downloaded again
+            data = os.urandom(6000)
+            driver.session.data, driver.session.etag = data, '"v2"'
+            with open(local_path, "r+b") as f:
+                f.truncate(1000)
+            with open(local_path + api.libcloud.webdavdrivers.DOWNLOAD_RESUME_SUFFIX, "w") as f:
+                f.write('"v1"')
+            driver.download("/file.bin", local_path, resume=True)
+            with open(local_path, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+            # partial files without a known version are not resumed
+            with open(local_path, "r+b") as f:
+                f.truncate(1000)
+            driver.download("/file.bin", local_path, resume=True)
+            self.assertEqual(driver.session.requests[-1], ("GET", None, None))
+            with open(local_path, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+    def test_webdav_driver_download_resume_complete(self):
+        """ A range past the end of the remote file means the download is complete only if the sizes match """
+        data = os.urandom(5000)
+        with tempfile.TemporaryDirectory() as directory:
+            local_path = os.path.join(directory, "file.bin")
+            resume_path = local_path + api.libcloud.webdavdrivers.DOWNLOAD_RESUME_SUFFIX
+            driver = self.get_range_driver(data, '"v1"')
+
+            # local file is larger than the remote file
+            with open(local_path, "wb") as f:
+                f.write(data + b"garbage")
+            with open(resume_path, "w") as f:
+                f.write('"v1"')
+            driver.download("/file.bin", local_path, resume=True)
+            with open(local_path, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+            # local file is complete but was not marked as such
+            with open(resume_path, "w") as f:
+                f.write('"v1"')
+            sent = len(driver.session.requests)
+            driver.download("/file.bin", local_path, resume=True)
+            self.assertEqual([r[0] for r in driver.session.requests[sent:]], ["GET", "HEAD"])
+            self.assertFalse(os.path.exists(resume_path))
+            with open(local_path, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+    @mock.patch("api.libcloud.webdavdrivers.DOWNLOAD_RANGE_SIZE_BYTES", 1000)
+    @mock.patch("api.libcloud.webdavdrivers.DOWNLOAD_PARALLEL_MIN_SIZE_BYTES", 2000)
+    def test_webdav_driver_download_parallel_fallback(self):
+        """ A failed parallel download does not leave a full size file behind to be resumed """
+        data = os.urandom(5000)
+        with tempfile.TemporaryDirectory() as directory:
+            local_path = os.path.join(directory, "file.bin")
+            driver = self.get_range_driver(data, '"v1"')
+            driver.download("/file.bin", local_path, threads=4)
+            self.assertEqual(len([r for r in driver.session.requests if r[1]]), 5)
+            with open(local_path, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+            # remote file changes after the HEAD request so the ranges fail If-Range
+            data = os.urandom(5000)
+            session, request = driver.session, driver.session.request
+
+            def change_after_head(method, *args, **kwargs):
+                response = request(method, *args, **kwargs)
+                if method == "HEAD":
+                    session.data, session.etag = data, '"v2"'
+                return response
+
+            with mock.patch.object(session, "request", side_effect=change_after_head):
+                driver.download("/file.bin", local_path, resume=True, threads=4)
+            with open(local_path, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+            # connection drops while downloading a range
+            def drop_range(method, url, headers=None, **kwargs):
+                if headers and headers.get("Range") == "bytes=2000-2999":
+                    raise requests.exceptions.ConnectionError("Connection reset by peer")
+                return request(method, url, headers=headers, **kwargs)
+
+            with mock.patch.object(session, "request", side_effect=drop_range):
+                with self.assertRaises(requests.exceptions.ConnectionError):
+                    driver.download("/file.bin", local_path, resume=True, threads=4)
+            self.assertFalse(os.path.exists(local_path))
+            driver.download("/file.bin", local_path, resume=True)
+            with open(local_path, "rb") as f:
+                self.assertEqual(f.read(), data)
+
     def test_webdav_driver_move(self):
         """ Upload a file then change its name. """
         driver = self.get_driver()
@@ -582,6 +883,159 @@ class WebdavTests(AnaliticoApiTestCase):
 
         driver.delete(path1)
 
+    def test_webdav_driver_copy(self):
+        """ Copy a directory with its contents on the server. """
+        driver = self.get_driver()
+
+        path1 = self.get_random_path() + "/"
+        path2 = self.get_random_path() + "/"
+        driver.mkdirs(path1 + "sub1/")
+        driver.upload(io.BytesIO(b"Tell me something new"), path1 + "sub1/file.txt", metadata={"title": "New"})
+
+        driver.copy(path1, path2)
+        self.assertTrue(driver.exists(path1 + "sub1/file.txt"))
+        self.assertTrue(driver.exists(path2 + "sub1/file.txt"))
+        ls = driver.ls(path2 + "sub1/file.txt")
+        self.assertEqual(ls[0].meta_data["title"], "New")
+
+        driver.rmdir(path1)
+        driver.rmdir(path2)
+
+    def test_local_driver_upload_ls_download(self):
+        """ Local driver has the same behaviour as the WebDAV driver on a directory on disk """
+        with tempfile.TemporaryDirectory() as root, self.settings(LOCAL_STORAGE_ROOTS=[root]):
+            driver = api.storage.Storage.factory({"driver": "local", "url": root}).driver
+            self.assertIsInstance(driver, api.libcloud.LocalStorageDriver)
+
+            driver.mkdirs("/datasets/ds_1/")
+            driver.upload(iter([b"Tell me ", b"something new"]), "/datasets/ds_1/file.txt", metadata={"title": "New"})
+            self.assertEqual(driver.get_local_path("/datasets/ds_1/file.txt"), root + "/datasets/ds_1/file.txt")
+
+            ls = driver.ls("/datasets/ds_1/")
+            self.assertEqual(len(ls), 2)
+            self.assertIsInstance(ls[0], Container)
+            self.assertEqual(ls[1].name, "/datasets/ds_1/file.txt")
+            self.assertEqual(ls[1].size, 21)
+            self.assertEqual(ls[1].meta_data["title"], "New")
+            self.assertEqual(ls[1].container.name, "/datasets/ds_1/")
+
+            self.assertEqual(b"".join(driver.download_as_stream("/datasets/ds_1/file.txt")), b"Tell me something new")
+            self.assertEqual(driver.download_range("/datasets/ds_1/file.txt", 8, 16), b"something")
+
+            # paths cannot reach outside of the root directory
+            self.assertEqual(driver.get_local_path("/../../etc/passwd"), root + "/etc/passwd")
+            with self.assertRaises(api.libcloud.WebdavException):
+                driver.ls("/missing.txt")
+
+    def test_local_driver_cannot_leave_root(self):
+        """ Local storage is limited to the directories allowed by the server, symbolic links cannot leave them """
+        with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as outside:
+            with self.assertRaises(analitico.AnaliticoException):
+                api.storage.Storage.factory({"driver": "local", "url": root})
+            with self.settings(LOCAL_STORAGE_ROOTS=[root]):
+                with self.assertRaises(analitico.AnaliticoException):
+                    api.storage.Storage.factory({"driver": "local", "url": os.path.join(root, "..")})
+                driver = api.storage.Storage.factory({"driver": "local", "url": root}).driver
+
+            with open(os.path.join(outside, "secret.txt"), "w") as f:
+                f.write("secret")
+            os.symlink(outside, os.path.join(root, "link"))
+            os.symlink(os.path.join(outside, "secret.txt"), os.path.join(root, "secret.txt"))
+            for path in ("/link/secret.txt", "/secret.txt", "/link/"):
+                with self.assertRaises(api.libcloud.WebdavException):
+                    driver.download_range(path, 0)
+            with self.assertRaises(api.libcloud.WebdavException):
+                driver.upload(io.BytesIO(b"overwritten"), "/link/secret.txt")
+            with open(os.path.join(outside, "secret.txt")) as f:
+                self.assertEqual(f.read(), "secret")
+
+    def test_local_driver_move_copy_delete(self):
+        """ Metadata follows files when they are moved or copied on a local drive """
+        with tempfile.TemporaryDirectory() as root:
+            driver = api.libcloud.LocalStorageDriver(root)
+            driver.upload(io.BytesIO(b"Tell me something new"), "/file1.txt", metadata={"title": "New"})
+
+            driver.move("/file1.txt", "/file2.txt")
+            driver.copy("/file2.txt", "/file3.txt")
+            self.assertFalse(driver.exists("/file1.txt"))
+            for path in ("/file2.txt", "/file3.txt"):
+                self.assertEqual(driver.ls(path)[0].meta_data["title"], "New")
+
+            driver.set_metadata("/file3.txt", None)
+            self.assertEqual(driver.ls("/file3.txt")[0].meta_data, {})
+
+            driver.delete("/file2.txt")
+            driver.delete("/file3.txt")
+            self.assertFalse([item for item in driver.ls_many("/") if item.name.endswith(".txt")])
+
+    def test_local_driver_clone_files_merge(self):
+        """ Cloning on the same server merges with the files already in the clone """
+        with tempfile.TemporaryDirectory() as root:
+            driver = api.libcloud.LocalStorageDriver(root)
+            item = types.SimpleNamespace(id="ds_1", storage_base_path="/datasets/ds_1/")
+            clone = types.SimpleNamespace(id="ds_2", storage_base_path="/datasets/ds_2/")
+            driver.mkdirs("/datasets/ds_1/sub/")
+            driver.mkdirs("/datasets/ds_2/sub/")
+            driver.upload(io.BytesIO(b"new"), "/datasets/ds_1/file1.txt", metadata={"title": "New"})
+            driver.upload(io.BytesIO(b"item"), "/datasets/ds_1/sub/file2.txt")
+            driver.upload(io.BytesIO(b"old"), "/datasets/ds_2/file1.txt")
+            driver.upload(io.BytesIO(b"clone"), "/datasets/ds_2/sub/file3.txt")
+
+            clone_files(item, clone, item_driver=driver, clone_driver=driver)
+            files = {f.name for f in driver.ls_many("/datasets/ds_2/") if f.name.endswith(".txt")}
+            names = ("file1.txt", "sub/file2.txt", "sub/file3.txt")
+            self.assertEqual(files, {"/datasets/ds_2/" + name for name in names})
+            self.assertEqual(b"".join(driver.download_as_stream("/datasets/ds_2/file1.txt")), b"new")
+            self.assertEqual(driver.ls("/datasets/ds_2/file1.txt")[0].meta_data["title"], "New")
+
+            # a clone that has no files yet is copied at once
+            clone = types.SimpleNamespace(id="ds_3", storage_base_path="/datasets/ds_3/")
+            clone_files(item, clone, item_driver=driver, clone_driver=driver)
+            self.assertTrue(driver.exists("/datasets/ds_3/sub/file2.txt"))
+
+    def test_local_driver_clone_files_between_servers(self):
+        """ Files are streamed from one server to the other and merged with the files already in the clone """
+        with tempfile.TemporaryDirectory() as root1, tempfile.TemporaryDirectory() as root2:
+            driver1, driver2 = api.libcloud.LocalStorageDriver(root1), api.libcloud.LocalStorageDriver(root2)
+            self.assertFalse(is_same_server(driver1, driver2))
+            item = types.SimpleNamespace(id="ds_1", storage_base_path="/datasets/ds_1/")
+            clone = types.SimpleNamespace(id="ds_2", storage_base_path="/datasets/ds_2/")
+            driver1.mkdirs("/datasets/ds_1/sub/empty/")
+            driver1.upload(io.BytesIO(b"new"), "/datasets/ds_1/file1.txt", metadata={"title": "New"})
+            driver1.upload(io.BytesIO(b"item" * 1000), "/datasets/ds_1/sub/file2.txt")
+            driver2.mkdirs("/datasets/ds_2/")
+            driver2.upload(io.BytesIO(b"clone"), "/datasets/ds_2/file3.txt")
+
+            clone_files(item, clone, item_driver=driver1, clone_driver=driver2)
+            self.assertTrue(driver2.exists("/datasets/ds_2/sub/empty/"))
+            self.assertTrue(driver2.exists("/datasets/ds_2/file3.txt"))
+            self.assertEqual(b"".join(driver2.download_as_stream("/datasets/ds_2/sub/file2.txt")), b"item" * 1000)
+            self.assertEqual(driver2.ls("/datasets/ds_2/file1.txt")[0].meta_data["title"], "New")
+
+    def test_iterio_read_and_seek(self):
+        """ IterIO reads chunks of an iterator and spills them to a temporary file when seeking """
+        data = bytes(range(256)) * 100
+        stream = api.libcloud.IterIO(data[i : i + 1000] for i in range(0, len(data), 1000))
+        buffer = bytearray(2500)
+        self.assertEqual(stream.readinto(buffer), 2500)
+        self.assertEqual(buffer, data[:2500])
+        self.assertEqual(stream.tell(), 2500)
+
+        stream.seek(-5, io.SEEK_END)
+        self.assertEqual(stream.read(), data[-5:])
+        stream.seek(3000)
+        self.assertEqual(stream.read(5), data[3000:3005])
+        with self.assertRaises(io.UnsupportedOperation):
+            stream.seek(0)  # consumed before spilling
+        stream.close()
+
+        # parquet readers seek to the footer first
+        df1 = pd.DataFrame({"a": range(10000), "b": ["x"] * 10000})
+        with tempfile.NamedTemporaryFile(suffix=".parquet") as f:
+            df1.to_parquet(f.name)
+            df2 = pd.read_parquet(api.libcloud.open_iterator(iter(lambda: f.read(4096), b"")))
+        self.assertTrue(df1.equals(df2))
+
     ##
     ## StorageDriver methods
     ##
@@ -1225,6 +1679,79 @@ class WebdavTests(AnaliticoApiTestCase):
         response3 = self.client.delete(obj_url)
         self.assertEqual(response3.status_code, 204)  # no content
 
+    def test_webdav_files_api_upload_multipart(self):
+        item = api.models.Dataset(workspace=self.ws1)
+        item.save()
+
+        obj_name = "sub/tst_" + django.utils.crypto.get_random_string() + ".txt"
+        obj_parts = [b"This is part one. ", b"This is part two. ", b"This is part three."]
+        obj_url = reverse(f"api:{item.type}-files", args=(item.id, obj_name))
+
+        # start upload
+        response1 = self.client.post(obj_url + "?uploads=true")
+        self.assertEqual(response1.status_code, 201)
+        upload_id = response1.data["data"]["upload_id"]
+
+        # upload parts out of order, then check which parts were received
+        for part in (3, 1, 2):
+            url = obj_url + f"?upload_id={upload_id}&part={part}"
+            response2 = self.client.put(url, data=obj_parts[part - 1], content_type="application/octet-stream")
+            self.assertEqual(response2.status_code, 204)
+        response3 = self.client.get(obj_url + f"?upload_id={upload_id}")
+        self.assertEqual(response3.status_code, 200)
+        parts = sorted(response3.data["data"]["parts"], key=lambda p: p["part"])
+        self.assertEqual([p["part"] for p in parts], [1, 2, 3])
+        self.assertEqual([p["size"] for p in parts], [len(p) for p in obj_parts])
+
+        # completing with missing parts fails, completing with all parts assembles the file
+        response4 = self.client.post(obj_url + f"?upload_id={upload_id}&parts=4")
+        self.assertEqual(response4.status_code, 400)
+        response5 = self.client.post(obj_url + f"?upload_id={upload_id}&parts=3")
+        self.assertEqual(response5.status_code, 204)
+
+        response6 = self.client.get(obj_url)
+        self.assertEqual(b"".join(response6.streaming_content), b"".join(obj_parts))
+
+        # invalid upload ids are rejected
+        response7 = self.client.get(obj_url + "?upload_id=../../etc")
+        self.assertEqual(response7.status_code, 400)
+
+        response8 = self.client.delete(obj_url)
+        self.assertEqual(response8.status_code, 204)
+
+    def test_webdav_files_api_upload_multipart_hidden_and_expired(self):
+        item = api.models.Dataset(workspace=self.ws1)
+        item.save()
+
+        obj_url = reverse(f"api:{item.type}-files", args=(item.id, "large.csv"))
+        response1 = self.client.post(obj_url + "?uploads=true")
+        upload_id = response1.data["data"]["upload_id"]
+        url = obj_url + f"?upload_id={upload_id}&part=1"
+        response2 = self.client.put(url, data=b"id,name\n1,first\n", content_type="application/octet-stream")
+        self.assertEqual(response2.status_code, 204)
+
+        # parts are not listed with the item's files
+        root_url = reverse(f"api:{item.type}-files", args=(item.id, "")) + "?metadata=true"
+        response3 = self.client.get(root_url)
+        self.assertEqual(response3.status_code, 200)
+        self.assertFalse([f for f in response3.data if UPLOADS_DIRECTORY in f["id"]])
+
+        # large uploads are assembled by a job
+        job = {"metadata": {"labels": {"analitico.ai/job-id": "jb_1"}}}
+        with mock.patch("api.views.filesviewsetmixin.UPLOAD_ASSEMBLE_JOB_SIZE_MB", 0):
+            with mock.patch("api.views.filesviewsetmixin.k8_job_assemble_upload", return_value=job) as assemble:
+                response4 = self.client.post(obj_url + f"?upload_id={upload_id}&parts=1")
+        self.assertEqual(response4.status_code, 202)
+        self.assertEqual(response4.data["data"]["job_id"], "jb_1")
+        part_path = f"/datasets/{item.id}/.uploads/{upload_id}/part_000001"
+        self.assertEqual(assemble.call_args[0][2:], (f"/datasets/{item.id}/large.csv", [part_path]))
+
+        # abandoned uploads are removed when the next upload starts
+        with mock.patch("api.views.filesviewsetmixin.UPLOAD_EXPIRATION_DAYS", -1):
+            self.client.post(obj_url + "?uploads=true")
+        response5 = self.client.get(obj_url + f"?upload_id={upload_id}")
+        self.assertEqual(response5.status_code, 404)
+
     def test_webdav_files_api_list_directory_with_order(self):
         try:
             item = api.models.Dataset(workspace=self.ws1)
@@ -1338,6 +1865,78 @@ class WebdavTests(AnaliticoApiTestCase):
             if item:
                 item.delete()
 
+    ##
+    ## WebDAV proxy
+    ##
+
+    def start_proxied_server(self):
+        """ Starts a local storage box for the proxy and returns its url """
+        ProxiedRequestHandler.headers, ProxiedRequestHandler.chunks = None, []
+        ProxiedRequestHandler.first_chunk.clear()
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ProxiedRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    def test_webdav_proxy_put_streams_request_body(self):
+        """ Request bodies are forwarded chunked while they are received, without hop-by-hop headers """
+        url = self.start_proxied_server()
+        body = io.BytesIO(os.urandom(3 * PROXY_CHUNK_SIZE))
+        request = RequestFactory().put(
+            "/files/large.bin",
+            data=body.getvalue(),
+            content_type="application/octet-stream",
+            HTTP_X_CLIENT="finder",
+            HTTP_TE="trailers",
+            HTTP_UPGRADE="h2c",
+            HTTP_PROXY_AUTHORIZATION="Basic c2VjcmV0",
+        )
+        received_while_reading = []
+
+        def read(size):
+            # the storage box has the first chunk before the rest of the body is read
+            if body.tell() == 2 * PROXY_CHUNK_SIZE:
+                received_while_reading.append(ProxiedRequestHandler.first_chunk.wait(10))
+            return body.read(size)
+
+        request.read = read
+        response = WebDavProxyMiddleware(None).proxy_view(request, url + "/files/large.bin")
+        b"".join(response.streaming_content)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(received_while_reading, [True])
+        self.assertEqual(ProxiedRequestHandler.chunks, [PROXY_CHUNK_SIZE] * 3)
+
+        headers = ProxiedRequestHandler.headers
+        self.assertEqual(headers["transfer-encoding"], "chunked")
+        self.assertEqual(headers["x-client"], "finder")
+        self.assertNotIn("content-length", headers)
+        for header in ("te", "upgrade", "proxy-authorization"):
+            self.assertNotIn(header, headers)
+
+    def test_webdav_proxy_get_response_headers(self):
+        """ Responses are returned without hop-by-hop headers and with their length only when not encoded """
+        url = self.start_proxied_server()
+        expected = b"unicorns do it better" * 100
+        for path, encoded in (("/plain.txt", False), ("/gzip.txt", True)):
+            request = RequestFactory().get(path, HTTP_X_CLIENT="finder", HTTP_TE="trailers")
+            response = WebDavProxyMiddleware(None).proxy_view(request, url + path)
+            self.assertIsInstance(response, StreamingHttpResponse)
+            self.assertEqual(b"".join(response.streaming_content), expected)
+            self.assertEqual(ProxiedRequestHandler.headers["x-client"], "finder")
+            self.assertNotIn("te", ProxiedRequestHandler.headers)
+
+            self.assertEqual(response["Content-Type"], "text/plain")
+            self.assertEqual(response["X-Storage"], "box-1")
+            self.assertNotIn("Keep-Alive", response)
+            self.assertNotIn("Proxy-Authenticate", response)
+            # requests decodes the content so the encoded length cannot be forwarded
+            self.assertNotIn("Content-Encoding", response)
+            if encoded:
+                self.assertNotIn("Content-Length", response)
+            else:
+                self.assertEqual(response["Content-Length"], str(len(expected)))
+
     ##
     ## Avatar
     ## ./manage.py test api.test.test_api_webdav.WebdavTests --tag=avatar
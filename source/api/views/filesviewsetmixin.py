@@ -1,6 +1,7 @@
 # pylint: disable=no-member
 
 import os
+import re
 import pandas as pd
 import urllib
 import io
@@ -8,7 +9,7 @@ import time
 import dateutil.parser
 
 from pathlib import Path
-from django.http.response import StreamingHttpResponse
+from django.http.response import StreamingHttpResponse, FileResponse
 
 from rest_framework import status
 from rest_framework.response import Response
@@ -28,12 +29,13 @@ from analitico import (
     QUERY_PARAM,
 )
 from analitico.pandas import pd_read_csv
-from analitico.utilities import get_dict_dot
+from analitico.utilities import get_dict_dot, id_generator
 
 from api.models import Workspace
 from api.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, MIN_PAGE_SIZE, PAGE_PARAM, PAGE_SIZE_PARAM
 from api.utilities import get_query_parameter_as_bool, get_query_parameter_as_int, get_query_parameter
 from api.models import ItemMixin
+from api.k8 import k8_job_assemble_upload
 
 import libcloud
 import api.libcloud
@@ -45,6 +47,17 @@ import api.metadata
 # chunk size when streaming content
 CHUNK_SIZE = 1024 * 1024
 
+# parts of multipart uploads are stored in this directory of the item's storage until they are assembled
+UPLOADS_DIRECTORY = ".uploads/"
+UPLOAD_ID_RE = r"^[a-z0-9]{16,64}$"
+UPLOAD_PART_NAME = "part_{:06d}"
+
+# uploads larger than this are assembled by a job on the workspace's drive instead of by the request
+UPLOAD_ASSEMBLE_JOB_SIZE_MB = 256
+
+# uploads that have not received parts in this many days are removed when a new upload starts
+UPLOAD_EXPIRATION_DAYS = 7
+
 ##
 ## FilesSerializer
 ##
@@ -215,7 +228,7 @@ class FilesViewSetMixin:
         df = df.fillna("")  # replace NaN with empty string
 
         # add paging metadata
-        rows = rows if rows else int(metadata["total_records"])
+        rows = rows if rows is not None else int(metadata["total_records"])
         metadata[PAGE_PARAM] = page
         metadata["page_records"] = len(df)
         metadata[PAGE_SIZE_PARAM] = page_size
@@ -258,6 +271,8 @@ class FilesViewSetMixin:
                     else:
                         f.meta_data = metadata
 
+            # parts of multipart uploads are not listed
+            files = [f for f in files if "/" + UPLOADS_DIRECTORY not in f.name]
             for f in files:
                 f.name = f.name.replace(base_path[:-1], "")
 
@@ -338,8 +353,13 @@ class FilesViewSetMixin:
                 raise AnaliticoException(metadata_msg, status_code=status.HTTP_400_BAD_REQUEST)
 
             obj_ls = ls[0]
-            obj_stream = driver.download_as_stream(path)
-            response = StreamingHttpResponse(obj_stream, content_type=obj_ls.extra["content_type"])
+            local_path = driver.get_local_path(path)
+            if local_path:
+                # files on local or mounted drives are handed to the server which can send them with sendfile
+                response = FileResponse(open(local_path, "rb"), content_type=obj_ls.extra["content_type"])
+            else:
+                obj_stream = driver.download_as_stream(path)
+                response = StreamingHttpResponse(obj_stream, content_type=obj_ls.extra["content_type"])
             response["Last-Modified"] = obj_ls.extra["last_modified"]
             response["ETag"] = obj_ls.extra["etag"]
 
@@ -390,11 +410,12 @@ class FilesViewSetMixin:
         if request.method == "DELETE":
             try:
                 driver.delete(path)
-                try:
-                    # delete metadata if exists
-                    driver.delete(api.metadata.get_metadata_path(path))
-                except Exception:
-                    pass
+                # delete metadata and row offsets index if they exist
+                for extra_path in (api.metadata.get_metadata_path(path), api.metadata.get_index_path(path)):
+                    try:
+                        driver.delete(extra_path)
+                    except Exception:
+                        pass
             except api.libcloud.WebdavException as exc:
                 raise AnaliticoException(f"Can't delete {path}", status_code=exc.actual_code) from exc
             return Response(status=status.HTTP_204_NO_CONTENT)
@@ -403,6 +424,105 @@ class FilesViewSetMixin:
         msg = f"Method {request.method} on {request.path} is not implemented"
         raise AnaliticoException(msg, status_code=status.HTTP_400_BAD_REQUEST)
 
+    ##
+    ## ?uploads=true, ?upload_id=xxx - multipart uploads of large files
+    ##
+
+    def files_multipart_expire(self, driver, base_path):
+        """ Removes the uploads of the item that have not received parts in UPLOAD_EXPIRATION_DAYS """
+        expired_at = time.time() - UPLOAD_EXPIRATION_DAYS * 24 * 60 * 60
+        try:
+            for upload in driver.ls(base_path + UPLOADS_DIRECTORY, cache=False):
+                last_modified = upload.extra.get("last_modified") if upload.extra else None
+                if not upload.name.endswith(UPLOADS_DIRECTORY) and last_modified:
+                    if dateutil.parser.parse(last_modified).timestamp() < expired_at:
+                        driver.rmdir(upload.name, safe=True)
+        except api.libcloud.WebdavException:
+            pass  # no uploads yet, or removed by another request
+
+    def files_multipart(self, request, item, driver, path, base_path):
+        """
+        Large files can be uploaded in parts which are then assembled into the final file on the server:
+        - POST /files/path?uploads=true starts an upload and returns its upload_id
+        - PUT /files/path?upload_id=xxx&part=n uploads part n (starting from 1) as the raw request body,
+          parts can be uploaded in parallel and a part can be uploaded again if it failed
+        - GET /files/path?upload_id=xxx lists the parts received so far so an upload can be resumed
+        - POST /files/path?upload_id=xxx&parts=n assembles parts 1 to n into the file at path, uploads
+          larger than UPLOAD_ASSEMBLE_JOB_SIZE_MB are assembled by a job on the workspace's drive and
+          the request returns 202 with the job_id, the file is in place when the job completes
+        - DELETE /files/path?upload_id=xxx aborts the upload and removes its parts
+        Parts are kept in a hidden directory of the item which is not listed and uploads that are
+        abandoned are removed after UPLOAD_EXPIRATION_DAYS.
+        """
+        if request.method == "POST" and get_query_parameter_as_bool(request, "uploads", False):
+            self.files_multipart_expire(driver, base_path)
+            upload_id = id_generator(32)
+            driver.mkdirs(base_path + UPLOADS_DIRECTORY + upload_id + "/")
+            return Response({"data": {"upload_id": upload_id, "path": path}}, status=status.HTTP_201_CREATED)
+
+        upload_id = get_query_parameter(request, "upload_id")
+        if not upload_id or not re.match(UPLOAD_ID_RE, upload_id):
+            raise AnaliticoException("upload_id is not valid", status_code=status.HTTP_400_BAD_REQUEST)
+        upload_path = base_path + UPLOADS_DIRECTORY + upload_id + "/"
+        try:
+            if request.method == "PUT":
+                part = get_query_parameter_as_int(request, "part", 0)
+                if part < 1:
+                    raise AnaliticoException("part should be 1 or more", status_code=status.HTTP_400_BAD_REQUEST)
+                data = iter(lambda: request.read(size=CHUNK_SIZE), b"")
+                driver.upload(data, upload_path + UPLOAD_PART_NAME.format(part), metadata=None)
+                return Response(status=status.HTTP_204_NO_CONTENT)
+
+            if request.method == "GET":
+                parts = [
+                    {"part": int(obj.name[obj.name.rfind("_") + 1 :]), "size": obj.size}
+                    for obj in driver.ls(upload_path, cache=False)
+                    if isinstance(obj, Object)
+                ]
+                return Response({"data": {"upload_id": upload_id, "path": path, "parts": parts}})
+
+            if request.method == "POST":
+                parts_count = get_query_parameter_as_int(request, "parts", 0)
+                ls = driver.ls(upload_path, cache=False)
+                received = {obj.name: obj.size for obj in ls if isinstance(obj, Object)}
+                part_paths = [upload_path + UPLOAD_PART_NAME.format(part) for part in range(1, parts_count + 1)]
+                missing = [part_path for part_path in part_paths if part_path not in received]
+                if parts_count < 1 or missing:
+                    msg = f"Upload {upload_id} is missing parts: {missing}"
+                    raise AnaliticoException(msg, status_code=status.HTTP_400_BAD_REQUEST)
+
+                # large files are assembled on the drive mounted by a job
+                workspace = item if isinstance(item, Workspace) else item.workspace
+                size = sum(received[part_path] for part_path in part_paths)
+                if (
+                    size > UPLOAD_ASSEMBLE_JOB_SIZE_MB * 1024 * 1024
+                    and workspace.get_attribute("storage.driver") == "hetzner-webdav"
+                ):
+                    job = k8_job_assemble_upload(item, upload_path, path, part_paths)
+                    job_id = job["metadata"]["labels"]["analitico.ai/job-id"]
+                    data = {"upload_id": upload_id, "path": path, "job_id": job_id}
+                    return Response({"data": data}, status=status.HTTP_202_ACCEPTED)
+
+                # parts are streamed one after the other from storage into the final file
+                def _assemble():
+                    for part_path in part_paths:
+                        yield from driver.download_as_stream(part_path)
+
+                driver.mkdirs(path[: path.rfind("/") + 1])
+                driver.upload(_assemble(), path, metadata=None)
+                driver.rmdir(upload_path, safe=True)
+                return Response(status=status.HTTP_204_NO_CONTENT)
+
+            if request.method == "DELETE":
+                driver.rmdir(upload_path, safe=True)
+                return Response(status=status.HTTP_204_NO_CONTENT)
+
+        except api.libcloud.WebdavException as exc:
+            raise AnaliticoException(f"Upload {upload_id} failed", status_code=exc.actual_code) from exc
+
+        msg = f"Method {request.method} on {request.path} is not implemented"
+        raise AnaliticoException(msg, status_code=status.HTTP_400_BAD_REQUEST)
+
     @permission_classes((IsAuthenticated,))
     @action(methods=["get", "post", "put", "delete"], detail=True, url_name="files", url_path="files/(?P<url>.*)")
     def files(self, request, pk, url) -> Response:
@@ -436,6 +556,10 @@ class FilesViewSetMixin:
         if records:
             return self.files_records(request, pk, item, url, driver, base_path)
 
+        # multipart upload of a large file?
+        if get_query_parameter(request, "upload_id") or get_query_parameter_as_bool(request, "uploads", False):
+            return self.files_multipart(request, item, driver, url, base_path)
+
         # operations on raw files (uploading, downloading, deleting, etc)
         return self.files_raw(request, pk, driver, url)
 
@@ -8,6 +8,8 @@ from rest_framework import status
 import analitico.utilities
 from api.views.k8viewsetmixin import get_namespace, get_kubectl_response, K8ViewSetMixin
 import api.utilities
+import api.k8informers
+import api.k8
 
 from analitico import AnaliticoException, logger
 
@@ -24,5 +26,26 @@ class K8ViewSet(GenericViewSet):
         """ Returns a list of nodes in the cluster. """
         service_namespace = get_namespace(request)
         return get_kubectl_response(
-            "kubectl", "get", "nodes", "-n", service_namespace, "-o", "json", "--sort-by", ".metadata.creationTimestamp"
+            service_namespace, "get", "nodes", args=["--sort-by", ".metadata.creationTimestamp"]
         )
+
+    @action(
+        methods=["get"], detail=False, url_name="informers", url_path="informers", permission_classes=(IsAdminUser,)
+    )
+    def informers(self, request):
+        """ Returns the state of the caches used to read jobs, services, statefulsets and pods. """
+        return Response({"data": api.k8informers.get_informers_stats()})
+
+    @action(
+        methods=["get"],
+        detail=False,
+        url_name="scale-to-zero",
+        url_path="scale-to-zero",
+        permission_classes=(IsAdminUser,),
+    )
+    def scale_to_zero(self, request):
+        """
+        Returns the number of scale to zero passes and the decisions and latency of the last one.
+        Stats are shared by the workers of a pod but each replica of the server reports its own passes.
+        """
+        return Response({"data": api.k8.k8_scale_to_zero_get_stats()})
@@ -30,9 +30,9 @@ def get_namespace(request) -> str:
     return api.utilities.get_query_parameter(request, "namespace", api.k8.K8_DEFAULT_NAMESPACE)
 
 
-def get_kubectl_response(*args):
-    """ Runs kubectl command, returns result as json """
-    stdout, _ = analitico.utilities.subprocess_run(args)
+def get_kubectl_response(*args, **kwargs):
+    """ Runs kubectl command, returns result as json, see api.k8.kubectl """
+    stdout, _ = kubectl(*args, **kwargs)
     return Response(stdout, content_type="application/json")
 
 
@@ -64,7 +64,7 @@ class K8ViewSetMixin:
         """ Return given kubernetes service. The primary key can be the service name or an item that was deployed to a service. """
         service_name, service_namespace = self.get_service_name(request, pk, stage)
         # kubectl get ksvc {service_name} -n {service_namespace} -o json
-        return get_kubectl_response("kubectl", "get", "ksvc", service_name, "-n", service_namespace, "-o", "json")
+        return get_kubectl_response(service_namespace, "get", "ksvc/" + service_name)
 
     @action(
         methods=["get"], detail=True, url_name="k8-revisions", url_path=r"k8s/revisions/(?P<stage>staging|production)$"
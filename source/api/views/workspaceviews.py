@@ -8,7 +8,7 @@ from django.db import transaction
 from django.core.exceptions import ObjectDoesNotExist
 from django.views.decorators.csrf import csrf_exempt
 
-from rest_framework import serializers
+from rest_framework import serializers, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
@@ -16,6 +16,7 @@ import api.models
 import api.utilities
 import api.notifications
 
+from analitico import AnaliticoException
 from analitico.utilities import logger, get_dict_dot, comma_separated_to_array, array_to_comma_separated, set_dict_dot
 from api.models import Workspace, Dataset, Role, User
 from api.permissions import has_item_permission, has_item_permission_or_exception
@@ -71,6 +72,24 @@ class WorkspaceSerializer(AttributeSerializerMixin, serializers.ModelSerializer)
 
         return data
 
+    def check_storage(self, attributes: dict, workspace: Workspace = None):
+        """
+        Storage settings decide which files the workspace can read and write on the server so they
+        cannot be changed through the api except by admins. Storage on the server's own filesystem,
+        local or mounted, can only be configured on the server.
+        """
+        if not attributes or "storage" not in attributes:
+            return
+        storage = attributes["storage"]
+        if workspace and storage == workspace.get_attribute("storage"):
+            return  # unchanged, eg. the whole workspace is saved back
+        if get_dict_dot(storage, "driver", "") in ("local", "mounted"):
+            message = "Local storage can only be configured on the server."
+            raise AnaliticoException(message, status_code=status.HTTP_403_FORBIDDEN)
+        if workspace and not self.context["request"].user.is_superuser:
+            message = "The storage of a workspace cannot be changed."
+            raise AnaliticoException(message, status_code=status.HTTP_403_FORBIDDEN)
+
     def create(self, validated_data, *args, **kwargs):
         """ Creates a workspace and assigns it to the currently authenticated user and the requested group (if any) """
         groupname = get_dict_dot(validated_data, "group.name")
@@ -79,6 +98,7 @@ class WorkspaceSerializer(AttributeSerializerMixin, serializers.ModelSerializer)
         if "group" in validated_data:
             validated_data.pop("group")  # pop and check if user belongs to group
 
+        self.check_storage(validated_data.get("attributes"))
         workspace = Workspace(**validated_data)
         workspace.user = self.context["request"].user
 
@@ -111,6 +131,7 @@ class WorkspaceSerializer(AttributeSerializerMixin, serializers.ModelSerializer)
         if "description" in validated_data:
             instance.description = validated_data["description"]
         if "attributes" in validated_data:
+            self.check_storage(validated_data["attributes"], instance)
             for (key, value) in validated_data["attributes"].items():
                 # TODO we should consider validating attributes against a fixed schema
                 instance.set_attribute(key, value)
@@ -14,11 +14,11 @@
 
 # pylint: disable=no-member
 
-import requests
+import threading
 import urllib.parse
 
 from cacheout import Cache
-from django.http import HttpResponse, QueryDict, Http404
+from django.http import StreamingHttpResponse, QueryDict, Http404
 from django.core.exceptions import PermissionDenied
 
 import rest_framework.authentication
@@ -27,6 +27,7 @@ from rest_framework import status
 
 from analitico import AnaliticoException, logger
 from analitico.utilities import re_match_group, get_dict_dot
+from analitico.sdk import create_session
 
 import api.authentication
 from api.models import Workspace, User
@@ -48,6 +49,57 @@ STORAGE_URL_RE = r"(ws[-_].*)\.cloud\.analitico\.ai(:[0-9]+)?(.*)$"
 # https://cacheout.readthedocs.io/en/latest/cache.html#cacheout.cache.Cache.memoize
 cache = Cache(maxsize=1024, ttl=60)
 
+# requests and responses are streamed through the proxy in chunks of this size
+PROXY_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+# keep-alive connections kept open with each storage box
+PROXY_POOL_SIZE = 16
+
+# Certain headers should NOT be just tunneled through in either direction
+# http://www.w3.org/Protocols/rfc2616/rfc2616-sec13.html#sec13.5.1
+HOP_BY_HOP_HEADERS = set(
+    [
+        "connection",
+        "keep-alive",
+        "proxy-authenticate",
+        "proxy-authorization",
+        "te",
+        "trailers",
+        "transfer-encoding",
+        "upgrade",
+    ]
+)
+
+# sessions with a pool of connections to each storage box, keyed by scheme and host
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_proxy_session(url: str):
+    """ Returns a session with pooled connections to the storage box serving the given url """
+    parsed = urllib.parse.urlparse(url)
+    key = (parsed.scheme, parsed.netloc)
+    with _sessions_lock:
+        if key not in _sessions:
+            # request bodies are streamed and cannot be replayed, so calls are never retried
+            _sessions[key] = create_session(pool_size=PROXY_POOL_SIZE, retries=0)
+        return _sessions[key]
+
+
+def iter_request_body(request, chunk_size: int = PROXY_CHUNK_SIZE):
+    """ Returns an iterator over the body of the incoming request or None if the request has no body """
+    if not int(request.META.get("CONTENT_LENGTH") or 0) and "HTTP_TRANSFER_ENCODING" not in request.META:
+        return None
+    return iter(lambda: request.read(chunk_size), b"")
+
+
+def iter_response_content(response, chunk_size: int = PROXY_CHUNK_SIZE):
+    """ Yields the content of an upstream response, then releases its connection to the pool """
+    try:
+        yield from response.iter_content(chunk_size)
+    finally:
+        response.close()
+
 
 @cache.memoize()
 def get_webdav_credentials_or_exception(workspace_id: str, user: User, method: str):
@@ -104,7 +156,8 @@ class WebDavProxyMiddleware:
             if "headers" not in requests_args:
                 requests_args["headers"] = {}
             if "data" not in requests_args:
-                requests_args["data"] = request.body
+                # body is forwarded with chunked encoding while it is being received
+                requests_args["data"] = iter_request_body(request)
             if "params" not in requests_args:
                 requests_args["params"] = QueryDict("", mutable=True)
 
@@ -114,44 +167,29 @@ class WebDavProxyMiddleware:
             params.update(requests_args["params"])
 
             # If there's a content-length header from Django, it's probably in all-caps
-            # and requests might not notice it, so just remove it.
+            # and requests might not notice it, so just remove it. The body is streamed
+            # with its own transfer encoding.
             for key in list(headers.keys()):
-                if key.lower() == "content-length":
+                if key.lower() == "content-length" or key.lower() in HOP_BY_HOP_HEADERS:
                     del headers[key]
 
             requests_args["headers"] = headers
             requests_args["params"] = params
 
-            response = requests.request(request.method, url, **requests_args)
-            response_body = response.content
+            session = get_proxy_session(url)
+            response = session.request(request.method, url, stream=True, **requests_args)
             response_content_type = response.headers.get("Content-Type")
 
-            # logger.info(f"proxy, response body: {response_body}")
-            proxy_response = HttpResponse(
-                response_body, status=response.status_code, content_type=response_content_type
+            # response is streamed back as it is received from the storage box
+            proxy_response = StreamingHttpResponse(
+                iter_response_content(response), status=response.status_code, content_type=response_content_type
             )
 
-            # Hop-by-hop headers
-            excluded_headers = set(
-                [
-                    # Certain response headers should NOT be just tunneled through
-                    # http://www.w3.org/Protocols/rfc2616/rfc2616-sec13.html#sec13.5.1
-                    "connection",
-                    "keep-alive",
-                    "proxy-authenticate",
-                    "proxy-authorization",
-                    "te",
-                    "trailers",
-                    "transfer-encoding",
-                    "upgrade",
-                    # Although content-encoding is not listed among the hop-by-hop headers,
-                    # it can cause trouble as well. Just let the server set the value as it should be.
-                    "content-encoding",
-                    # Since the remote server may or may not have sent the content in the
-                    # same encoding as Django will, let Django worry about what the length should be.
-                    "content-length",
-                ]
-            )
+            # Although content-encoding is not a hop-by-hop header, requests decodes the
+            # content, so the encoding and the length of the encoded content are not forwarded.
+            excluded_headers = HOP_BY_HOP_HEADERS | set(["content-encoding"])
+            if "content-encoding" in response.headers:
+                excluded_headers.add("content-length")
             for key, value in response.headers.items():
                 if key.lower() in excluded_headers:
                     continue
@@ -4,7 +4,11 @@ import os
 import json
 import collections
 import copy
+import threading
+import concurrent.futures
+import numpy as np
 
+from cacheout import Cache
 from ortools.constraint_solver import pywrapcp
 from ortools.constraint_solver import routing_enums_pb2
 from analitico.utilities import time_ms
@@ -16,8 +20,17 @@ from analitico.pandas import pd_drop_column
 from analitico import AnaliticoException
 from analitico.plugin import plugin
 from analitico.utilities import save_json
+from analitico.factory import Factory
+from analitico.registry import model_registry
 import s24.categories
 
+# distances between categories in a store are cached across orders, keyed by model, store and category pair
+# https://cacheout.readthedocs.io/en/latest/cache.html
+DISTANCES_CACHE_SIZE = 256 * 1024
+DISTANCES_CACHE_TTL = 60 * 60
+
+distances_cache = Cache(maxsize=DISTANCES_CACHE_SIZE, ttl=DISTANCES_CACHE_TTL)
+
 ##
 ## OrderSortingPlugin
 ##
@@ -229,58 +242,94 @@ class OrderSortingPlugin(analitico.plugin.CatBoostRegressorPlugin):
     ## Predicting
     ##
 
-    def create_distance_callback(self, sto_ref_id, sto_name, sto_area, sto_province, model, categories, meta):
-        """ Creates a callback used to calculate the distance in seconds between product categories in a supermarket """
-        _cache = {}
-
-        def _distance_callback(from_node, to_node):
-            if (from_node, to_node) in _cache:
-                return _cache[(from_node, to_node)]
-
-            started_on = time_ms()
-            test_df = pd.DataFrame(
+    def get_distance_features(self, sto_ref_id, sto_name, sto_area, sto_province, from_categories, to_categories):
+        """ Returns a dataframe with the features used to predict the distance between pairs of from, to categories """
+        rows = len(from_categories)
+        return pd.DataFrame(
+            collections.OrderedDict(
                 [
-                    collections.OrderedDict(
-                        [
-                            ("odt_status", "PURCHASED"),
-                            ("sto_ref_id", sto_ref_id),
-                            ("sto_name", sto_name),
-                            ("sto_area", sto_area),
-                            ("sto_province", sto_province),
-                            # from
-                            ("prev_odt_category_id", categories[from_node]["odt_category_id"]),
-                            ("prev_odt_category_id.level2", categories[from_node]["odt_category_id.level2"]),
-                            ("prev_odt_category_id.level3", categories[from_node]["odt_category_id.level3"]),
-                            # to
-                            ("odt_category_id", categories[to_node]["odt_category_id"]),
-                            ("odt_category_id.level2", categories[to_node]["odt_category_id.level2"]),
-                            ("odt_category_id.level3", categories[to_node]["odt_category_id.level3"]),
-                            # fixed for all items
-                            # TODO could use now date or order time date
-                            ("odt_variable_weight", 0),  # categories[to_node]["odt_variable_weight"],
-                            ("odt_replaceable", 0),
-                            ("odt_touched_at.year", 2019),
-                            ("odt_touched_at.month", 6),
-                            ("odt_touched_at.day", 6),
-                            ("odt_touched_at.hour", 12),
-                            ("odt_touched_at.dayofweek", 1),
-                        ]
-                    )
+                    ("odt_status", ["PURCHASED"] * rows),
+                    ("sto_ref_id", [sto_ref_id] * rows),
+                    ("sto_name", [sto_name] * rows),
+                    ("sto_area", [sto_area] * rows),
+                    ("sto_province", [sto_province] * rows),
+                    # from
+                    ("prev_odt_category_id", [c["odt_category_id"] for c in from_categories]),
+                    ("prev_odt_category_id.level2", [c["odt_category_id.level2"] for c in from_categories]),
+                    ("prev_odt_category_id.level3", [c["odt_category_id.level3"] for c in from_categories]),
+                    # to
+                    ("odt_category_id", [c["odt_category_id"] for c in to_categories]),
+                    ("odt_category_id.level2", [c["odt_category_id.level2"] for c in to_categories]),
+                    ("odt_category_id.level3", [c["odt_category_id.level3"] for c in to_categories]),
+                    # fixed for all items
+                    # TODO could use now date or order time date
+                    ("odt_variable_weight", [0] * rows),
+                    ("odt_replaceable", [0] * rows),
+                    ("odt_touched_at.year", [2019] * rows),
+                    ("odt_touched_at.month", [6] * rows),
+                    ("odt_touched_at.day", [6] * rows),
+                    ("odt_touched_at.hour", [12] * rows),
+                    ("odt_touched_at.dayofweek", [1] * rows),
                 ]
             )
+        )
 
-            # augment date information
-            # test_df = analitico.pandas.augment_dates(test_df, "odt_touched_at")
-
+    def create_distance_matrix(
+        self, sto_ref_id, sto_name, sto_area, sto_province, model, categories, meta, model_key=None
+    ):
+        """
+        Returns an n x n matrix (as a list of lists) with the distance in seconds between each pair of
+        categories in the order. Distances are predicted for each distinct pair of categories at once
+        with a single call to the model. Distances already predicted for the same store and model by
+        previous orders are taken from a cache shared across orders and are not predicted again.
+        """
+        # the same category may appear multiple times in an order, predict each distinct category once
+        category_ids = [category["odt_category_id"] for category in categories]
+        unique_ids = list(collections.OrderedDict.fromkeys(category_ids))
+        unique_categories = {category["odt_category_id"]: category for category in categories}
+        store_key = (model_key, sto_ref_id, sto_name, sto_area, sto_province)
+
+        distances, missing = {}, []
+        for from_id in unique_ids:
+            for to_id in unique_ids:
+                distance = distances_cache.get((store_key, from_id, to_id)) if model_key else None
+                if distance is None:
+                    missing.append((from_id, to_id))
+                else:
+                    distances[(from_id, to_id)] = distance
+        meta["cached_predictions"] = meta.get("cached_predictions", 0) + len(distances)
+
+        if missing:
+            started_on = time_ms()
+            test_df = self.get_distance_features(
+                sto_ref_id,
+                sto_name,
+                sto_area,
+                sto_province,
+                [unique_categories[from_id] for from_id, _ in missing],
+                [unique_categories[to_id] for _, to_id in missing],
+            )
             # use catboost model to guess distance between items in the supermarket
-            test_preds = model.predict(test_df)
-            test_distance = int(test_preds[0])
-            _cache[(from_node, to_node)] = test_distance
-
-            meta["predictions"] += 1
+            test_preds = np.asarray(model.predict(test_df)).astype(int)
+            for pair, distance in zip(missing, test_preds.tolist()):
+                distances[pair] = distance
+                if model_key:
+                    distances_cache.set((store_key,) + pair, distance)
+            meta["predictions"] += len(missing)
             meta["predictions_ms"] += time_ms(started_on)
-            # print('distance_callback(%d,%d): %d' % (from_node, to_node, test_distance))
-            return test_distance
+
+        return [[distances[(from_id, to_id)] for to_id in category_ids] for from_id in category_ids]
+
+    def create_distance_callback(
+        self, sto_ref_id, sto_name, sto_area, sto_province, model, categories, meta, model_key=None
+    ):
+        """ Creates a callback used to calculate the distance in seconds between product categories in a supermarket """
+        matrix = self.create_distance_matrix(
+            sto_ref_id, sto_name, sto_area, sto_province, model, categories, meta, model_key
+        )
+
+        def _distance_callback(from_node, to_node):
+            return matrix[from_node][to_node]
 
         return _distance_callback
 
@@ -292,8 +341,13 @@ class OrderSortingPlugin(analitico.plugin.CatBoostRegressorPlugin):
             return d[label2]
         return None
 
-    def predict_single(self, data, model, meta):
-        """ Sort a single order """
+    def get_model_key(self):
+        """ Returns a key that changes whenever the trained model is saved again, used to key cached distances """
+        model_path = os.path.join(self.factory.get_artifacts_directory(), "model.cbm")
+        return (model_path, os.stat(model_path).st_mtime_ns)
+
+    def predict_single(self, data, model, meta, model_key=None):
+        """ Sort a single order, returns a sorted copy of the order without modifying the original """
         sto_ref_id = self.getdata(data, "sto_ref_id", "store_ref_id")
         sto_name = self.getdata(data, "sto_name", "store_name")
         sto_area = self.getdata(data, "sto_area", "store_area")
@@ -302,6 +356,8 @@ class OrderSortingPlugin(analitico.plugin.CatBoostRegressorPlugin):
         # items in the basket, no point in sorting an order if it's only got an item in it
         details = data["details"]
         if len(details) < 2:
+            data = dict(data)
+            data["details"] = [dict(detail) for detail in details]
             return data
 
         # extract all the categories used in the order (with main, sub and 3rd level category)
@@ -356,11 +412,15 @@ class OrderSortingPlugin(analitico.plugin.CatBoostRegressorPlugin):
         search_parameters = pywrapcp.RoutingModel.DefaultSearchParameters()
         # pylint: disable=no-member
         search_parameters.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+        # a time limit on the search trades quality of the route for throughput
+        time_limit_ms = self.get_attribute("routing.time_limit_ms")
+        if time_limit_ms:
+            search_parameters.time_limit_ms = int(time_limit_ms)
 
         # the distance callback will estimate the distance in seconds between items of certain
         # categories using the pretrained model that includes store info and pickig info
         dist_callback = self.create_distance_callback(
-            sto_ref_id, sto_name, sto_area, sto_province, model, categories, meta
+            sto_ref_id, sto_name, sto_area, sto_province, model, categories, meta, model_key
         )
         routing.SetArcCostEvaluatorOfAllVehicles(dist_callback)
         assignment = routing.SolveWithParameters(search_parameters)
@@ -383,14 +443,14 @@ class OrderSortingPlugin(analitico.plugin.CatBoostRegressorPlugin):
                 # convert variable indices to node indices in the route
                 node = routing.IndexToNode(index)
                 category_id = categories[node]["odt_category_id"]
-                sorted_details.append(details[node - 1])
-                # enrich record with top level and subcategory information
-                details[node - 1]["odt_category_id"] = categories[node]["odt_category_id"]
-                details[node - 1]["odt_category_id.slug"] = categories[node]["odt_category_id.slug"]
-                details[node - 1]["odt_category_id.level2"] = categories[node]["odt_category_id.level2"]
-                details[node - 1]["odt_category_id.level2.slug"] = categories[node]["odt_category_id.level2.slug"]
-                details[node - 1]["odt_category_id.level3"] = categories[node]["odt_category_id.level3"]
-                details[node - 1]["odt_category_id.level3.slug"] = categories[node]["odt_category_id.level3.slug"]
+                # enrich a copy of the record with top level and subcategory information
+                detail = dict(details[node - 1])
+                detail["odt_category_id"] = categories[node]["odt_category_id"]
+                detail["odt_category_id.slug"] = categories[node]["odt_category_id.slug"]
+                detail["odt_category_id.level2"] = categories[node]["odt_category_id.level2"]
+                detail["odt_category_id.level2.slug"] = categories[node]["odt_category_id.level2.slug"]
+                detail["odt_category_id.level3"] = categories[node]["odt_category_id.level3"]
+                detail["odt_category_id.level3.slug"] = categories[node]["odt_category_id.level3.slug"]
                 self.info(
                     "%4d, %6d %s > %s > %s: %s",
                     index,
@@ -398,45 +458,82 @@ class OrderSortingPlugin(analitico.plugin.CatBoostRegressorPlugin):
                     s24.categories.s24_get_category_slug_level1(category_id),
                     s24.categories.s24_get_category_slug_level2(category_id),
                     s24.categories.s24_get_category_slug_level3(category_id),
-                    self.getdata(details[node - 1], "odt_name", "item_name"),
+                    self.getdata(detail, "odt_name", "item_name"),
                 )
+                sorted_details.append(detail)
             index = assignment.Value(routing.NextVar(index))
 
         # add original and sorted order picking time estimates
+        data = dict(data)
         data["unsorted_time_sec"] = unsorted_distance
         data["sorted_time_sec"] = assignment.ObjectiveValue()
         data["details"] = sorted_details
         return data
 
+    def get_worker_pool(self, training):
+        """
+        Returns a pool of worker processes used to sort orders in parallel. Each worker loads
+        the model once when it starts. The pool is kept between calls and is replaced when
+        the model, the number of workers or the plugin's configuration change.
+        """
+        global _worker_pool, _worker_pool_key
+        model_path = os.path.join(self.factory.get_artifacts_directory(), "model.cbm")
+        attributes = {key: value for key, value in self.attributes.items() if key != "factory"}
+        workers = int(self.get_attribute("routing.workers"))
+        pool_key = (workers, self.get_model_key(), json.dumps(attributes, sort_keys=True, default=str))
+        with _worker_pool_lock:
+            if _worker_pool_key != pool_key:
+                if _worker_pool:
+                    _worker_pool.shutdown(wait=False)
+                _worker_pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=_worker_initializer,
+                    initargs=(attributes, training, model_path, pool_key[1]),
+                )
+                _worker_pool_key = pool_key
+            return _worker_pool
+
     def predict(self, data, training, results, *args, **kwargs):
-        """ Takes an order with item details and sorts them so it's quicker to shop """
+        """
+        Takes a list of orders with item details and sorts them so they're quicker to shop.
+        If the plugin's "routing.workers" attribute is greater than one, orders are sorted
+        in parallel by a pool of worker processes. Sorted orders are returned in input order.
+        """
         try:
-            # create model object from stored file
             meta = results["performance"]
             started_on = time_ms()
 
-            model_path = os.path.join(self.factory.get_artifacts_directory(), "model.cbm")
-            if not os.path.isfile(model_path):
-                self.exception("CatBoostPlugin.predict - cannot find saved model in %s", model_path)
-
-            loading_on = time_ms()
-            model = self.create_model(training)
-            model.load_model(model_path)
-            meta["loading_ms"] = time_ms(loading_on)
-
             meta["items"] = 0
             meta["predictions"] = 0
             meta["predictions_ms"] = 0
+            meta["cached_predictions"] = 0
 
             results["records"] = []
             results["predictions"] = []
 
-            # handle a single record at a time
             for item in data:
                 results["records"].append(item)
                 meta["items"] += len(item["details"])
-                item = self.predict_single(copy.deepcopy(item), model, meta)
-                results["predictions"].append(item)
+
+            workers = self.get_attribute("routing.workers", 1)
+            if int(workers) > 1 and len(data) > 1:
+                # sort orders in parallel, each worker process has its own model and distances cache
+                pool = self.get_worker_pool(training)
+                for item, item_meta in pool.map(_worker_predict_single, data):
+                    results["predictions"].append(item)
+                    for key in ("predictions", "predictions_ms", "cached_predictions"):
+                        meta[key] += item_meta[key]
+            else:
+                # model is loaded once and then cached by the model registry
+                loading_on = time_ms()
+                model = self.load_model(training)
+                model_key = self.get_model_key()
+                meta["loading_ms"] = time_ms(loading_on)
+
+                # handle a single record at a time
+                for item in data:
+                    item = self.predict_single(item, model, meta, model_key)
+                    results["predictions"].append(item)
 
             meta["total_ms"] = time_ms(started_on)
             return results
@@ -445,6 +542,39 @@ class OrderSortingPlugin(analitico.plugin.CatBoostRegressorPlugin):
             raise exc
 
 
+##
+## Worker processes
+##
+
+_worker_pool = None
+_worker_pool_key = None
+_worker_pool_lock = threading.Lock()
+
+# plugin, model and model key used by the current worker process
+_worker_context = None
+
+
+def _worker_initializer(attributes, training, model_path, model_key):
+    """ Creates the plugin and loads the model once when a worker process starts """
+    global _worker_context
+    plugin = OrderSortingPlugin(factory=Factory(), **attributes)
+
+    def _load_model(path):
+        model = plugin.create_model(copy.deepcopy(training))
+        model.load_model(path)
+        return model
+
+    model = model_registry.get(model_path, _load_model)
+    _worker_context = (plugin, model, model_key)
+
+
+def _worker_predict_single(item):
+    """ Sorts a single order in a worker process, returns sorted order and performance counters """
+    plugin, model, model_key = _worker_context
+    meta = {"predictions": 0, "predictions_ms": 0, "cached_predictions": 0}
+    return plugin.predict_single(item, model, meta, model_key), meta
+
+
 ##
 ## UTILITIES
 ##
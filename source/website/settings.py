@@ -408,6 +408,14 @@ try:
         }
     }
 
+    ##
+    ## Local storage
+    ##
+
+    # directories on the server that can be used by workspaces with "local" storage, separated by ":"
+    # storage settings can only point to these directories, workspaces cannot configure them via the api
+    LOCAL_STORAGE_ROOTS = [root for root in os.environ.get("ANALITICO_LOCAL_STORAGE_ROOTS", "").split(":") if root]
+
     ##
     ## Prometheus service used for metrics on kubernetes cluster
     ##